@@ -85,9 +85,10 @@ async def login(request: web.Request) -> web.Response:
     if player.get('banned', False):
         return web.json_response({'error': 'This account has been banned'}, status=403)
 
-    # Update last login
-    player['last_login'] = __import__('datetime').datetime.now().timestamp()
-    await db.save_player(player)
+    async with db.entity_locks(players=[player['id']]):
+        # Update last login
+        player['last_login'] = __import__('datetime').datetime.now().timestamp()
+        await db.save_player(player)
 
     # Generate token
     token = auth.create_token(player['id'], username, is_guest=False)
@@ -204,13 +205,14 @@ async def convert_guest(request: web.Request) -> web.Response:
     if existing and existing['id'] != player_id:
         return web.json_response({'error': 'Username already taken'}, status=400)
 
-    # Update player
-    player['username'] = username
-    player['password_hash'] = auth.hash_password(password)
-    player['is_guest'] = False
-    player['profile']['name'] = username
+    async with db.entity_locks(players=[player_id]):
+        # Update player
+        player['username'] = username
+        player['password_hash'] = auth.hash_password(password)
+        player['is_guest'] = False
+        player['profile']['name'] = username
 
-    success = await db.save_player(player)
+        success = await db.save_player(player)
     if not success:
         return web.json_response({'error': 'Failed to convert account'}, status=500)
 
@@ -246,9 +248,10 @@ async def ban_player(request: web.Request) -> web.Response:
         return web.json_response({'error': 'Player not found'}, status=404)
 
     # Update ban status
-    player['banned'] = banned
     player_id = player['id']
-    success = await db.save_player(player)
+    async with db.entity_locks(players=[player_id]):
+        player['banned'] = banned
+        success = await db.save_player(player)
 
     if not success:
         return web.json_response({'error': 'Failed to update player'}, status=500)
@@ -346,65 +349,67 @@ async def update_player_data(request: web.Request) -> web.Response:
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
-    player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
-
-    # Update allowed fields
-    updates = data.get('updates', {})
-
-    # Stats updates
-    if 'trophies' in updates:
-        player.setdefault('stats', {})['trophies'] = max(0, int(updates['trophies']))
-    if 'medals' in updates:
-        player.setdefault('stats', {})['medals'] = max(0, int(updates['medals']))
-        player['stats']['medals_highest'] = max(player['stats'].get('medals_highest', 0), player['stats']['medals'])
-    if 'wins' in updates:
-        player.setdefault('stats', {})['wins'] = max(0, int(updates['wins']))
-    if 'losses' in updates:
-        player.setdefault('stats', {})['losses'] = max(0, int(updates['losses']))
-
-    # Resources updates
-    if 'gold' in updates:
-        player.setdefault('resources', {})['gold'] = max(0, int(updates['gold']))
-    if 'gems' in updates:
-        player.setdefault('resources', {})['gems'] = max(0, int(updates['gems']))
-    if 'crystals' in updates:
-        player.setdefault('resources', {})['crystals'] = max(0, int(updates['crystals']))
-    if 'star_points' in updates:
-        player.setdefault('resources', {})['star_points'] = max(0, int(updates['star_points']))
-    if 'royal_wild_cards' in updates:
-        player.setdefault('resources', {})['royal_wild_cards'] = max(0, int(updates['royal_wild_cards']))
-
-    # Cards updates
-    if 'unlocked' in updates:
-        player.setdefault('cards', {})['unlocked'] = updates['unlocked']
-    if 'levels' in updates:
-        player.setdefault('cards', {})['levels'] = updates['levels']
-    if 'shards' in updates:
-        player.setdefault('cards', {})['shards'] = updates['shards']
-
-    # Decks updates
-    if 'decks' in updates:
-        player['decks'] = updates['decks']
-    if 'current_deck' in updates:
-        player['current_deck'] = int(updates['current_deck'])
-
-    # Chests updates
-    if 'chests' in updates:
-        player['chests'] = updates['chests']
-
-    # Trophy road updates
-    if 'trophy_road_claimed' in updates:
-        player.setdefault('trophy_road', {})['claimed'] = updates['trophy_road_claimed']
-
-    # Cash and discount updates
-    if 'cash' in updates:
-        player.setdefault('resources', {})['cash'] = max(0, float(updates['cash']))
-    if 'discount' in updates:
-        player['discount'] = max(0, min(100, int(updates['discount'])))
-
-    success = await db.save_player(player)
+    # Locked like the API transactions, so a concurrent trade or transfer is neither lost nor rolled back
+    async with db.entity_locks(players=[player_id]):
+        player = await db.get_player(player_id)
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        # Update allowed fields
+        updates = data.get('updates', {})
+
+        # Stats updates
+        if 'trophies' in updates:
+            player.setdefault('stats', {})['trophies'] = max(0, int(updates['trophies']))
+        if 'medals' in updates:
+            player.setdefault('stats', {})['medals'] = max(0, int(updates['medals']))
+            player['stats']['medals_highest'] = max(player['stats'].get('medals_highest', 0), player['stats']['medals'])
+        if 'wins' in updates:
+            player.setdefault('stats', {})['wins'] = max(0, int(updates['wins']))
+        if 'losses' in updates:
+            player.setdefault('stats', {})['losses'] = max(0, int(updates['losses']))
+
+        # Resources updates
+        if 'gold' in updates:
+            player.setdefault('resources', {})['gold'] = max(0, int(updates['gold']))
+        if 'gems' in updates:
+            player.setdefault('resources', {})['gems'] = max(0, int(updates['gems']))
+        if 'crystals' in updates:
+            player.setdefault('resources', {})['crystals'] = max(0, int(updates['crystals']))
+        if 'star_points' in updates:
+            player.setdefault('resources', {})['star_points'] = max(0, int(updates['star_points']))
+        if 'royal_wild_cards' in updates:
+            player.setdefault('resources', {})['royal_wild_cards'] = max(0, int(updates['royal_wild_cards']))
+
+        # Cards updates
+        if 'unlocked' in updates:
+            player.setdefault('cards', {})['unlocked'] = updates['unlocked']
+        if 'levels' in updates:
+            player.setdefault('cards', {})['levels'] = updates['levels']
+        if 'shards' in updates:
+            player.setdefault('cards', {})['shards'] = updates['shards']
+
+        # Decks updates
+        if 'decks' in updates:
+            player['decks'] = updates['decks']
+        if 'current_deck' in updates:
+            player['current_deck'] = int(updates['current_deck'])
+
+        # Chests updates
+        if 'chests' in updates:
+            player['chests'] = updates['chests']
+
+        # Trophy road updates
+        if 'trophy_road_claimed' in updates:
+            player.setdefault('trophy_road', {})['claimed'] = updates['trophy_road_claimed']
+
+        # Cash and discount updates
+        if 'cash' in updates:
+            player.setdefault('resources', {})['cash'] = max(0, float(updates['cash']))
+        if 'discount' in updates:
+            player['discount'] = max(0, min(100, int(updates['discount'])))
+
+        success = await db.save_player(player)
     if not success:
         return web.json_response({'error': 'Failed to update player'}, status=500)
 
@@ -444,9 +449,10 @@ async def reset_password(request: web.Request) -> web.Response:
     if not player:
         return web.json_response({'error': 'Player not found'}, status=404)
 
-    # Update password
-    player['password_hash'] = auth.hash_password(new_password)
-    success = await db.save_player(player)
+    async with db.entity_locks(players=[player['id']]):
+        # Update password
+        player['password_hash'] = auth.hash_password(new_password)
+        success = await db.save_player(player)
 
     if not success:
         return web.json_response({'error': 'Failed to update password'}, status=500)
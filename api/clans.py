@@ -1,11 +1,15 @@
 """
 Clan API Endpoints
-Clan CRUD, membership, donations, chat
+Clan CRUD, membership, donations, chat, wars
 """
 
 from aiohttp import web
 from database import json_db as db
+from database import chat_store
 from services import auth_service as auth
+from services.clan_events import clan_events
+from services.clan_war_service import clan_wars, idle_war
+from websocket.manager import ws_manager
 
 routes = web.RouteTableDef()
 
@@ -18,14 +22,68 @@ def get_player_id_from_request(request: web.Request) -> str:
     return auth.get_player_id_from_token(token)
 
 
+def clan_response(clan) -> web.Response:
+    """Clan document with each member's online status"""
+    return web.json_response({'clan': clan.to_dict(online=ws_manager.is_online)})
+
+
+async def publish_saved(txn, clan, event) -> bool:
+    """Push a clan event to the clan channel once its transaction is saved, else take it back"""
+    if not txn.saved:
+        clan_events.discard(clan, event)
+        return False
+    await clan_events.publish(clan.id, event)
+    return True
+
+
+def save_failed() -> web.Response:
+    return web.json_response({'error': 'Failed to save clan'}, status=500)
+
+
 @routes.get('/api/clans')
 async def list_clans(request: web.Request) -> web.Response:
-    """Search/list clans"""
+    """Search/list clans (most members first, paginated)"""
     query = request.query.get('q', '')
-    min_trophies = int(request.query.get('trophies', 0))
+    try:
+        min_trophies = int(request.query['trophies']) if 'trophies' in request.query else None
+        offset = max(0, int(request.query.get('offset', 0)))
+        limit = max(1, min(db.CLAN_SEARCH_LIMIT, int(request.query.get('limit', db.CLAN_SEARCH_LIMIT))))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
+
+    clans, total = await db.search_clans(query, min_trophies, offset, limit)
+    return web.json_response({'clans': clans, 'total': total, 'offset': offset, 'limit': limit})
+
+
+@routes.get('/api/clans/leaderboard')
+async def clan_leaderboard(request: web.Request) -> web.Response:
+    """Clans ranked by total member trophies, donations or war trophies"""
+    sort_by = request.query.get('sort', 'trophies')
+    if sort_by not in db.CLAN_LEADERBOARD_FIELDS:
+        return web.json_response({'error': 'Invalid leaderboard type'}, status=400)
+    try:
+        offset = max(0, int(request.query.get('offset', 0)))
+        limit = max(1, min(100, int(request.query.get('limit', 100))))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
 
-    clans = await db.search_clans(query, min_trophies)
-    return web.json_response({'clans': clans})
+    clans, total = await db.get_clan_leaderboard(sort_by, limit, offset)
+
+    # Requesting player's clan rank if authenticated
+    clan_rank = -1
+    player_id = get_player_id_from_request(request)
+    if player_id:
+        player = await db.get_player(player_id)
+        if player and player.get('clan_id'):
+            clan_rank = await db.get_clan_rank(player['clan_id'], sort_by)
+
+    return web.json_response({
+        'type': sort_by,
+        'clans': clans,
+        'clan_rank': clan_rank,
+        'total_clans': total,
+        'offset': offset,
+    })
 
 
 @routes.post('/api/clan')
@@ -66,16 +124,22 @@ async def create_clan(request: web.Request) -> web.Response:
     if 'badge' in data:
         clan['badge'] = data['badge']
 
-    # Save clan
-    success = await db.save_clan(clan)
-    if not success:
-        return web.json_response({'error': 'Failed to create clan'}, status=500)
+    # The founder is locked from the check until the clan and their clan_id are saved
+    async with db.entity_locks(players=[player_id]):
+        player = await db.get_player(player_id)
+        if not player or player.get('clan_id'):
+            return web.json_response({'error': 'Already in a clan'}, status=400)
 
-    # Update player's clan_id
-    player['clan_id'] = clan_id
-    await db.save_player(player)
+        # Save clan
+        success = await db.save_clan(clan)
+        if not success:
+            return web.json_response({'error': 'Failed to create clan'}, status=500)
 
-    return web.json_response({'clan': clan})
+        # Update player's clan_id
+        player['clan_id'] = clan_id
+        await db.save_player(player)
+
+    return clan_response(await db.get_clan(clan_id))
 
 
 @routes.get('/api/clan/{clan_id}')
@@ -87,60 +151,113 @@ async def get_clan(request: web.Request) -> web.Response:
     if not clan:
         return web.json_response({'error': 'Clan not found'}, status=404)
 
-    return web.json_response({'clan': clan})
+    # Chat is served by /chat; older documents still carry it until migrated
+    await chat_store.migrate_clan(clan)
+    return clan_response(clan)
 
 
-@routes.post('/api/clan/{clan_id}/join')
-async def join_clan(request: web.Request) -> web.Response:
-    """Join a clan"""
+@routes.get('/api/clan/{clan_id}/chat')
+async def get_clan_chat(request: web.Request) -> web.Response:
+    """Clan chat history, oldest first (page back with ?before=<seq>)"""
     player_id = get_player_id_from_request(request)
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
+    clan_id = request.match_info['clan_id']
     player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
-
-    if player.get('clan_id'):
-        return web.json_response({'error': 'Already in a clan'}, status=400)
+    if not player or player.get('clan_id') != clan_id:
+        return web.json_response({'error': 'Not in this clan'}, status=403)
 
-    clan_id = request.match_info['clan_id']
     clan = await db.get_clan(clan_id)
     if not clan:
         return web.json_response({'error': 'Clan not found'}, status=404)
 
-    # Check clan type
-    if clan.get('type') == 'closed':
-        return web.json_response({'error': 'Clan is closed'}, status=400)
+    try:
+        before = int(request.query['before']) if 'before' in request.query else None
+        limit = max(1, min(chat_store.PAGE_LIMIT, int(request.query.get('limit', chat_store.PAGE_LIMIT))))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
+
+    await chat_store.migrate_clan(clan)
+    messages = await chat_store.get_messages(clan_id, before, limit)
+    return web.json_response({
+        'messages': messages,
+        'has_more': bool(messages) and messages[0]['seq'] > 1,
+    })
 
-    # Check trophy requirement
-    player_trophies = player.get('stats', {}).get('trophies', 0)
-    if player_trophies < clan.get('required_trophies', 0):
-        return web.json_response({'error': 'Not enough trophies'}, status=400)
 
-    # Check if clan is full (max 50 members)
-    if len(clan.get('members', [])) >= 50:
-        return web.json_response({'error': 'Clan is full'}, status=400)
+@routes.get('/api/clan/{clan_id}/events')
+async def get_clan_events(request: web.Request) -> web.Response:
+    """Clan events after ?since=<seq>; resync means refetch the clan instead"""
+    clan = await db.get_clan(request.match_info['clan_id'])
+    if not clan:
+        return web.json_response({'error': 'Clan not found'}, status=404)
+    try:
+        since = int(request.query.get('since', 0))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
 
-    # Add player to clan
-    import time
-    player_name = player.get('profile', {}).get('name', player.get('username', 'Unknown'))
-    clan['members'].append({
-        'player_id': player_id,
-        'name': player_name,
-        'role': 'member',
-        'joined_at': time.time(),
-        'donations': 0,
-        'last_active': time.time(),
+    events = clan_events.since(clan, since)
+    return web.json_response({
+        'events': events or [],
+        'seq': clan.get('event_seq', 0),
+        'resync': events is None,
     })
 
-    await db.save_clan(clan)
 
-    # Update player's clan_id
-    player['clan_id'] = clan_id
-    await db.save_player(player)
+@routes.post('/api/clan/{clan_id}/join')
+async def join_clan(request: web.Request) -> web.Response:
+    """Join a clan"""
+    player_id = get_player_id_from_request(request)
+    if not player_id:
+        return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    return web.json_response({'clan': clan})
+    # Player and clan are locked from the checks until both are saved (no joining two clans at once)
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(players=[player_id], clans=[clan_id]) as txn:
+        player, clan = txn.players[player_id], txn.clans[clan_id]
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        if player.get('clan_id'):
+            return web.json_response({'error': 'Already in a clan'}, status=400)
+
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check clan type
+        if clan.get('type') == 'closed':
+            return web.json_response({'error': 'Clan is closed'}, status=400)
+
+        # Check trophy requirement
+        player_trophies = player.get('stats', {}).get('trophies', 0)
+        if player_trophies < clan.get('required_trophies', 0):
+            return web.json_response({'error': 'Not enough trophies'}, status=400)
+
+        # Check if clan is full (max 50 members)
+        if clan.member_count >= db.MAX_CLAN_MEMBERS:
+            return web.json_response({'error': 'Clan is full'}, status=400)
+
+        # Add player to clan
+        import time
+        player_name = player.get('profile', {}).get('name', player.get('username', 'Unknown'))
+        member = {
+            'player_id': player_id,
+            'name': player_name,
+            'role': 'member',
+            'joined_at': time.time(),
+            'donations': 0,
+            'last_active': time.time(),
+        }
+        clan.add_member(member)
+
+        # Update player's clan_id
+        player['clan_id'] = clan_id
+        event = clan_events.add(clan, 'member_joined', {'member': member})
+
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
+    return clan_response(clan)
 
 
 @routes.post('/api/clan/{clan_id}/leave')
@@ -150,44 +267,46 @@ async def leave_clan(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
-
     clan_id = request.match_info['clan_id']
-    if player.get('clan_id') != clan_id:
-        return web.json_response({'error': 'Not in this clan'}, status=400)
-
-    clan = await db.get_clan(clan_id)
-    if not clan:
-        return web.json_response({'error': 'Clan not found'}, status=404)
-
-    # Find member
-    member = None
-    for m in clan.get('members', []):
-        if m.get('player_id') == player_id:
-            member = m
-            break
-
-    if not member:
-        return web.json_response({'error': 'Not a member'}, status=400)
-
-    # If leader, must transfer leadership first (unless last member)
-    if member.get('role') == 'leader' and len(clan['members']) > 1:
-        return web.json_response({'error': 'Transfer leadership before leaving'}, status=400)
-
-    # Remove from clan
-    clan['members'] = [m for m in clan['members'] if m.get('player_id') != player_id]
-
-    # If no members left, delete clan
-    if len(clan['members']) == 0:
-        await db.delete_clan(clan_id)
-    else:
-        await db.save_clan(clan)
-
-    # Update player
-    player['clan_id'] = None
-    await db.save_player(player)
+    event = None
+    async with db.transaction(players=[player_id], clans=[clan_id]) as txn:
+        player, clan = txn.players[player_id], txn.clans[clan_id]
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        if player.get('clan_id') != clan_id:
+            return web.json_response({'error': 'Not in this clan'}, status=400)
+
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        if not clan.member(player_id):
+            return web.json_response({'error': 'Not a member'}, status=400)
+
+        # If leader, must transfer leadership first (unless last member)
+        if clan.has_role(player_id, 'leader') and clan.member_count > 1:
+            return web.json_response({'error': 'Transfer leadership before leaving'}, status=400)
+
+        # Remove from clan
+        clan.remove_member(player_id)
+
+        # If no members left, delete clan (still under its lock, so nobody joins it meanwhile)
+        if clan.member_count == 0:
+            await db.delete_clan(clan_id)
+            txn.clans[clan_id] = None
+        else:
+            event = clan_events.add(clan, 'member_left', {'player_id': player_id})
+
+        # Update player
+        player['clan_id'] = None
+
+    if event is None:
+        await chat_store.delete_chat(clan_id)
+        clan_events.drop(clan_id)
+        if not txn.saved:
+            return save_failed()
+    elif not await publish_saved(txn, clan, event):
+        return save_failed()
 
     return web.json_response({'success': True})
 
@@ -199,45 +318,45 @@ async def promote_member(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    clan_id = request.match_info['clan_id']
-    clan = await db.get_clan(clan_id)
-    if not clan:
-        return web.json_response({'error': 'Clan not found'}, status=404)
-
-    # Check if player is leader or co-leader
-    player_member = None
-    for m in clan.get('members', []):
-        if m.get('player_id') == player_id:
-            player_member = m
-            break
-
-    if not player_member or player_member.get('role') not in ['leader', 'co-leader']:
-        return web.json_response({'error': 'Insufficient permissions'}, status=403)
-
     try:
         data = await request.json()
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
     target_id = data.get('player_id')
-    if not target_id:
-        return web.json_response({'error': 'Target player required'}, status=400)
-
-    # Find target member
-    for m in clan['members']:
-        if m.get('player_id') == target_id:
-            current_role = m.get('role', 'member')
-            if current_role == 'member':
-                m['role'] = 'elder'
-            elif current_role == 'elder':
-                m['role'] = 'co-leader'
-            elif current_role == 'co-leader' and player_member.get('role') == 'leader':
-                m['role'] = 'leader'
-                player_member['role'] = 'co-leader'
-            break
-
-    await db.save_clan(clan)
-    return web.json_response({'clan': clan})
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check if player is leader or co-leader
+        if not clan.is_manager(player_id):
+            return web.json_response({'error': 'Insufficient permissions'}, status=403)
+
+        if not target_id:
+            return web.json_response({'error': 'Target player required'}, status=400)
+
+        # Promote target member
+        current_role = clan.role(target_id)
+        if current_role is None:
+            return web.json_response({'error': 'Member not found'}, status=404)
+        if current_role == 'member':
+            clan.set_role(target_id, 'elder')
+        elif current_role == 'elder':
+            clan.set_role(target_id, 'co-leader')
+        elif current_role == 'co-leader' and clan.has_role(player_id, 'leader'):
+            clan.set_role(target_id, 'leader')
+            clan.set_role(player_id, 'co-leader')
+        else:
+            return web.json_response({'error': 'Cannot promote this member'}, status=403)
+
+        roles = {pid: clan.role(pid) for pid in (target_id, player_id) if clan.member(pid)}
+        event = clan_events.add(clan, 'roles_changed', {'roles': roles, 'by': player_id})
+
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
+    return clan_response(clan)
 
 
 @routes.post('/api/clan/{clan_id}/kick')
@@ -247,21 +366,6 @@ async def kick_member(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    clan_id = request.match_info['clan_id']
-    clan = await db.get_clan(clan_id)
-    if not clan:
-        return web.json_response({'error': 'Clan not found'}, status=404)
-
-    # Check if player is leader or co-leader
-    player_member = None
-    for m in clan.get('members', []):
-        if m.get('player_id') == player_id:
-            player_member = m
-            break
-
-    if not player_member or player_member.get('role') not in ['leader', 'co-leader']:
-        return web.json_response({'error': 'Insufficient permissions'}, status=403)
-
     try:
         data = await request.json()
     except:
@@ -271,29 +375,35 @@ async def kick_member(request: web.Request) -> web.Response:
     if not target_id or target_id == player_id:
         return web.json_response({'error': 'Invalid target'}, status=400)
 
-    # Find and remove target
-    target_found = False
-    for m in clan['members']:
-        if m.get('player_id') == target_id:
-            # Can't kick leader or co-leader if you're not leader
-            if m.get('role') in ['leader', 'co-leader'] and player_member.get('role') != 'leader':
-                return web.json_response({'error': 'Cannot kick higher rank'}, status=403)
-            target_found = True
-            break
+    # Clan and kicked player are saved together
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(players=[target_id], clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check if player is leader or co-leader
+        if not clan.is_manager(player_id):
+            return web.json_response({'error': 'Insufficient permissions'}, status=403)
 
-    if not target_found:
-        return web.json_response({'error': 'Member not found'}, status=404)
+        if not clan.member(target_id):
+            return web.json_response({'error': 'Member not found'}, status=404)
 
-    clan['members'] = [m for m in clan['members'] if m.get('player_id') != target_id]
-    await db.save_clan(clan)
+        # Can't kick leader or co-leader if you're not leader
+        if clan.is_manager(target_id) and not clan.has_role(player_id, 'leader'):
+            return web.json_response({'error': 'Cannot kick higher rank'}, status=403)
 
-    # Update kicked player
-    target_player = await db.get_player(target_id)
-    if target_player:
-        target_player['clan_id'] = None
-        await db.save_player(target_player)
+        clan.remove_member(target_id)
 
-    return web.json_response({'clan': clan})
+        # Update kicked player
+        target_player = txn.players[target_id]
+        if target_player and target_player.get('clan_id') == clan_id:
+            target_player['clan_id'] = None
+        event = clan_events.add(clan, 'member_kicked', {'player_id': target_id, 'by': player_id})
+
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
+    return clan_response(clan)
 
 
 @routes.post('/api/clan/{clan_id}/donate')
@@ -323,65 +433,81 @@ async def donate_cards(request: web.Request) -> web.Response:
     request_id = data.get('request_id')
     amount = int(data.get('amount', 1))
 
-    # Find the donation request
-    donation_request = None
-    for req in clan.get('donation_requests', []):
-        if req.get('id') == request_id:
-            donation_request = req
-            break
+    def find_request(clan):
+        return next((r for r in clan.get('donation_requests', []) if r.get('id') == request_id), None)
 
+    donation_request = find_request(clan)
     if not donation_request:
         return web.json_response({'error': 'Request not found'}, status=404)
 
-    if donation_request.get('requester_id') == player_id:
-        return web.json_response({'error': 'Cannot donate to yourself'}, status=400)
-
-    # Check if player has the card
-    card_id = donation_request.get('card_id')
-    player_shards = player.get('cards', {}).get('shards', {}).get(card_id, 0)
-    if player_shards < amount:
-        return web.json_response({'error': 'Not enough cards'}, status=400)
-
-    # Check max donation
-    current_donated = donation_request.get('amount', 0)
-    max_donation = donation_request.get('max', 10)
-    if current_donated + amount > max_donation:
-        amount = max_donation - current_donated
-
-    if amount <= 0:
-        return web.json_response({'error': 'Request already filled'}, status=400)
-
-    # Transfer cards
-    player['cards']['shards'][card_id] = player_shards - amount
-    await db.save_player(player)
-
-    # Update requester
-    requester = await db.get_player(donation_request['requester_id'])
-    if requester:
-        if 'shards' not in requester.get('cards', {}):
-            requester['cards']['shards'] = {}
-        requester['cards']['shards'][card_id] = requester['cards']['shards'].get(card_id, 0) + amount
-        await db.save_player(requester)
-
-    # Update donation request
-    donation_request['amount'] = current_donated + amount
-
-    # Update donator's stats
-    for m in clan['members']:
-        if m.get('player_id') == player_id:
-            m['donations'] = m.get('donations', 0) + amount
-            break
-
-    # Ensure stats exists
-    if 'stats' not in clan:
-        clan['stats'] = {}
-    clan['stats']['total_donations'] = clan['stats'].get('total_donations', 0) + amount
-
-    # Remove completed requests
-    if donation_request['amount'] >= donation_request['max']:
-        clan['donation_requests'] = [r for r in clan['donation_requests'] if r.get('id') != request_id]
-
-    await db.save_clan(clan)
+    # Donor, requester and clan are locked from the checks until all three are saved together
+    requester_id = donation_request.get('requester_id')
+    async with db.transaction(players=[player_id, requester_id], clans=[clan_id]) as txn:
+        player, requester, clan = txn.players[player_id], txn.players[requester_id], txn.clans[clan_id]
+        donation_request = find_request(clan) if clan else None
+        if not player or not donation_request:
+            return web.json_response({'error': 'Request not found'}, status=404)
+
+        if requester_id == player_id:
+            return web.json_response({'error': 'Cannot donate to yourself'}, status=400)
+
+        # Check if player has the card
+        card_id = donation_request.get('card_id')
+        player_shards = player.get('cards', {}).get('shards', {}).get(card_id, 0)
+        if player_shards < amount:
+            return web.json_response({'error': 'Not enough cards'}, status=400)
+
+        # Check max donation
+        current_donated = donation_request.get('amount', 0)
+        max_donation = donation_request.get('max', 10)
+        if current_donated + amount > max_donation:
+            amount = max_donation - current_donated
+
+        if amount <= 0:
+            return web.json_response({'error': 'Request already filled'}, status=400)
+
+        # Transfer cards
+        player['cards']['shards'][card_id] = player_shards - amount
+
+        # Update requester
+        if requester:
+            if 'shards' not in requester.get('cards', {}):
+                requester['cards']['shards'] = {}
+            requester['cards']['shards'][card_id] = requester['cards']['shards'].get(card_id, 0) + amount
+
+        # Update donation request
+        donation_request['amount'] = current_donated + amount
+
+        # Update donator's stats
+        member = clan.member(player_id)
+        if member:
+            member['donations'] = member.get('donations', 0) + amount
+
+        # Ensure stats exists
+        if 'stats' not in clan:
+            clan['stats'] = {}
+        clan['stats']['total_donations'] = clan['stats'].get('total_donations', 0) + amount
+
+        # Remove completed requests
+        filled = donation_request['amount'] >= donation_request['max']
+        if filled:
+            clan['donation_requests'] = [r for r in clan['donation_requests'] if r.get('id') != request_id]
+
+        event = clan_events.add(
+            clan, 'donation',
+            {
+                'request_id': request_id,
+                'donor_id': player_id,
+                'donated': amount,
+                'request_amount': donation_request['amount'],
+                'filled': filled,
+                'donor_donations': member.get('donations', 0) if member else 0,
+                'total_donations': clan['stats']['total_donations'],
+            },
+        )
+
+    if not await publish_saved(txn, clan, event):
+        return web.json_response({'error': 'Failed to save donation'}, status=500)
 
     return web.json_response({
         'success': True,
@@ -405,10 +531,6 @@ async def request_cards(request: web.Request) -> web.Response:
     if player.get('clan_id') != clan_id:
         return web.json_response({'error': 'Not in this clan'}, status=400)
 
-    clan = await db.get_clan(clan_id)
-    if not clan:
-        return web.json_response({'error': 'Clan not found'}, status=404)
-
     try:
         data = await request.json()
     except:
@@ -418,36 +540,42 @@ async def request_cards(request: web.Request) -> web.Response:
     if not card_id:
         return web.json_response({'error': 'Card ID required'}, status=400)
 
-    # Check if player already has an active request
-    for req in clan.get('donation_requests', []):
-        if req.get('requester_id') == player_id:
-            return web.json_response({'error': 'Already have an active request'}, status=400)
-
-    # Create request
-    import time
-    import uuid
-
-    # Determine max based on rarity (simplified)
-    max_cards = 40  # Common default
-
-    player_name = player.get('profile', {}).get('name', player.get('username', 'Unknown'))
-
-    new_request = {
-        'id': str(uuid.uuid4()),
-        'requester_id': player_id,
-        'requester_name': player_name,
-        'card_id': card_id,
-        'amount': 0,
-        'max': max_cards,
-        'timestamp': time.time(),
-    }
-
-    if 'donation_requests' not in clan:
-        clan['donation_requests'] = []
-    clan['donation_requests'].insert(0, new_request)
-
-    await db.save_clan(clan)
-
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check if player already has an active request
+        for req in clan.get('donation_requests', []):
+            if req.get('requester_id') == player_id:
+                return web.json_response({'error': 'Already have an active request'}, status=400)
+
+        # Create request
+        import time
+        import uuid
+
+        # Determine max based on rarity (simplified)
+        max_cards = 40  # Common default
+
+        player_name = player.get('profile', {}).get('name', player.get('username', 'Unknown'))
+
+        new_request = {
+            'id': str(uuid.uuid4()),
+            'requester_id': player_id,
+            'requester_name': player_name,
+            'card_id': card_id,
+            'amount': 0,
+            'max': max_cards,
+            'timestamp': time.time(),
+        }
+
+        if 'donation_requests' not in clan:
+            clan['donation_requests'] = []
+        clan['donation_requests'].insert(0, new_request)
+        event = clan_events.add(clan, 'request_created', {'request': new_request})
+
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
     return web.json_response({'request': new_request})
 
 
@@ -458,38 +586,37 @@ async def update_clan_settings(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    clan_id = request.match_info['clan_id']
-    clan = await db.get_clan(clan_id)
-    if not clan:
-        return web.json_response({'error': 'Clan not found'}, status=404)
-
-    # Check if player is leader or co-leader
-    player_member = None
-    for m in clan.get('members', []):
-        if m.get('player_id') == player_id:
-            player_member = m
-            break
-
-    if not player_member or player_member.get('role') not in ['leader', 'co-leader']:
-        return web.json_response({'error': 'Insufficient permissions'}, status=403)
-
     try:
         data = await request.json()
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
-    # Update allowed fields
-    if 'description' in data:
-        clan['description'] = str(data['description'])[:500]
-    if 'badge' in data:
-        clan['badge'] = str(data['badge'])[:4]  # emoji
-    if 'type' in data and data['type'] in ['open', 'invite_only', 'closed']:
-        clan['type'] = data['type']
-    if 'required_trophies' in data:
-        clan['required_trophies'] = max(0, min(10000, int(data['required_trophies'])))
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check if player is leader or co-leader
+        if not clan.is_manager(player_id):
+            return web.json_response({'error': 'Insufficient permissions'}, status=403)
+
+        # Update allowed fields
+        if 'description' in data:
+            clan['description'] = str(data['description'])[:500]
+        if 'badge' in data:
+            clan['badge'] = str(data['badge'])[:4]  # emoji
+        if 'type' in data and data['type'] in ['open', 'invite_only', 'closed']:
+            clan['type'] = data['type']
+        if 'required_trophies' in data:
+            clan['required_trophies'] = max(0, min(10000, int(data['required_trophies'])))
+
+        settings = {key: clan.get(key) for key in ('description', 'badge', 'type', 'required_trophies') if key in data}
+        event = clan_events.add(clan, 'settings_changed', {'settings': settings})
 
-    await db.save_clan(clan)
-    return web.json_response({'clan': clan})
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
+    return clan_response(clan)
 
 
 @routes.post('/api/clan/{clan_id}/demote')
@@ -499,40 +626,98 @@ async def demote_member(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
+    try:
+        data = await request.json()
+    except:
+        return web.json_response({'error': 'Invalid JSON'}, status=400)
+
+    target_id = data.get('player_id')
     clan_id = request.match_info['clan_id']
-    clan = await db.get_clan(clan_id)
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        # Check if player is leader or co-leader
+        if not clan.is_manager(player_id):
+            return web.json_response({'error': 'Insufficient permissions'}, status=403)
+
+        if not target_id:
+            return web.json_response({'error': 'Target player required'}, status=400)
+
+        # Demote target member (can only demote if you outrank them)
+        current_role = clan.role(target_id)
+        if current_role is None:
+            return web.json_response({'error': 'Member not found'}, status=404)
+        if current_role == 'co-leader' and clan.has_role(player_id, 'leader'):
+            clan.set_role(target_id, 'elder')
+        elif current_role == 'elder':
+            clan.set_role(target_id, 'member')
+        else:
+            return web.json_response({'error': 'Cannot demote this member'}, status=403)
+
+        event = clan_events.add(clan, 'roles_changed', {'roles': {target_id: clan.role(target_id)}, 'by': player_id})
+
+    if not await publish_saved(txn, clan, event):
+        return save_failed()
+    return clan_response(clan)
+
+
+@routes.get('/api/clan/{clan_id}/war')
+async def get_clan_war(request: web.Request) -> web.Response:
+    """Clan war status: roster, battles fought, score and the last result"""
+    clan = await db.get_clan(request.match_info['clan_id'])
     if not clan:
         return web.json_response({'error': 'Clan not found'}, status=404)
+    return web.json_response({'war': clan_wars.war_status(clan, get_player_id_from_request(request))})
 
-    # Check if player is leader or co-leader
-    player_member = None
-    for m in clan.get('members', []):
-        if m.get('player_id') == player_id:
-            player_member = m
-            break
 
-    if not player_member or player_member.get('role') not in ['leader', 'co-leader']:
-        return web.json_response({'error': 'Insufficient permissions'}, status=403)
+@routes.post('/api/clan/{clan_id}/war/join')
+async def join_clan_war(request: web.Request) -> web.Response:
+    """Sign up for the clan's next war (the roster of a running war is fixed when it is matched)"""
+    player_id = get_player_id_from_request(request)
+    if not player_id:
+        return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    try:
-        data = await request.json()
-    except:
-        return web.json_response({'error': 'Invalid JSON'}, status=400)
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+        if not clan.member(player_id):
+            return web.json_response({'error': 'Not a member'}, status=403)
+
+        war = clan.setdefault('war', idle_war())
+        if war.get('active'):
+            return web.json_response({'error': 'War already started'}, status=400)
+        participants = war.setdefault('participants', [])
+        if player_id not in participants:
+            participants.append(player_id)
+
+    if not txn.saved:
+        return save_failed()
+    return web.json_response({'war': clan_wars.war_status(clan, player_id)})
+
+
+@routes.post('/api/clan/{clan_id}/war/leave')
+async def leave_clan_war(request: web.Request) -> web.Response:
+    """Withdraw from the next clan war"""
+    player_id = get_player_id_from_request(request)
+    if not player_id:
+        return web.json_response({'error': 'Unauthorized'}, status=401)
 
-    target_id = data.get('player_id')
-    if not target_id:
-        return web.json_response({'error': 'Target player required'}, status=400)
-
-    # Find target member and demote
-    for m in clan['members']:
-        if m.get('player_id') == target_id:
-            current_role = m.get('role', 'member')
-            # Can only demote if you outrank them
-            if current_role == 'co-leader' and player_member.get('role') == 'leader':
-                m['role'] = 'elder'
-            elif current_role == 'elder':
-                m['role'] = 'member'
-            break
-
-    await db.save_clan(clan)
-    return web.json_response({'clan': clan})
+    clan_id = request.match_info['clan_id']
+    async with db.transaction(clans=[clan_id]) as txn:
+        clan = txn.clans[clan_id]
+        if not clan:
+            return web.json_response({'error': 'Clan not found'}, status=404)
+
+        war = clan.get('war') or {}
+        if war.get('active'):
+            return web.json_response({'error': 'War already started'}, status=400)
+        if player_id in war.get('participants', []):
+            war['participants'].remove(player_id)
+
+    if not txn.saved:
+        return save_failed()
+    return web.json_response({'war': clan_wars.war_status(clan, player_id)})
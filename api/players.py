@@ -6,6 +6,8 @@ Player data CRUD and sync
 from aiohttp import web
 from database import json_db as db
 from services import auth_service as auth
+from services.battle_results import battle_results
+from services.rating import ratings
 
 routes = web.RouteTableDef()
 
@@ -65,69 +67,74 @@ async def sync_player(request: web.Request) -> web.Response:
     if auth_player_id != player_id:
         return web.json_response({'error': 'Unauthorized'}, status=403)
 
-    player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
+    # Let queued server battle results land first so client totals don't get them added twice
+    await battle_results.wait_for_player(player_id)
 
     try:
         data = await request.json()
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
-    # Merge client data with server data
-    # Stats - use higher values for most things (anti-cheat basic)
-    if 'stats' in data:
-        client_stats = data['stats']
-        server_stats = player.get('stats', {})
-
-        # These fields can only go up or are server-authoritative
-        for field in ['trophies', 'wins', 'losses', 'crowns', 'max_streak',
-                      'medals', 'medals_wins', 'medals_losses', 'medals_highest',
-                      'comp_wins', 'comp_losses', 'comp_trophies']:
-            if field in client_stats:
-                # For now, trust client for progression stats
-                server_stats[field] = client_stats[field]
-
-        player['stats'] = server_stats
-
-    # Resources - SERVER AUTHORITATIVE (don't let client overwrite)
-    # Resources can only be changed by server-side actions (trades, rewards, etc.)
-    # Client sync is ignored to prevent overwrites from stale local data
-
-    # Cards - trust client for now
-    if 'cards' in data:
-        player['cards'] = data['cards']
-
-    # Decks
-    if 'decks' in data:
-        player['decks'] = data['decks']
-    if 'current_deck' in data:
-        player['current_deck'] = data['current_deck']
-
-    # Profile - name is server-authoritative to prevent sync overwrites
-    if 'profile' in data:
-        for field in ['title', 'tower_skin']:  # name excluded - only changeable server-side
-            if field in data['profile']:
-                player['profile'][field] = data['profile'][field]
-
-    # Battle pass
-    if 'battle_pass' in data:
-        player['battle_pass'] = data['battle_pass']
-
-    # Trophy road
-    if 'trophy_road' in data:
-        player['trophy_road'] = data['trophy_road']
-
-    # Chests
-    if 'chests' in data:
-        player['chests'] = data['chests']
-
-    # Battle log
-    if 'battle_log' in data:
-        player['battle_log'] = data['battle_log'][-20:]  # Keep last 20
-
-    # Save
-    success = await db.save_player(player)
+    # Locked like the API transactions, so a concurrent trade or transfer is neither lost nor rolled back
+    async with db.entity_locks(players=[player_id]):
+        player = await db.get_player(player_id)
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        # Merge client data with server data
+        # Stats - use higher values for most things (anti-cheat basic)
+        if 'stats' in data:
+            client_stats = data['stats']
+            server_stats = player.get('stats', {})
+
+            # These fields can only go up or are server-authoritative
+            for field in ['trophies', 'wins', 'losses', 'crowns', 'max_streak',
+                          'medals', 'medals_wins', 'medals_losses', 'medals_highest',
+                          'comp_wins', 'comp_losses', 'comp_trophies']:
+                if field in client_stats:
+                    # For now, trust client for progression stats
+                    server_stats[field] = client_stats[field]
+
+            player['stats'] = server_stats
+
+        # Resources - SERVER AUTHORITATIVE (don't let client overwrite)
+        # Resources can only be changed by server-side actions (trades, rewards, etc.)
+        # Client sync is ignored to prevent overwrites from stale local data
+
+        # Cards - trust client for now
+        if 'cards' in data:
+            player['cards'] = data['cards']
+
+        # Decks
+        if 'decks' in data:
+            player['decks'] = data['decks']
+        if 'current_deck' in data:
+            player['current_deck'] = data['current_deck']
+
+        # Profile - name is server-authoritative to prevent sync overwrites
+        if 'profile' in data:
+            for field in ['title', 'tower_skin']:  # name excluded - only changeable server-side
+                if field in data['profile']:
+                    player['profile'][field] = data['profile'][field]
+
+        # Battle pass
+        if 'battle_pass' in data:
+            player['battle_pass'] = data['battle_pass']
+
+        # Trophy road
+        if 'trophy_road' in data:
+            player['trophy_road'] = data['trophy_road']
+
+        # Chests
+        if 'chests' in data:
+            player['chests'] = data['chests']
+
+        # Battle log
+        if 'battle_log' in data:
+            player['battle_log'] = data['battle_log'][-20:]  # Keep last 20
+
+        # Save
+        success = await db.save_player(player)
     if not success:
         return web.json_response({'error': 'Failed to save'}, status=500)
 
@@ -146,28 +153,29 @@ async def update_profile(request: web.Request) -> web.Response:
     if auth_player_id != player_id:
         return web.json_response({'error': 'Unauthorized'}, status=403)
 
-    player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
-
     try:
         data = await request.json()
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
-    # Update allowed profile fields
-    if 'name' in data:
-        name = data['name'].strip()
-        if len(name) >= 3 and len(name) <= 20:
-            player['profile']['name'] = name
+    async with db.entity_locks(players=[player_id]):
+        player = await db.get_player(player_id)
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
 
-    if 'title' in data:
-        player['profile']['title'] = data['title']
+        # Update allowed profile fields
+        if 'name' in data:
+            name = data['name'].strip()
+            if len(name) >= 3 and len(name) <= 20:
+                player['profile']['name'] = name
 
-    if 'tower_skin' in data:
-        player['profile']['tower_skin'] = data['tower_skin']
+        if 'title' in data:
+            player['profile']['title'] = data['title']
 
-    success = await db.save_player(player)
+        if 'tower_skin' in data:
+            player['profile']['tower_skin'] = data['tower_skin']
+
+        success = await db.save_player(player)
     if not success:
         return web.json_response({'error': 'Failed to save'}, status=500)
 
@@ -203,7 +211,7 @@ async def get_leaderboard(request: web.Request) -> web.Response:
         'type': lb_type,
         'players': players,
         'player_rank': player_rank,
-        'total_players': len(await db.get_all_players()),
+        'total_players': await db.get_ranked_player_count(),
     })
 
 
@@ -216,51 +224,67 @@ async def report_battle_result(request: web.Request) -> web.Response:
     if auth_player_id != player_id:
         return web.json_response({'error': 'Unauthorized'}, status=403)
 
-    player = await db.get_player(player_id)
-    if not player:
-        return web.json_response({'error': 'Player not found'}, status=404)
-
     try:
         data = await request.json()
     except:
         return web.json_response({'error': 'Invalid JSON'}, status=400)
 
-    # Apply battle result
-    stats = player.get('stats', {})
-
-    if data.get('won'):
-        stats['wins'] = stats.get('wins', 0) + 1
-        stats['current_streak'] = stats.get('current_streak', 0) + 1
-        if stats['current_streak'] > stats.get('max_streak', 0):
-            stats['max_streak'] = stats['current_streak']
-    else:
-        stats['losses'] = stats.get('losses', 0) + 1
-        stats['current_streak'] = 0
-
-    # Apply trophy/elo changes
-    if 'trophy_change' in data:
-        stats['trophies'] = max(0, stats.get('trophies', 0) + data['trophy_change'])
-    if 'new_elo' in data:
-        stats['elo'] = data['new_elo']
-    if 'crowns' in data:
-        stats['crowns'] = stats.get('crowns', 0) + data['crowns']
-
-    # Apply gold earned
-    resources = player.get('resources', {})
-    if 'gold_earned' in data:
-        resources['gold'] = resources.get('gold', 0) + data['gold_earned']
-
-    player['stats'] = stats
-    player['resources'] = resources
-
-    # Add to battle log
-    if 'battle_log_entry' in data:
-        if 'battle_log' not in player:
-            player['battle_log'] = []
-        player['battle_log'].insert(0, data['battle_log_entry'])
-        player['battle_log'] = player['battle_log'][:20]  # Keep last 20
-
-    success = await db.save_player(player)
+    await battle_results.wait_for_player(player_id)
+
+    async with db.entity_locks(players=[player_id]):
+        player = await db.get_player(player_id)
+        if not player:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        # Server-run battles are applied by the result pipeline; never apply one twice
+        battle_id = data.get('battle_id')
+        if battle_id and (battle_results.is_tracked(battle_id) or battle_id in player.get('applied_battles', [])):
+            return web.json_response({
+                'success': True,
+                'already_applied': True,
+                'stats': player.get('stats', {}),
+                'resources': player.get('resources', {}),
+            })
+
+        # Apply battle result
+        stats = player.get('stats', {})
+
+        if data.get('won'):
+            stats['wins'] = stats.get('wins', 0) + 1
+            stats['current_streak'] = stats.get('current_streak', 0) + 1
+            if stats['current_streak'] > stats.get('max_streak', 0):
+                stats['max_streak'] = stats['current_streak']
+        else:
+            stats['losses'] = stats.get('losses', 0) + 1
+            stats['current_streak'] = 0
+
+        # Apply trophy/elo changes
+        if 'trophy_change' in data:
+            stats['trophies'] = max(0, stats.get('trophies', 0) + data['trophy_change'])
+        if 'new_elo' in data and not ratings.deferred:
+            stats['elo'] = data['new_elo']
+        if 'crowns' in data:
+            stats['crowns'] = stats.get('crowns', 0) + data['crowns']
+
+        # Apply gold earned
+        resources = player.get('resources', {})
+        if 'gold_earned' in data:
+            resources['gold'] = resources.get('gold', 0) + data['gold_earned']
+
+        player['stats'] = stats
+        player['resources'] = resources
+        if battle_id:
+            player.setdefault('applied_battles', []).append(battle_id)
+            player['applied_battles'] = player['applied_battles'][-20:]
+
+        # Add to battle log
+        if 'battle_log_entry' in data:
+            if 'battle_log' not in player:
+                player['battle_log'] = []
+            player['battle_log'].insert(0, data['battle_log_entry'])
+            player['battle_log'] = player['battle_log'][:20]  # Keep last 20
+
+        success = await db.save_player(player)
     if not success:
         return web.json_response({'error': 'Failed to save'}, status=500)
 
@@ -0,0 +1,60 @@
+"""
+Replay API Endpoints
+Battle replay listing and streaming
+"""
+
+from aiohttp import web
+from database import replay_store
+from websocket.battle_replay import ReplayRecorder
+
+routes = web.RouteTableDef()
+
+
+@routes.get('/api/replay/{battle_id}')
+async def get_replay(request: web.Request) -> web.StreamResponse:
+    """Stream a battle replay (binary by default, ?format=json for decoded actions)"""
+    battle_id = request.match_info['battle_id']
+
+    info = await replay_store.get_replay_info(battle_id)
+    if not info:
+        return web.json_response({'error': 'Replay not found'}, status=404)
+
+    if request.query.get('format') == 'json':
+        data = await replay_store.read_replay(battle_id)
+        try:
+            recorder = ReplayRecorder.decode(data)
+        except (ValueError, IndexError):
+            return web.json_response({'error': 'Replay is corrupted'}, status=500)
+        return web.json_response({
+            'replay': {k: v for k, v in info.items() if k not in ('segment', 'offset', 'length')},
+            'actions': recorder.to_actions(participants=info.get('participants')),
+        })
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/octet-stream',
+        'Content-Disposition': f'attachment; filename="{battle_id}.replay"',
+    })
+    response.content_length = info['length']
+    await response.prepare(request)
+    async for chunk in replay_store.iter_replay(battle_id):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+@routes.get('/api/player/{player_id}/replays')
+async def list_player_replays(request: web.Request) -> web.Response:
+    """List a player's recent replays"""
+    player_id = request.match_info['player_id']
+    try:
+        limit = max(1, min(50, int(request.query.get('limit', 20))))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
+
+    replays = await replay_store.get_player_replays(player_id, limit)
+    return web.json_response({
+        'replays': [
+            {k: v for k, v in r.items() if k not in ('segment', 'offset', 'length')}
+            for r in replays
+        ],
+    })
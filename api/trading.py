@@ -147,63 +147,64 @@ async def accept_trade(request: web.Request) -> web.Response:
     if not trade:
         return web.json_response({'error': 'Trade not found'}, status=404)
 
-    if trade.get('status') != 'open':
-        return web.json_response({'error': 'Trade not available'}, status=400)
-
-    if trade.get('creator_id') == player_id:
-        return web.json_response({'error': 'Cannot accept own trade'}, status=400)
-
-    # Check if expired
-    if trade.get('expires_at', 0) < time.time():
-        trade['status'] = 'expired'
-        await db.save_trade(trade)
-        return web.json_response({'error': 'Trade expired'}, status=400)
-
-    # Check acceptor has the requested card
-    want_card = trade['requesting']['card_id']
-    want_amount = trade['requesting']['amount']
-    player_shards = player.get('cards', {}).get('shards', {}).get(want_card, 0)
-
-    if player_shards < want_amount:
-        return web.json_response({'error': 'Not enough cards'}, status=400)
-
-    # Get creator
-    creator = await db.get_player(trade['creator_id'])
-    if not creator:
-        trade['status'] = 'cancelled'
-        await db.save_trade(trade)
-        return web.json_response({'error': 'Trade creator not found'}, status=400)
-
-    # Check creator still has the offered card
-    offer_card = trade['offering']['card_id']
-    offer_amount = trade['offering']['amount']
-    creator_shards = creator.get('cards', {}).get('shards', {}).get(offer_card, 0)
-
-    if creator_shards < offer_amount:
-        trade['status'] = 'cancelled'
-        await db.save_trade(trade)
-        return web.json_response({'error': 'Creator no longer has cards'}, status=400)
-
-    # Execute trade
-    # Remove from creator, add to acceptor
-    creator['cards']['shards'][offer_card] = creator_shards - offer_amount
-    if 'shards' not in player.get('cards', {}):
-        player['cards']['shards'] = {}
-    player['cards']['shards'][offer_card] = player['cards']['shards'].get(offer_card, 0) + offer_amount
-
-    # Remove from acceptor, add to creator
-    player['cards']['shards'][want_card] = player_shards - want_amount
-    creator['cards']['shards'][want_card] = creator['cards']['shards'].get(want_card, 0) + want_amount
-
-    # Save players
-    await db.save_player(player)
-    await db.save_player(creator)
-
-    # Update trade
-    trade['status'] = 'accepted'
-    trade['accepted_by'] = player_id
-    trade['accepted_at'] = time.time()
-    await db.save_trade(trade)
+    # Both players and the trade are locked until the exchange is saved, so a trade can't be
+    # accepted twice and neither side can spend the same cards elsewhere meanwhile
+    async with db.transaction(players=[player_id, trade['creator_id']], trades=[trade_id]) as txn:
+        trade = txn.trades[trade_id]
+        player = txn.players[player_id]
+
+        if trade.get('status') != 'open':
+            return web.json_response({'error': 'Trade not available'}, status=400)
+
+        if trade.get('creator_id') == player_id:
+            return web.json_response({'error': 'Cannot accept own trade'}, status=400)
+
+        # Check if expired
+        if trade.get('expires_at', 0) < time.time():
+            trade['status'] = 'expired'
+            return web.json_response({'error': 'Trade expired'}, status=400)
+
+        # Check acceptor has the requested card
+        want_card = trade['requesting']['card_id']
+        want_amount = trade['requesting']['amount']
+        player_shards = player.get('cards', {}).get('shards', {}).get(want_card, 0)
+
+        if player_shards < want_amount:
+            return web.json_response({'error': 'Not enough cards'}, status=400)
+
+        # Get creator
+        creator = txn.players[trade['creator_id']]
+        if not creator:
+            trade['status'] = 'cancelled'
+            return web.json_response({'error': 'Trade creator not found'}, status=400)
+
+        # Check creator still has the offered card
+        offer_card = trade['offering']['card_id']
+        offer_amount = trade['offering']['amount']
+        creator_shards = creator.get('cards', {}).get('shards', {}).get(offer_card, 0)
+
+        if creator_shards < offer_amount:
+            trade['status'] = 'cancelled'
+            return web.json_response({'error': 'Creator no longer has cards'}, status=400)
+
+        # Execute trade
+        # Remove from creator, add to acceptor
+        creator['cards']['shards'][offer_card] = creator_shards - offer_amount
+        if 'shards' not in player.get('cards', {}):
+            player['cards']['shards'] = {}
+        player['cards']['shards'][offer_card] = player['cards']['shards'].get(offer_card, 0) + offer_amount
+
+        # Remove from acceptor, add to creator
+        player['cards']['shards'][want_card] = player_shards - want_amount
+        creator['cards']['shards'][want_card] = creator['cards']['shards'].get(want_card, 0) + want_amount
+
+        # Update trade (saved with both players when the transaction ends)
+        trade['status'] = 'accepted'
+        trade['accepted_by'] = player_id
+        trade['accepted_at'] = time.time()
+
+    if not txn.saved:
+        return web.json_response({'error': 'Failed to save trade'}, status=500)
 
     player_name = player.get('profile', {}).get('name', player.get('username', 'Unknown'))
 
@@ -221,20 +222,24 @@ async def cancel_trade(request: web.Request) -> web.Response:
     if not player_id:
         return web.json_response({'error': 'Unauthorized'}, status=401)
 
+    # Locked like accept_trade, so a trade is either accepted or cancelled, never both
     trade_id = request.match_info['trade_id']
-    trade = await db.get_trade(trade_id)
+    async with db.transaction(trades=[trade_id]) as txn:
+        trade = txn.trades[trade_id]
 
-    if not trade:
-        return web.json_response({'error': 'Trade not found'}, status=404)
+        if not trade:
+            return web.json_response({'error': 'Trade not found'}, status=404)
 
-    if trade.get('creator_id') != player_id:
-        return web.json_response({'error': 'Not your trade'}, status=403)
+        if trade.get('creator_id') != player_id:
+            return web.json_response({'error': 'Not your trade'}, status=403)
 
-    if trade.get('status') != 'open':
-        return web.json_response({'error': 'Trade cannot be cancelled'}, status=400)
+        if trade.get('status') != 'open':
+            return web.json_response({'error': 'Trade cannot be cancelled'}, status=400)
 
-    trade['status'] = 'cancelled'
-    await db.save_trade(trade)
+        trade['status'] = 'cancelled'
+
+    if not txn.saved:
+        return web.json_response({'error': 'Failed to cancel trade'}, status=500)
 
     return web.json_response({'success': True})
 
@@ -280,23 +285,30 @@ async def send_resources(request: web.Request) -> web.Response:
     if recipient['id'] == player_id:
         return web.json_response({'error': 'Cannot send to yourself'}, status=400)
 
-    # Check sender has enough resources
-    sender_resources = sender.get('resources', {})
-    sender_amount = sender_resources.get(resource_type, 0)
+    # Both balances are locked from the check until the transfer is saved (no double spending)
+    recipient_id = recipient['id']
+    async with db.transaction(players=[player_id, recipient_id]) as txn:
+        sender = txn.players[player_id]
+        recipient = txn.players[recipient_id]
+        if not sender or not recipient:
+            return web.json_response({'error': 'Player not found'}, status=404)
+
+        # Check sender has enough resources
+        sender_resources = sender.get('resources', {})
+        sender_amount = sender_resources.get(resource_type, 0)
 
-    if sender_amount < amount:
-        return web.json_response({'error': f'Not enough {resource_type}. You have {sender_amount}'}, status=400)
+        if sender_amount < amount:
+            return web.json_response({'error': f'Not enough {resource_type}. You have {sender_amount}'}, status=400)
 
-    # Transfer resources
-    sender['resources'][resource_type] = sender_amount - amount
+        # Transfer resources
+        sender['resources'][resource_type] = sender_amount - amount
 
-    if 'resources' not in recipient:
-        recipient['resources'] = {}
-    recipient['resources'][resource_type] = recipient['resources'].get(resource_type, 0) + amount
+        if 'resources' not in recipient:
+            recipient['resources'] = {}
+        recipient['resources'][resource_type] = recipient['resources'].get(resource_type, 0) + amount
 
-    # Save both players
-    await db.save_player(sender)
-    await db.save_player(recipient)
+    if not txn.saved:
+        return web.json_response({'error': 'Failed to send resources'}, status=500)
 
     sender_name = sender.get('profile', {}).get('name', sender.get('username', 'Unknown'))
     recipient_display = recipient.get('profile', {}).get('name', recipient.get('username', 'Unknown'))
@@ -0,0 +1,46 @@
+"""
+Battle History
+Append-only log of finished battles (sides, winner, crowns) used to recompute ratings
+"""
+
+import os
+import json
+import asyncio
+import aiofiles
+from typing import Dict, Iterator, List
+
+from database.json_db import DATA_DIR
+
+HISTORY_PATH = os.path.join(DATA_DIR, 'battle_history.jsonl')
+
+_lock = asyncio.Lock()
+
+
+async def append_battles(entries: List[Dict]) -> bool:
+    """Append a batch of battles with one write"""
+    if not entries:
+        return True
+    try:
+        async with _lock:
+            async with aiofiles.open(HISTORY_PATH, 'a', encoding='utf-8') as f:
+                await f.write(''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries))
+        return True
+    except Exception as e:
+        print(f"Error writing battle history: {e}")
+        return False
+
+
+def read_battles(path: str = None) -> Iterator[Dict]:
+    """Stream battles in the order they were recorded (for offline tools)"""
+    path = path or HISTORY_PATH
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn final line from a crash
@@ -0,0 +1,143 @@
+"""
+Clan Chat Store
+Append-only chat log per clan with an in-memory ring of recent messages
+"""
+
+import os
+import json
+import asyncio
+import aiofiles
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from database.json_db import DATA_DIR
+
+CHAT_DIR = os.path.join(DATA_DIR, 'clan_chat')
+RING_SIZE = 100  # Recent messages kept in memory per clan
+PAGE_LIMIT = 50
+TAIL_CHUNK_SIZE = 16 * 1024
+
+
+class ClanChat:
+    """Recent messages of one clan and its last sequence number"""
+
+    def __init__(self):
+        self.recent: Deque[Dict] = deque(maxlen=RING_SIZE)
+        self.last_seq = 0
+        self.lock = asyncio.Lock()
+
+
+_chats: Dict[str, ClanChat] = {}
+
+
+def _chat_path(clan_id: str) -> str:
+    return os.path.join(CHAT_DIR, f'{clan_id}.jsonl')
+
+
+async def _read_tail(path: str, count: int) -> List[Dict]:
+    """Last count messages of a log, reading backwards from the end"""
+    if not os.path.exists(path):
+        return []
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(0, os.SEEK_END)
+        position = await f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(TAIL_CHUNK_SIZE, position)
+            position -= step
+            await f.seek(position)
+            data = await f.read(step) + data
+    messages = []
+    for line in data.splitlines()[-(count + 1):]:
+        try:
+            messages.append(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue  # Partial first line of the chunk, or a torn final line
+    return messages[-count:]
+
+
+async def _get_chat(clan_id: str) -> ClanChat:
+    """Load a clan's recent messages from the tail of its log on first use"""
+    chat = _chats.get(clan_id)
+    if chat is None:
+        chat = ClanChat()
+        for message in await _read_tail(_chat_path(clan_id), RING_SIZE):
+            chat.recent.append(message)
+        if chat.recent:
+            chat.last_seq = chat.recent[-1].get('seq', 0)
+        chat = _chats.setdefault(clan_id, chat)
+    return chat
+
+
+async def append_messages(clan_id: str, messages: List[Dict]) -> List[Dict]:
+    """Number and append messages with one write (returns them with their seq)"""
+    chat = await _get_chat(clan_id)
+    async with chat.lock:
+        numbered = []
+        for message in messages:
+            chat.last_seq += 1
+            numbered.append({'seq': chat.last_seq, **message})
+        try:
+            async with aiofiles.open(_chat_path(clan_id), 'a', encoding='utf-8') as f:
+                await f.write(''.join(json.dumps(m, separators=(',', ':')) + '\n' for m in numbered))
+        except IOError as e:
+            chat.last_seq -= len(numbered)
+            print(f"Error writing clan chat {clan_id}: {e}")
+            return []
+        chat.recent.extend(numbered)
+        return numbered
+
+
+async def append_message(clan_id: str, message: Dict) -> Optional[Dict]:
+    """Append one chat message"""
+    numbered = await append_messages(clan_id, [message])
+    return numbered[0] if numbered else None
+
+
+async def get_messages(clan_id: str, before: Optional[int] = None, limit: int = PAGE_LIMIT) -> List[Dict]:
+    """Up to limit messages older than seq `before` (newest if None), oldest first"""
+    chat = await _get_chat(clan_id)
+    before = chat.last_seq + 1 if before is None else before
+    recent = [m for m in chat.recent if m['seq'] < before]
+    # The ring covers the page if it holds enough older messages or reaches back to the start
+    if len(recent) >= limit or len(chat.recent) < RING_SIZE or chat.recent[0]['seq'] == 1:
+        return recent[-limit:]
+
+    # Older history: stream the log
+    page: Deque[Dict] = deque(maxlen=limit)
+    async with aiofiles.open(_chat_path(clan_id), 'r', encoding='utf-8') as f:
+        async for line in f:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if message.get('seq', 0) >= before:
+                break
+            page.append(message)
+    return list(page)
+
+
+async def migrate_clan(clan: Dict) -> bool:
+    """Move chat_history out of a clan document into the store (returns True if the clan changed)"""
+    if 'chat_history' not in clan:
+        return False
+    from database import json_db as db
+    async with db.entity_locks(clans=[clan['id']]):
+        if 'chat_history' not in clan:
+            return False  # Migrated while waiting for the lock
+        history = clan.pop('chat_history') or []
+        chat = await _get_chat(clan['id'])
+        if history and not chat.last_seq:
+            await append_messages(clan['id'], history)
+        await db.save_clan(clan)
+    return True
+
+
+async def delete_chat(clan_id: str):
+    """Drop a disbanded clan's chat"""
+    _chats.pop(clan_id, None)
+    try:
+        if os.path.exists(_chat_path(clan_id)):
+            os.remove(_chat_path(clan_id))
+    except IOError as e:
+        print(f"Error deleting clan chat {clan_id}: {e}")
@@ -0,0 +1,108 @@
+"""
+Clan Model
+Clan documents with members indexed by player id and roles kept as sets
+"""
+
+from typing import Callable, Dict, List, Optional, Set
+
+ROLES = ('member', 'elder', 'co-leader', 'leader')
+MANAGER_ROLES = ('leader', 'co-leader')
+
+
+class Clan:
+    """A clan document; member lookups and role checks are O(1)"""
+
+    # Other fields read and write like the stored dict (clan['stats'], clan.get('type'));
+    # to_dict() gives back the stored format with members as a list
+    def __init__(self, data: Dict):
+        self.load(data)
+
+    def load(self, data: Dict):
+        """Replace the contents with a stored-format document"""
+        self.data = {key: value for key, value in data.items() if key != 'members'}
+        # player_id -> member entry (insertion ordered, like the stored list)
+        self.members: Dict[str, Dict] = {}
+        # role -> player_ids with that role
+        self.roles: Dict[str, Set[str]] = {role: set() for role in ROLES}
+        for member in data.get('members', []):
+            if member.get('player_id'):
+                self.add_member(member)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Clan':
+        return cls(data)
+
+    def to_dict(self, online: Callable[[str], bool] = None) -> Dict:
+        """Stored format; pass an online check to add each member's online status"""
+        if online:
+            members = [{**member, 'online': online(player_id)} for player_id, member in self.members.items()]
+        else:
+            members = list(self.members.values())
+        return {**self.data, 'members': members}
+
+    # Document fields
+    @property
+    def id(self) -> str:
+        return self.data['id']
+
+    def __getitem__(self, key: str):
+        return self.data[key]
+
+    def __setitem__(self, key: str, value):
+        self.data[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def setdefault(self, key: str, default=None):
+        return self.data.setdefault(key, default)
+
+    def pop(self, key: str, *default):
+        return self.data.pop(key, *default)
+
+    # Members
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def member(self, player_id: str) -> Optional[Dict]:
+        return self.members.get(player_id)
+
+    def role(self, player_id: str) -> Optional[str]:
+        member = self.members.get(player_id)
+        return member.get('role', 'member') if member else None
+
+    def has_role(self, player_id: str, *roles: str) -> bool:
+        return any(player_id in self.roles.get(role, ()) for role in roles)
+
+    def is_manager(self, player_id: str) -> bool:
+        """Leader or co-leader"""
+        return self.has_role(player_id, *MANAGER_ROLES)
+
+    def with_role(self, role: str) -> Set[str]:
+        return self.roles.get(role, set())
+
+    def add_member(self, member: Dict):
+        player_id = member['player_id']
+        self.remove_member(player_id)
+        member.setdefault('role', 'member')
+        self.members[player_id] = member
+        self.roles.setdefault(member['role'], set()).add(player_id)
+
+    def remove_member(self, player_id: str) -> Optional[Dict]:
+        member = self.members.pop(player_id, None)
+        if member:
+            self.roles.get(member.get('role', 'member'), set()).discard(player_id)
+        return member
+
+    def set_role(self, player_id: str, role: str):
+        member = self.members[player_id]
+        self.roles.get(member.get('role', 'member'), set()).discard(player_id)
+        member['role'] = role
+        self.roles.setdefault(role, set()).add(player_id)
+
+    def member_ids(self) -> List[str]:
+        return list(self.members)
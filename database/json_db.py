@@ -5,24 +5,31 @@ With caching for improved performance
 """
 
 import os
+import copy
 import json
 import asyncio
 import aiofiles
-from typing import Optional, Dict, List, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, Optional, Dict, List, Any, Set, Tuple, Union
 from datetime import datetime
 import uuid
 import time
 
+from database.clan_model import Clan
+from database.rank_index import RankIndex
+
 # Base data directory
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
 # Ensure directories exist
-SUBDIRS = ['players', 'clans', 'tournaments', 'trades']
+SUBDIRS = ['players', 'clans', 'tournaments', 'trades', 'replays', 'clan_chat']
 for subdir in SUBDIRS:
     os.makedirs(os.path.join(DATA_DIR, subdir), exist_ok=True)
 
 # File locks for concurrent access
 _locks: Dict[str, asyncio.Lock] = {}
+# Entity locks held by transactions ('player:<id>', 'clan:<id>', 'trade:<id>')
+_entity_locks: Dict[str, asyncio.Lock] = {}
 
 # ==================== CACHING SYSTEM ====================
 # Cache players in memory to reduce file I/O
@@ -31,6 +38,29 @@ _username_index: Dict[str, str] = {}  # username -> player_id
 _cache_timestamps: Dict[str, float] = {}
 CACHE_TTL = 60  # Cache expires after 60 seconds
 
+# Leaderboards: stat field -> RankIndex of player_id by that stat (built on first use)
+LEADERBOARD_FIELDS = ['trophies', 'medals', 'comp_wins']
+_leaderboards: Dict[str, RankIndex] = {}
+
+# Clans: write-through cache of every clan (loaded once), a trigram index over names
+# and a ranking by member count, so searches never touch the clan files
+_clan_cache: Dict[str, Clan] = {}
+_clan_names: Dict[str, str] = {}  # clan_id -> indexed lowercase name
+_clan_trigrams: Dict[str, Set[str]] = {}  # trigram -> clan_ids
+_clan_ranking = RankIndex()  # clan_id by member count
+_clans_loaded = False
+CLAN_SEARCH_LIMIT = 50
+MAX_CLAN_MEMBERS = 50
+
+# Clan aggregates, kept up to date as members join, leave and win or lose trophies
+# (a member's last counted trophies are remembered so each change is applied as a delta)
+CLAN_LEADERBOARD_FIELDS = ['trophies', 'donations', 'war_trophies']
+_clan_totals: Dict[str, Dict[str, int]] = {}  # clan_id -> aggregate -> value
+_clan_leaderboards: Dict[str, RankIndex] = {field: RankIndex() for field in CLAN_LEADERBOARD_FIELDS}
+_clan_member_ids: Dict[str, Set[str]] = {}  # clan_id -> member ids when last indexed
+_member_clan: Dict[str, str] = {}  # player_id -> clan_id counting their trophies
+_member_trophies: Dict[str, int] = {}  # player_id -> trophies counted in their clan's total
+
 def _is_cache_valid(player_id: str) -> bool:
     """Check if cached data is still valid"""
     if player_id not in _cache_timestamps:
@@ -77,7 +107,8 @@ async def warm_cache():
             except Exception as e:
                 print(f"Error caching {filename}: {e}")
 
-    print(f"Cache warmed: {count} players loaded")
+    await _load_clans()
+    print(f"Cache warmed: {count} players, {len(_clan_cache)} clans loaded")
     return count
 
 def _get_lock(path: str) -> asyncio.Lock:
@@ -139,15 +170,28 @@ async def get_player(player_id: str) -> Optional[Dict]:
 
 async def save_player(player: Dict) -> bool:
     """Save a player (create or update) and update cache"""
-    player['updated_at'] = datetime.now().timestamp()
-    success = await write_json(_player_path(player['id']), player)
-    if success:
+    return await save_players([player])
+
+async def save_players(players: List[Dict]) -> bool:
+    """Save several players with concurrent writes, then update cache and leaderboards once"""
+    now = datetime.now().timestamp()
+    for player in players:
+        player['updated_at'] = now
+
+    results = await asyncio.gather(*(write_json(_player_path(p['id']), p) for p in players))
+
+    saved = [player for player, success in zip(players, results) if success]
+    for player in saved:
         _cache_player(player)
-    return success
+    _update_leaderboards(saved)
+    _update_clan_trophies(saved)
+    return all(results)
 
 async def delete_player(player_id: str) -> bool:
     """Delete a player and remove from cache"""
     _invalidate_cache(player_id)
+    for index in _leaderboards.values():
+        index.remove(player_id)
     return await delete_json(_player_path(player_id))
 
 async def find_player_by_username(username: str) -> Optional[Dict]:
@@ -206,21 +250,44 @@ async def get_all_players(include_banned: bool = False) -> List[Dict]:
 
     return players
 
+def _is_ranked(player: Dict) -> bool:
+    """Guests and banned players are left off leaderboards"""
+    return not player.get('is_guest', False) and not player.get('banned', False)
+
+def _leaderboard_score(player: Dict, field: str) -> float:
+    value = player.get('stats', {}).get(field, 0)
+    return value if isinstance(value, (int, float)) else 0
+
+def _update_leaderboards(players: List[Dict]):
+    """Move saved players to their new leaderboard positions"""
+    if not _leaderboards:
+        return
+    for player in players:
+        ranked = _is_ranked(player)
+        for field, index in _leaderboards.items():
+            index.update(player['id'], _leaderboard_score(player, field) if ranked else None)
+
+async def _get_leaderboard_index(sort_by: str) -> RankIndex:
+    """Get a leaderboard index, building all of them from disk on first use"""
+    if not _leaderboards:
+        players = await get_all_players()
+        indexes = {field: RankIndex() for field in LEADERBOARD_FIELDS}
+        for player in players:
+            for field, index in indexes.items():
+                index.update(player['id'], _leaderboard_score(player, field))
+        _leaderboards.update(indexes)
+    return _leaderboards.get(sort_by, _leaderboards['trophies'])
+
 async def get_leaderboard(sort_by: str = 'trophies', limit: int = 100) -> List[Dict]:
     """Get sorted leaderboard"""
-    players = await get_all_players()
-
-    # Sort by the specified field
-    if sort_by == 'trophies':
-        players.sort(key=lambda p: p.get('stats', {}).get('trophies', 0), reverse=True)
-    elif sort_by == 'medals':
-        players.sort(key=lambda p: p.get('stats', {}).get('medals', 0), reverse=True)
-    elif sort_by == 'comp_wins':
-        players.sort(key=lambda p: p.get('stats', {}).get('comp_wins', 0), reverse=True)
+    index = await _get_leaderboard_index(sort_by)
 
     # Return top N with ranking info
     result = []
-    for i, player in enumerate(players[:limit]):
+    for i, (player_id, _) in enumerate(index.top(limit)):
+        player = _player_cache.get(player_id) or await get_player(player_id)
+        if not player:
+            continue
         result.append({
             'rank': i + 1,
             'id': player['id'],
@@ -233,76 +300,243 @@ async def get_leaderboard(sort_by: str = 'trophies', limit: int = 100) -> List[D
 
 async def get_player_rank(player_id: str, sort_by: str = 'trophies') -> int:
     """Get a player's rank on the leaderboard"""
-    players = await get_all_players()
-
-    if sort_by == 'trophies':
-        players.sort(key=lambda p: p.get('stats', {}).get('trophies', 0), reverse=True)
-    elif sort_by == 'medals':
-        players.sort(key=lambda p: p.get('stats', {}).get('medals', 0), reverse=True)
-    elif sort_by == 'comp_wins':
-        players.sort(key=lambda p: p.get('stats', {}).get('comp_wins', 0), reverse=True)
+    index = await _get_leaderboard_index(sort_by)
+    return index.rank(player_id)
 
-    for i, player in enumerate(players):
-        if player['id'] == player_id:
-            return i + 1
-    return -1
+async def get_ranked_player_count() -> int:
+    """Number of players on the leaderboards"""
+    index = await _get_leaderboard_index('trophies')
+    return len(index)
 
 # ==================== CLAN OPERATIONS ====================
 
 def _clan_path(clan_id: str) -> str:
     return os.path.join(DATA_DIR, 'clans', f'{clan_id}.json')
 
-async def get_clan(clan_id: str) -> Optional[Dict]:
-    """Get a clan by ID"""
-    return await read_json(_clan_path(clan_id))
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _drop_clan_name(clan_id: str):
+    """Remove a clan's name from the trigram index"""
+    old_name = _clan_names.pop(clan_id, None)
+    if old_name is None:
+        return
+    for trigram in _trigrams(old_name):
+        ids = _clan_trigrams.get(trigram)
+        if ids:
+            ids.discard(clan_id)
+            if not ids:
+                del _clan_trigrams[trigram]
+
+def _add_member_trophies(player_id: str, clan_id: str):
+    """Count a member's trophies (from the player cache) in their clan's total"""
+    _remove_member_trophies(player_id)
+    player = _player_cache.get(player_id)
+    trophies = int(_leaderboard_score(player, 'trophies')) if player else 0
+    _member_clan[player_id] = clan_id
+    _member_trophies[player_id] = trophies
+    _clan_totals[clan_id]['trophies'] += trophies
+
+def _remove_member_trophies(player_id: str):
+    clan_id = _member_clan.pop(player_id, None)
+    trophies = _member_trophies.pop(player_id, 0)
+    if clan_id in _clan_totals:
+        _clan_totals[clan_id]['trophies'] -= trophies
+
+def _rank_clan(clan_id: str):
+    totals = _clan_totals[clan_id]
+    for field, index in _clan_leaderboards.items():
+        index.update(clan_id, totals[field])
+
+def _update_clan_trophies(players: List[Dict]):
+    """Apply saved players' trophy changes to their clans' totals"""
+    changed = set()
+    for player in players:
+        clan_id = _member_clan.get(player['id'])
+        if clan_id is None:
+            continue
+        trophies = int(_leaderboard_score(player, 'trophies'))
+        delta = trophies - _member_trophies[player['id']]
+        if delta:
+            _member_trophies[player['id']] = trophies
+            _clan_totals[clan_id]['trophies'] += delta
+            changed.add(clan_id)
+    for clan_id in changed:
+        _rank_clan(clan_id)
+
+def _index_clan(clan: Clan):
+    """Cache a clan and move it in the name index, rankings and aggregates"""
+    clan_id = clan['id']
+    _clan_cache[clan_id] = clan
+    name = clan.get('name', '').lower()
+    if _clan_names.get(clan_id) != name:
+        _drop_clan_name(clan_id)
+        for trigram in _trigrams(name):
+            _clan_trigrams.setdefault(trigram, set()).add(clan_id)
+        _clan_names[clan_id] = name
+    _clan_ranking.update(clan_id, clan.member_count)
+
+    # Only members who joined or left since the last save change the trophy total
+    totals = _clan_totals.setdefault(clan_id, {field: 0 for field in CLAN_LEADERBOARD_FIELDS})
+    old_members = _clan_member_ids.get(clan_id, set())
+    members = set(clan.members)
+    for player_id in old_members - members:
+        if _member_clan.get(player_id) == clan_id:
+            _remove_member_trophies(player_id)
+    for player_id in members - old_members:
+        _add_member_trophies(player_id, clan_id)
+    _clan_member_ids[clan_id] = members
+    totals['donations'] = sum(member.get('donations', 0) for member in clan.members.values())
+    totals['war_trophies'] = clan.get('stats', {}).get('war_trophies', 0)
+    _rank_clan(clan_id)
+
+def _unindex_clan(clan_id: str):
+    _drop_clan_name(clan_id)
+    _clan_cache.pop(clan_id, None)
+    _clan_ranking.remove(clan_id)
+    for player_id in _clan_member_ids.pop(clan_id, set()):
+        if _member_clan.get(player_id) == clan_id:
+            _remove_member_trophies(player_id)
+    _clan_totals.pop(clan_id, None)
+    for index in _clan_leaderboards.values():
+        index.remove(clan_id)
+
+async def _cache_clan(data: Dict) -> Clan:
+    """Index a clan read from disk, loading any members missing from the player cache first"""
+    clan = Clan.from_dict(data)
+    for player_id in clan.members:
+        if player_id not in _player_cache:
+            await get_player(player_id)
+    _index_clan(clan)
+    return clan
+
+async def _load_clans():
+    """Load every clan file into the cache once"""
+    global _clans_loaded
+    if _clans_loaded:
+        return
+    clans_dir = os.path.join(DATA_DIR, 'clans')
+    if os.path.exists(clans_dir):
+        for filename in os.listdir(clans_dir):
+            if filename.endswith('.json') and filename[:-5] not in _clan_cache:
+                clan = await read_json(os.path.join(clans_dir, filename))
+                if clan:
+                    await _cache_clan(clan)
+    _clans_loaded = True
+
+async def get_clan(clan_id: str) -> Optional[Clan]:
+    """Get a clan by ID (cached model)"""
+    if clan_id in _clan_cache:
+        return _clan_cache[clan_id]
+    data = await read_json(_clan_path(clan_id))
+    if not data:
+        return None
+    return await _cache_clan(data)
 
-async def save_clan(clan: Dict) -> bool:
-    """Save a clan"""
-    clan['updated_at'] = datetime.now().timestamp()
-    return await write_json(_clan_path(clan['id']), clan)
+async def save_clan(clan: Union[Clan, Dict]) -> bool:
+    """Save a clan (model or stored-format dict) and update the cache and indexes"""
+    return await save_clans([clan])
+
+async def save_clans(clans: List[Union[Clan, Dict]]) -> bool:
+    """Save several clans with concurrent writes, then update the cache and indexes"""
+    clans = [clan if isinstance(clan, Clan) else Clan.from_dict(clan) for clan in clans]
+    now = datetime.now().timestamp()
+    for clan in clans:
+        clan['updated_at'] = now
+
+    results = await asyncio.gather(*(write_json(_clan_path(clan.id), clan.to_dict()) for clan in clans))
+
+    for clan, success in zip(clans, results):
+        if success:
+            _index_clan(clan)
+    return all(results)
 
 async def delete_clan(clan_id: str) -> bool:
     """Delete a clan"""
+    _unindex_clan(clan_id)
     return await delete_json(_clan_path(clan_id))
 
-async def get_all_clans() -> List[Dict]:
+async def get_all_clans() -> List[Clan]:
     """Get all clans"""
-    clans = []
-    clans_dir = os.path.join(DATA_DIR, 'clans')
-
-    if not os.path.exists(clans_dir):
-        return clans
+    await _load_clans()
+    return list(_clan_cache.values())
 
-    for filename in os.listdir(clans_dir):
-        if filename.endswith('.json'):
-            clan = await read_json(os.path.join(clans_dir, filename))
-            if clan:
-                clans.append(clan)
-    return clans
+def _clan_summary(clan: Clan) -> Dict:
+    return {
+        'id': clan.id,
+        'name': clan['name'],
+        'badge': clan.get('badge', 'default'),
+        'members': clan.member_count,
+        'max_members': MAX_CLAN_MEMBERS,
+        'required_trophies': clan.get('required_trophies', 0),
+        'type': clan.get('type', 'open'),
+        'trophies': _clan_totals.get(clan.id, {}).get('trophies', 0),
+        'war_trophies': clan.get('stats', {}).get('war_trophies', 0),
+    }
 
-async def search_clans(query: str = '', min_trophies: int = 0) -> List[Dict]:
-    """Search clans by name"""
-    clans = await get_all_clans()
-    query_lower = query.lower()
+async def search_clans(query: str = '', min_trophies: Optional[int] = None, offset: int = 0,
+                       limit: int = CLAN_SEARCH_LIMIT) -> Tuple[List[Dict], int]:
+    """Search clans by name, most members first; returns one page and the total match count"""
+    await _load_clans()
+    query_lower = query.lower().strip()
+
+    if not query_lower:
+        if min_trophies is None:
+            # Straight from the ranking
+            page = [_clan_summary(_clan_cache[clan_id]) for clan_id, _ in _clan_ranking.top(limit, offset)]
+            return page, len(_clan_ranking)
+        ordered = [clan_id for clan_id, _ in _clan_ranking.top(len(_clan_ranking))]
+    else:
+        if len(query_lower) >= 3:
+            # Clans containing every trigram of the query (then checked for the whole substring)
+            postings = sorted((_clan_trigrams.get(t, set()) for t in _trigrams(query_lower)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        else:
+            candidates = _clan_names.keys()
+        ordered = sorted(
+            (clan_id for clan_id in candidates if query_lower in _clan_names[clan_id]),
+            key=lambda clan_id: (-_clan_ranking.score(clan_id), clan_id),
+        )
+
+    # Only clans the player's trophies qualify for
+    matches = [
+        clan_id for clan_id in ordered
+        if min_trophies is None or _clan_cache[clan_id].get('required_trophies', 0) <= min_trophies
+    ]
+
+    page = [_clan_summary(_clan_cache[clan_id]) for clan_id in matches[offset:offset + limit]]
+    return page, len(matches)
+
+def get_clan_totals(clan_id: str) -> Dict[str, int]:
+    """A clan's aggregates (total member trophies, donations, war trophies)"""
+    return dict(_clan_totals.get(clan_id, {field: 0 for field in CLAN_LEADERBOARD_FIELDS}))
+
+def get_member_trophies(player_id: str) -> int:
+    """Trophies a clan member currently adds to their clan's total"""
+    return _member_trophies.get(player_id, 0)
+
+async def get_clan_leaderboard(sort_by: str = 'trophies', limit: int = 100,
+                               offset: int = 0) -> Tuple[List[Dict], int]:
+    """Clans ranked by an aggregate; returns one page and the number of ranked clans"""
+    await _load_clans()
+    index = _clan_leaderboards.get(sort_by, _clan_leaderboards['trophies'])
+    page = []
+    for i, (clan_id, _) in enumerate(index.top(limit, offset)):
+        clan = _clan_cache[clan_id]
+        page.append({
+            'rank': offset + i + 1,
+            'id': clan_id,
+            'name': clan['name'],
+            'badge': clan.get('badge', 'default'),
+            'members': clan.member_count,
+            **_clan_totals[clan_id],
+        })
+    return page, len(index)
 
-    results = []
-    for clan in clans:
-        if query_lower in clan.get('name', '').lower():
-            if clan.get('required_trophies', 0) <= min_trophies or not query:
-                results.append({
-                    'id': clan['id'],
-                    'name': clan['name'],
-                    'badge': clan.get('badge', 'default'),
-                    'members': len(clan.get('members', [])),
-                    'max_members': 50,
-                    'required_trophies': clan.get('required_trophies', 0),
-                    'type': clan.get('type', 'open'),
-                    'war_trophies': clan.get('stats', {}).get('war_trophies', 0),
-                })
-
-    # Sort by member count
-    results.sort(key=lambda c: c['members'], reverse=True)
-    return results[:50]
+async def get_clan_rank(clan_id: str, sort_by: str = 'trophies') -> int:
+    """A clan's rank on a clan leaderboard (-1 if unknown)"""
+    await _load_clans()
+    return _clan_leaderboards.get(sort_by, _clan_leaderboards['trophies']).rank(clan_id)
 
 # ==================== TOURNAMENT OPERATIONS ====================
 
@@ -394,6 +628,108 @@ async def get_player_trades(player_id: str) -> List[Dict]:
                 trades.append(trade)
     return trades
 
+# ==================== TRANSACTIONS ====================
+
+class Transaction:
+    """Entities locked by transaction(), by id (None if missing); mutate them in place"""
+
+    def __init__(self):
+        self.players: Dict[str, Optional[Dict]] = {}
+        self.clans: Dict[str, Optional[Clan]] = {}
+        self.trades: Dict[str, Optional[Dict]] = {}
+        self.saved = False
+
+def _entity_lock(key: str) -> asyncio.Lock:
+    if key not in _entity_locks:
+        _entity_locks[key] = asyncio.Lock()
+    return _entity_locks[key]
+
+def _entities(txn: Transaction) -> List[Tuple[str, Any]]:
+    """('<kind>:<id>', entity) for every entity in a transaction"""
+    return [
+        (f'{kind}:{entity_id}', entity)
+        for kind, entities in (('player', txn.players), ('clan', txn.clans), ('trade', txn.trades))
+        for entity_id, entity in entities.items()
+    ]
+
+def _restore(txn: Transaction, before: Dict[str, Dict]):
+    """Put a transaction's entities back to their snapshots (in place, so cached objects stay shared)"""
+    for key, entity in _entities(txn):
+        snapshot = before.get(key)
+        if snapshot is None or entity is None:
+            continue
+        if isinstance(entity, Clan):
+            entity.load(copy.deepcopy(snapshot))
+        else:
+            entity.clear()
+            entity.update(copy.deepcopy(snapshot))
+
+async def _save_entity(key: str, entity) -> bool:
+    kind = key.split(':', 1)[0]
+    if kind == 'player':
+        return await save_players([entity])
+    if kind == 'clan':
+        return await save_clans([entity])
+    return await save_trade(entity)
+
+@asynccontextmanager
+async def entity_locks(players: Iterable[str] = (), clans: Iterable[str] = (),
+                       trades: Iterable[str] = ()) -> AsyncIterator[None]:
+    """Hold the transaction locks of players, clans and trades (for writers that save on their own)"""
+    # Locks are taken in sorted key order so overlapping holders queue up instead of deadlocking;
+    # holders of unrelated entities run in parallel
+    keys = sorted({f'player:{i}' for i in players} | {f'clan:{i}' for i in clans} | {f'trade:{i}' for i in trades})
+    held = []
+    try:
+        for key in keys:
+            lock = _entity_lock(key)
+            await lock.acquire()
+            held.append(lock)
+        yield
+    finally:
+        for lock in reversed(held):
+            lock.release()
+
+@asynccontextmanager
+async def transaction(players: List[str] = (), clans: List[str] = (),
+                      trades: List[str] = ()) -> AsyncIterator[Transaction]:
+    """Lock players, clans and trades, yield them, then save every changed one in one batch"""
+    # An exception restores the entities and saves nothing; a failed save restores them too, and txn.saved
+    # tells the caller. An entity set to None in the transaction (e.g. deleted) is left alone.
+    async with entity_locks(players, clans, trades):
+        # Read after locking, so each transaction sees the previous one's result
+        txn = Transaction()
+        for player_id in players:
+            txn.players[player_id] = await get_player(player_id)
+        for clan_id in clans:
+            txn.clans[clan_id] = await get_clan(clan_id)
+        for trade_id in trades:
+            txn.trades[trade_id] = await get_trade(trade_id)
+        before: Dict[str, Dict] = {
+            key: copy.deepcopy(entity.to_dict() if isinstance(entity, Clan) else entity)
+            for key, entity in _entities(txn) if entity is not None
+        }
+
+        try:
+            yield txn
+        except BaseException:
+            _restore(txn, before)
+            raise
+
+        changed = [
+            (key, entity) for key, entity in _entities(txn)
+            if entity is not None and (entity.to_dict() if isinstance(entity, Clan) else entity) != before.get(key)
+        ]
+        results = await asyncio.gather(*(_save_entity(key, entity) for key, entity in changed))
+        txn.saved = all(results)
+        if not txn.saved:
+            # Put everything back, in memory and on disk for the writes that did succeed,
+            # so a failed transaction leaves no half-applied change behind
+            _restore(txn, before)
+            await asyncio.gather(*(
+                _save_entity(key, entity) for (key, entity), saved in zip(changed, results) if saved
+            ))
+
 # ==================== UTILITY FUNCTIONS ====================
 
 def generate_id() -> str:
@@ -505,7 +841,6 @@ def create_clan_template(clan_id: str, name: str, creator_id: str, creator_name:
             }
         ],
 
-        'chat_history': [],
         'donation_requests': [],
 
         'war': {
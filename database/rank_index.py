@@ -0,0 +1,144 @@
+"""
+Rank Index
+Sorted score index with incremental updates and bucketed rank lookups
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SORTED_BUCKET = 512  # Keys per bucket of a SortedKeyList (split at twice this)
+
+
+class SortedKeyList:
+    """Sorted keys kept in bounded buckets: O(log n + B) inserts and deletes, O(n / B + log B) positions"""
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._buckets: List[List[Any]] = [keys[i:i + SORTED_BUCKET] for i in range(0, len(keys), SORTED_BUCKET)]
+        self._maxes: List[Any] = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        for bucket in self._buckets:
+            yield from bucket
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+        else:
+            i = bisect_left(self._maxes, key)
+            if i == len(self._maxes):
+                i -= 1
+                self._buckets[i].append(key)
+                self._maxes[i] = key
+            else:
+                insort(self._buckets[i], key)
+            bucket = self._buckets[i]
+            if len(bucket) > 2 * SORTED_BUCKET:
+                self._buckets[i:i + 1] = [bucket[:SORTED_BUCKET], bucket[SORTED_BUCKET:]]
+                self._maxes[i:i + 1] = [bucket[SORTED_BUCKET - 1], bucket[-1]]
+        self._len += 1
+
+    def remove(self, key) -> bool:
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        if bucket[j] != key:
+            return False
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            if len(bucket) < SORTED_BUCKET // 4 and len(self._buckets) > 1:
+                self._merge(min(i, len(self._buckets) - 2))
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+        return True
+
+    def _merge(self, i: int):
+        """Merge a small bucket with the next one (splitting again if that is too big)"""
+        merged = self._buckets[i] + self._buckets[i + 1]
+        if len(merged) > 2 * SORTED_BUCKET:
+            half = len(merged) // 2
+            self._buckets[i:i + 2] = [merged[:half], merged[half:]]
+            self._maxes[i:i + 2] = [merged[half - 1], merged[-1]]
+        else:
+            self._buckets[i:i + 2] = [merged]
+            self._maxes[i:i + 2] = [merged[-1]]
+
+    def _offset(self, bucket_index: int) -> int:
+        return sum(len(bucket) for bucket in self._buckets[:bucket_index])
+
+    def bisect_left(self, key) -> int:
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._offset(i) + bisect_left(self._buckets[i], key)
+
+    def bisect_right(self, key) -> int:
+        i = bisect_right(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._offset(i) + bisect_right(self._buckets[i], key)
+
+    def islice(self, start: int, stop: int) -> List[Any]:
+        """Keys at positions start .. stop-1"""
+        keys = []
+        pos = 0
+        for bucket in self._buckets:
+            if pos >= stop:
+                break
+            if pos + len(bucket) > start:
+                keys.extend(bucket[max(0, start - pos):stop - pos])
+            pos += len(bucket)
+        return keys
+
+
+class RankIndex:
+    """Members ordered by score (highest first), ties broken by member id"""
+
+    def __init__(self):
+        self._keys = SortedKeyList()  # (-score, member_id), ascending
+        self._scores: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, member_id: str) -> bool:
+        return member_id in self._scores
+
+    def update(self, member_id: str, score: Optional[float]):
+        """Set a member's score (None removes the member)"""
+        old = self._scores.get(member_id)
+        if old == score:
+            return
+        if old is not None:
+            self._keys.remove((-old, member_id))
+            del self._scores[member_id]
+        if score is not None:
+            self._keys.add((-score, member_id))
+            self._scores[member_id] = score
+
+    def remove(self, member_id: str):
+        self.update(member_id, None)
+
+    def score(self, member_id: str) -> Optional[float]:
+        return self._scores.get(member_id)
+
+    def rank(self, member_id: str) -> int:
+        """1-based rank of a member, -1 if not ranked"""
+        score = self._scores.get(member_id)
+        if score is None:
+            return -1
+        return self._keys.bisect_left((-score, member_id)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> List[Tuple[str, float]]:
+        """Members and scores for ranks offset+1 .. offset+limit"""
+        return [(member_id, -neg) for neg, member_id in self._keys.islice(offset, offset + limit)]
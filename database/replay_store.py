@@ -0,0 +1,156 @@
+"""
+Replay Store
+Append-only segment files for finished battle replays, indexed by battle and player
+"""
+
+import os
+import json
+import asyncio
+import aiofiles
+from typing import Optional, Dict, List, Tuple, AsyncIterator
+
+from database.json_db import DATA_DIR
+
+REPLAY_DIR = os.path.join(DATA_DIR, 'replays')
+INDEX_PATH = os.path.join(REPLAY_DIR, 'index.jsonl')
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024  # Start a new segment after 16 MB
+PLAYER_REPLAY_LIMIT = 50  # Recent replays kept in each player's index
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# battle_id -> index entry (segment, offset, length + battle metadata)
+_battle_index: Dict[str, Dict] = {}
+# player_id -> recent battle_ids (oldest first)
+_player_index: Dict[str, List[str]] = {}
+_current_segment = 0
+_loaded = False
+_lock = asyncio.Lock()
+
+
+def _segment_path(segment: int) -> str:
+    return os.path.join(REPLAY_DIR, f'segment-{segment:06d}.bin')
+
+
+def _index_entry(entry: Dict):
+    """Add an entry to the in-memory indexes"""
+    battle_id = entry['battle_id']
+    _battle_index[battle_id] = entry
+    for player_id in entry.get('players', []):
+        battle_ids = _player_index.setdefault(player_id, [])
+        battle_ids.append(battle_id)
+        if len(battle_ids) > PLAYER_REPLAY_LIMIT:
+            del battle_ids[0]
+
+
+async def _load_index():
+    """Load the index log on first use (must hold lock)"""
+    global _current_segment, _loaded
+    if _loaded:
+        return
+    if os.path.exists(INDEX_PATH):
+        async with aiofiles.open(INDEX_PATH, 'r', encoding='utf-8') as f:
+            async for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn final line from a crash
+                _index_entry(entry)
+                _current_segment = max(_current_segment, entry['segment'])
+    _loaded = True
+
+
+async def save_replay(battle_id: str, data: bytes, metadata: Dict) -> bool:
+    """Append a replay to the current segment and record it in the index"""
+    return await save_replays([(battle_id, data, metadata)])
+
+
+async def save_replays(replays: List[Tuple[str, bytes, Dict]]) -> bool:
+    """Append a batch of replays with one segment write and one index write"""
+    global _current_segment
+    try:
+        async with _lock:
+            await _load_index()
+
+            path = _segment_path(_current_segment)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            chunks = []
+            entries = []
+            seen = set()
+            for battle_id, data, metadata in replays:
+                if battle_id in _battle_index or battle_id in seen:
+                    continue
+                seen.add(battle_id)
+                if offset and offset + len(data) > SEGMENT_MAX_BYTES:
+                    await _write_segment(path, chunks)
+                    chunks = []
+                    _current_segment += 1
+                    path = _segment_path(_current_segment)
+                    offset = 0
+                chunks.append(data)
+                entries.append({
+                    **metadata,
+                    'battle_id': battle_id,
+                    'segment': _current_segment,
+                    'offset': offset,
+                    'length': len(data),
+                })
+                offset += len(data)
+
+            if not entries:
+                return True
+            await _write_segment(path, chunks)
+            async with aiofiles.open(INDEX_PATH, 'a', encoding='utf-8') as f:
+                await f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            for entry in entries:
+                _index_entry(entry)
+        return True
+    except IOError as e:
+        print(f"Error saving replays: {e}")
+        return False
+
+
+async def _write_segment(path: str, chunks: List[bytes]):
+    """Append replay blobs to a segment file"""
+    if chunks:
+        async with aiofiles.open(path, 'ab') as f:
+            await f.write(b''.join(chunks))
+
+
+async def get_replay_info(battle_id: str) -> Optional[Dict]:
+    """Get the index entry for a replay"""
+    async with _lock:
+        await _load_index()
+    return _battle_index.get(battle_id)
+
+
+async def get_player_replays(player_id: str, limit: int = 20) -> List[Dict]:
+    """Get a player's most recent replays (newest first)"""
+    async with _lock:
+        await _load_index()
+    battle_ids = _player_index.get(player_id, [])[-limit:]
+    return [_battle_index[b] for b in reversed(battle_ids)]
+
+
+async def iter_replay(battle_id: str) -> AsyncIterator[bytes]:
+    """Yield a replay's bytes in chunks straight from its segment"""
+    entry = await get_replay_info(battle_id)
+    if not entry:
+        return
+    remaining = entry['length']
+    async with aiofiles.open(_segment_path(entry['segment']), 'rb') as f:
+        await f.seek(entry['offset'])
+        while remaining > 0:
+            chunk = await f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def read_replay(battle_id: str) -> Optional[bytes]:
+    """Read a whole replay into memory"""
+    if not await get_replay_info(battle_id):
+        return None
+    return b''.join([chunk async for chunk in iter_replay(battle_id)])
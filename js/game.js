@@ -239,6 +239,8 @@ const NET = {
               this.updateConnectionStatus('online');
               this.hideDisconnectWarning();
               this.updateOnlineIndicator();
+              // Channel subscriptions don't survive a reconnect; pick up missed clan events too
+              if(typeof resyncClan==='function')resyncClan();
               resolve();
             } else if (msg.type === 'auth_error') {
               this.updateConnectionStatus('offline');
@@ -423,6 +425,7 @@ const NET = {
         if (clanData.clan) {
           P.clan = clanData.clan;
           P.clanId = serverPlayer.clan_id;
+          if(typeof loadClanChat==='function')await loadClanChat();
           // Subscribe to clan chat channel
           if(typeof subscribeToClanChannel==='function')subscribeToClanChannel();
         }
@@ -601,10 +604,40 @@ NET.on('battle_action', (data) => {
 
 NET.on('battle_state', (data) => {
   if (typeof B !== 'undefined' && B.isMultiplayer) {
+    if (data.seq) B.stateSeq = data.seq;
     syncBattleState(data);
   }
 });
 
+NET.on('battle_delta', (data) => {
+  if (typeof B !== 'undefined' && B.isMultiplayer) {
+    // Ignore stale deltas (a newer keyframe already covered them)
+    if (B.stateSeq && data.seq <= B.stateSeq) return;
+    B.stateSeq = data.seq;
+    applyBattleDelta(data.changes || {});
+  }
+});
+
+NET.on('battle_snapshot', (data) => {
+  // Sent when we rejoin a battle after a dropped connection
+  if (typeof B !== 'undefined' && B && B.isMultiplayer && B.battleId === data.battle_id) {
+    B.stateSeq = data.seq;
+    syncBattleState(data);
+  }
+});
+
+NET.on('opponent_disconnected', (data) => {
+  if (typeof B !== 'undefined' && B && B.isMultiplayer) {
+    showNotify(`Opponent disconnected - waiting ${data.grace}s for them to return`, 'info', '📡');
+  }
+});
+
+NET.on('opponent_reconnected', (data) => {
+  if (typeof B !== 'undefined' && B && B.isMultiplayer) {
+    showNotify('Opponent reconnected', 'success', '📡');
+  }
+});
+
 NET.on('battle_result', async (data) => {
   console.log('Battle result received:', data);
   if (typeof B !== 'undefined' && B.isMultiplayer) {
@@ -1138,6 +1171,32 @@ function syncBattleState(data) {
   document.getElementById('aiCrowns').textContent = B.crowns.ai;
 }
 
+function applyBattleDelta(changes) {
+  if (!B || !B.on) return;
+
+  // Deltas only carry the towers/crowns that changed
+  const myRole = B.myRole || 'player1';
+  const enemyRole = myRole === 'player1' ? 'player2' : 'player1';
+  const towerKeys = { king: 'K', left: 'L', right: 'R' };
+
+  for (const [role, prefix] of [[myRole, 'p'], [enemyRole, 'a']]) {
+    const hp = changes[role + '_hp'];
+    if (!hp) continue;
+    for (const [tower, key] of Object.entries(towerKeys)) {
+      if (hp[tower] !== undefined) B.towers[prefix + key].hp = hp[tower];
+    }
+  }
+
+  if (changes[myRole + '_crowns'] !== undefined) {
+    B.crowns.me = changes[myRole + '_crowns'];
+    document.getElementById('myCrowns').textContent = B.crowns.me;
+  }
+  if (changes[enemyRole + '_crowns'] !== undefined) {
+    B.crowns.ai = changes[enemyRole + '_crowns'];
+    document.getElementById('aiCrowns').textContent = B.crowns.ai;
+  }
+}
+
 async function applyBattleResult(result) {
   P.tr = Math.max(0, (P.tr || 0) + (result.trophy_change || 0));
   P.gold = (P.gold || 0) + (result.gold_earned || 0);
@@ -4368,25 +4427,14 @@ async function deleteClan(){
 }
 
 // ===== REAL-TIME CLAN UPDATES =====
+// Clan changes arrive as numbered clan_event deltas on the clan channel; a gap or a reconnect asks
+// for the missed events, and the clan is only refetched when the server no longer has them
 let clanPollingInterval=null;
 
 function startClanPolling(){
   if(clanPollingInterval)return;
-  clanPollingInterval=setInterval(async()=>{
-    if(!NET.isOnline||!P.clan?.id)return;
-    try{
-      const result=await NET.api(`/api/clan/${P.clan.id}`);
-      if(result.clan){
-        // Preserve local chat history
-        const localChat=P.clan.chatHistory||[];
-        P.clan=result.clan;
-        // Merge chat histories
-        if(!P.clan.chatHistory)P.clan.chatHistory=[];
-        P.clan.chatHistory=[...P.clan.chat_history||[],...localChat.filter(m=>!P.clan.chat_history?.some(s=>s.message===m.msg&&s.sender_name===m.sender))];
-        updateClan();
-      }
-    }catch(e){}
-  },10000); // Poll every 10 seconds
+  // Safety net: ask for missed events (usually none) instead of refetching the whole clan
+  clanPollingInterval=setInterval(syncClanEvents,60000);
 }
 
 function stopClanPolling(){
@@ -4396,6 +4444,83 @@ function stopClanPolling(){
   }
 }
 
+function syncClanEvents(){
+  if(!NET.isOnline||!P.clan?.id)return;
+  NET.send('clan_sync',{clan_id:P.clan.id,since:P.clan.event_seq||0});
+}
+function resyncClan(){
+  subscribeToClanChannel();
+  syncClanEvents();
+}
+async function refetchClan(){
+  if(!NET.isOnline||!P.clan?.id)return;
+  try{
+    const result=await NET.api(`/api/clan/${P.clan.id}`);
+    if(result.clan){
+      const chat=P.clan.chat_history;
+      P.clan=result.clan;
+      P.clan.chat_history=chat;
+      updateClan();
+    }
+  }catch(e){}
+}
+// Apply one event; false if events before it were missed
+function applyClanEvent(ev){
+  const c=P.clan;
+  if(!c||ev.seq<=(c.event_seq||0))return true;
+  if(ev.seq>(c.event_seq||0)+1)return false;
+  c.members=c.members||[];
+  switch(ev.type){
+    case 'member_joined':
+      c.members=c.members.filter(m=>m.player_id!==ev.member.player_id);
+      c.members.push({...ev.member,online:true});
+      break;
+    case 'member_left':
+    case 'member_kicked':
+      c.members=c.members.filter(m=>m.player_id!==ev.player_id);
+      if(ev.player_id===NET.playerId){
+        unsubscribeFromClanChannel(c.id);
+        P.clan=null;P.clanId=null;save();
+        if(ev.type==='member_kicked')showNotify('You were removed from the clan','error');
+        return true;
+      }
+      break;
+    case 'roles_changed':
+      for(const m of c.members)if(ev.roles[m.player_id])m.role=ev.roles[m.player_id];
+      break;
+    case 'donation':{
+      const req=(c.donation_requests||[]).find(r=>r.id===ev.request_id);
+      if(req)req.amount=ev.request_amount;
+      if(ev.filled)c.donation_requests=(c.donation_requests||[]).filter(r=>r.id!==ev.request_id);
+      const donor=c.members.find(m=>m.player_id===ev.donor_id);
+      if(donor)donor.donations=ev.donor_donations;
+      c.stats=c.stats||{};c.stats.total_donations=ev.total_donations;
+      break;
+    }
+    case 'request_created':
+      c.donation_requests=[ev.request,...(c.donation_requests||[]).filter(r=>r.id!==ev.request.id)];
+      break;
+    case 'settings_changed':
+      Object.assign(c,ev.settings);
+      break;
+  }
+  c.event_seq=ev.seq;
+  return true;
+}
+NET.on('clan_event',(data)=>{
+  if(!P.clan||data.clan_id!==P.clan.id)return;
+  if(!applyClanEvent(data)){syncClanEvents();return;}
+  updateClan();
+});
+NET.on('clan_events',(data)=>{
+  if(!P.clan||data.clan_id!==P.clan.id)return;
+  if(data.resync){refetchClan();return;}
+  for(const ev of data.events){
+    if(!applyClanEvent(ev)){refetchClan();return;}
+  }
+  updateClan();
+});
+
 // ===== AI JOIN REQUESTS SYSTEM =====
 function generateJoinRequests(){
   if(!P.clan)return;
@@ -4550,6 +4675,14 @@ function subscribeToClanChannel(){
     NET.send('subscribe',{channel:`clan:${P.clan.id}`});
   }
 }
+// Recent clan chat lives in its own store, not in the clan document
+async function loadClanChat(){
+  if(!P.clan?.id||!NET.isOnline)return;
+  try{
+    const result=await NET.api(`/api/clan/${P.clan.id}/chat?limit=20`);
+    if(result.messages)P.clan.chat_history=result.messages;
+  }catch(e){}
+}
 function unsubscribeFromClanChannel(clanId){
   if(clanId&&NET.isOnline){
     NET.send('unsubscribe',{channel:`clan:${clanId}`});
@@ -20,13 +20,20 @@ from api.auth import routes as auth_routes
 from api.players import routes as player_routes
 from api.clans import routes as clan_routes
 from api.trading import routes as trading_routes
+from api.replays import routes as replay_routes
 
 # Import WebSocket manager
-from websocket.manager import ws_manager
+from websocket.manager import ws_manager, rtt_loop
 
 # Import background tasks
-from services.matchmaking_service import matchmaking, matchmaking_loop
+from services.matchmaking_service import matchmaking, matchmaking_loop, QueueEntry, TEAM_MODES
 from websocket.battle_sync import battle_timer_loop
+from services.battle_results import battle_results, battle_result_loop
+from websocket.spectators import spectators, spectator_loop
+from websocket.battle_bots import bot_runner, bot_loop
+from services.rating import ratings, rating_loop
+from services.clan_war_service import clan_wars, clan_war_loop
+from services.clan_events import clan_events
 
 # Server configuration
 HOST = '0.0.0.0'  # Listen on all interfaces
@@ -39,6 +46,11 @@ def setup_websocket_handlers():
     async def handle_queue_join(ws_mgr, player_id, data):
         """Player wants to join matchmaking queue"""
         from database import json_db as db
+        from websocket.battle_sync import is_player_in_battle
+
+        if is_player_in_battle(player_id):
+            await ws_mgr.send_to_player(player_id, 'error', {'error': 'Already in a battle'})
+            return
 
         player = await db.get_player(player_id)
         if not player:
@@ -50,20 +62,99 @@ def setup_websocket_handlers():
         elo = player.get('stats', {}).get('elo', 1000)
         deck = data.get('deck', player.get('decks', [[]])[player.get('current_deck', 0)])
 
-        success = await matchmaking.join_queue(player_id, mode, trophies, elo, deck)
+        # War battles queue against the opposing clan in that war's own queue
+        clan_id = None
+        if mode == 'clan_war':
+            clan = await db.get_clan(player['clan_id']) if player.get('clan_id') else None
+            mode, error = clan_wars.check_attack(clan, player_id) if clan else (None, 'Not in a clan')
+            if error:
+                await ws_mgr.send_to_player(player_id, 'error', {'error': error})
+                return
+            clan_id = clan.id
+
+        # Team modes queue the player's party together
+        partner = None
+        partner_id = matchmaking.get_partner(player_id) if mode in TEAM_MODES else None
+        if partner_id:
+            partner_data = await db.get_player(partner_id)
+            if not partner_data or not ws_mgr.is_online(partner_id) or is_player_in_battle(partner_id):
+                await ws_mgr.send_to_player(player_id, 'error', {'error': 'Party partner is not available'})
+                return
+            partner = QueueEntry(
+                player_id=partner_id,
+                trophies=partner_data.get('stats', {}).get('trophies', 0),
+                elo=partner_data.get('stats', {}).get('elo', 1000),
+                deck=partner_data.get('decks', [[]])[partner_data.get('current_deck', 0)],
+                mode=mode,
+                rtt=ws_mgr.get_rtt(partner_id),
+            )
+
+        success = await matchmaking.join_queue(player_id, mode, trophies, elo, deck, partner=partner,
+                                               rtt=ws_mgr.get_rtt(player_id), clan_id=clan_id)
 
         if success:
-            await ws_mgr.send_to_player(player_id, 'queue_joined', {
-                'mode': mode,
-                'position': matchmaking.get_queue_position(player_id),
-            })
+            for member_id in [player_id] + ([partner_id] if partner else []):
+                await ws_mgr.send_to_player(member_id, 'queue_joined', {
+                    'mode': mode,
+                    'position': matchmaking.get_queue_position(member_id),
+                    'partner_id': partner_id if partner else None,
+                })
         else:
             await ws_mgr.send_to_player(player_id, 'error', {'error': 'Failed to join queue'})
 
     async def handle_queue_leave(ws_mgr, player_id, data):
         """Player wants to leave matchmaking queue"""
+        queued_together = matchmaking.get_queued_players(player_id)
         success = await matchmaking.leave_queue(player_id)
         await ws_mgr.send_to_player(player_id, 'queue_left', {'success': success})
+        # Leaving also pulls a queued party partner out
+        for member_id in queued_together:
+            if member_id != player_id:
+                await ws_mgr.send_to_player(member_id, 'queue_left', {'success': True, 'by_partner': True})
+
+    async def handle_party_invite(ws_mgr, player_id, data):
+        """Invite another online player to team up for 2v2"""
+        target_id = data.get('player_id')
+        if not target_id or target_id == player_id:
+            await ws_mgr.send_to_player(player_id, 'error', {'error': 'Invalid player'})
+            return
+        if not ws_mgr.is_online(target_id):
+            await ws_mgr.send_to_player(player_id, 'error', {'error': 'Player is not online'})
+            return
+
+        matchmaking.party_invites[target_id] = player_id
+        await ws_mgr.send_to_player(target_id, 'party_invite', {'from': player_id})
+        await ws_mgr.send_to_player(player_id, 'party_invite_sent', {'player_id': target_id})
+
+    async def handle_party_accept(ws_mgr, player_id, data):
+        """Accept a party invite"""
+        inviter_id = data.get('player_id')
+        if not inviter_id or matchmaking.party_invites.get(player_id) != inviter_id:
+            await ws_mgr.send_to_player(player_id, 'error', {'error': 'Party invite not found'})
+            return
+        del matchmaking.party_invites[player_id]
+
+        # Queue entries from before the party no longer apply
+        for member_id in (inviter_id, player_id):
+            await matchmaking.leave_queue(member_id)
+            old_partner = matchmaking.get_partner(member_id)
+            if old_partner and old_partner not in (inviter_id, player_id):
+                await ws_mgr.send_to_player(old_partner, 'party_left', {'player_id': member_id})
+
+        matchmaking.create_party(inviter_id, player_id)
+        await ws_mgr.send_to_player(inviter_id, 'party_formed', {'partner_id': player_id})
+        await ws_mgr.send_to_player(player_id, 'party_formed', {'partner_id': inviter_id})
+
+    async def handle_party_leave(ws_mgr, player_id, data):
+        """Leave the current party"""
+        partner_id = matchmaking.get_partner(player_id)
+        if not partner_id:
+            return
+        if partner_id in matchmaking.get_queued_players(player_id):
+            await matchmaking.leave_queue(player_id)
+        matchmaking.leave_party(player_id)
+        await ws_mgr.send_to_player(player_id, 'party_left', {'player_id': player_id})
+        await ws_mgr.send_to_player(partner_id, 'party_left', {'player_id': player_id})
 
     async def handle_battle_ready(ws_mgr, player_id, data):
         """Player is ready to start battle"""
@@ -73,6 +164,13 @@ def setup_websocket_handlers():
         if battle_id:
             await player_ready(battle_id, player_id, ws_mgr)
 
+    async def handle_battle_rejoin(ws_mgr, player_id, data):
+        """Player wants to resume the battle they were in"""
+        from websocket.battle_sync import rejoin_battle
+
+        if not await rejoin_battle(player_id, ws_mgr):
+            await ws_mgr.send_to_player(player_id, 'battle_rejoin_failed', {'error': 'No battle to rejoin'})
+
     async def handle_battle_action(ws_mgr, player_id, data):
         """Player performed a battle action"""
         from websocket.battle_sync import handle_battle_action
@@ -98,15 +196,43 @@ def setup_websocket_handlers():
         if battle:
             # If surrendering, give opponent the win
             if data.get('surrender'):
-                if player_id == battle.player1_id:
+                if battle.side(player_id) == 'player1':
                     battle.player2_crowns = 3
                 else:
                     battle.player1_crowns = 3
             await end_battle(battle.id, ws_mgr)
 
+    async def handle_spectate(ws_mgr, player_id, data):
+        """Start watching a battle (delayed spectator feed)"""
+        from websocket.battle_sync import spectate_battle, get_battle
+        from websocket.spectators import SPECTATOR_DELAY
+
+        battle_id = data.get('battle_id')
+        error = spectate_battle(battle_id, player_id) if battle_id else 'No battle specified'
+        if error:
+            await ws_mgr.send_to_player(player_id, 'spectate_failed', {'error': error})
+            return
+
+        battle = get_battle(battle_id)
+        await ws_mgr.send_to_player(player_id, 'spectate_started', {
+            'battle_id': battle_id,
+            'mode': battle.mode,
+            'player1_id': battle.player1_id,
+            'player2_id': battle.player2_id,
+            'delay': SPECTATOR_DELAY,
+        })
+
+    async def handle_spectate_stop(ws_mgr, player_id, data):
+        """Stop watching a battle"""
+        from websocket.spectators import spectators
+
+        spectators.remove_spectator(player_id)
+        await ws_mgr.send_to_player(player_id, 'spectate_stopped', {})
+
     async def handle_chat_send(ws_mgr, player_id, data):
         """Player sent a chat message"""
         from database import json_db as db
+        from database import chat_store
 
         channel = data.get('channel', 'global')
         message = data.get('message', '').strip()[:200]  # Max 200 chars
@@ -123,28 +249,23 @@ def setup_websocket_handlers():
         if channel == 'clan':
             clan_id = data.get('clan_id') or player.get('clan_id')
             if clan_id:
-                # Add to clan chat history
+                # Append to the clan's chat log (the clan document is not rewritten)
                 clan = await db.get_clan(clan_id)
                 if clan:
-                    if 'chat_history' not in clan:
-                        clan['chat_history'] = []
-                    clan['chat_history'].append({
+                    await chat_store.migrate_clan(clan)
+                    stored = await chat_store.append_message(clan_id, {
                         'sender_id': player_id,
                         'sender_name': player_name,
                         'message': message,
                         'timestamp': __import__('time').time(),
                     })
-                    # Keep last 100 messages
-                    clan['chat_history'] = clan['chat_history'][-100:]
-                    await db.save_clan(clan)
+                    if not stored:
+                        return
 
                     # Broadcast to clan channel
                     await ws_mgr.broadcast_channel(f"clan:{clan_id}", 'chat_message', {
                         'channel': 'clan',
-                        'sender_id': player_id,
-                        'sender_name': player_name,
-                        'message': message,
-                        'timestamp': __import__('time').time(),
+                        **stored,
                     })
 
         elif channel == 'global':
@@ -171,6 +292,27 @@ def setup_websocket_handlers():
             await ws_mgr.unsubscribe(player_id, channel)
             await ws_mgr.send_to_player(player_id, 'unsubscribed', {'channel': channel})
 
+    async def handle_clan_sync(ws_mgr, player_id, data):
+        """Send the clan events a client missed since its last seen sequence number"""
+        from database import json_db as db
+
+        clan_id = data.get('clan_id')
+        clan = await db.get_clan(clan_id) if clan_id else None
+        if not clan:
+            await ws_mgr.send_to_player(player_id, 'error', {'error': 'Clan not found'})
+            return
+        try:
+            since = int(data.get('since', 0))
+        except (TypeError, ValueError):
+            since = 0
+        events = clan_events.since(clan, since)
+        await ws_mgr.send_to_player(player_id, 'clan_events', {
+            'clan_id': clan_id,
+            'events': events or [],
+            'seq': clan.get('event_seq', 0),
+            'resync': events is None,
+        })
+
     async def handle_get_online_players(ws_mgr, player_id, data):
         """Get list of online players for PVP challenges"""
         players = await ws_mgr.get_online_players_with_info()
@@ -184,6 +326,7 @@ def setup_websocket_handlers():
     async def handle_challenge_player(ws_mgr, player_id, data):
         """Send a PVP challenge to another player"""
         from database import json_db as db
+        from websocket.battle_sync import is_player_in_battle
         import time
 
         target_id = data.get('target_id')
@@ -195,6 +338,14 @@ def setup_websocket_handlers():
             await ws_mgr.send_to_player(player_id, 'challenge_failed', {'error': 'Player is offline'})
             return
 
+        if is_player_in_battle(player_id):
+            await ws_mgr.send_to_player(player_id, 'challenge_failed', {'error': 'You are already in a battle'})
+            return
+
+        if is_player_in_battle(target_id):
+            await ws_mgr.send_to_player(player_id, 'challenge_failed', {'error': 'Player is in a battle'})
+            return
+
         # Get challenger info
         challenger = await db.get_player(player_id)
         if not challenger:
@@ -224,7 +375,7 @@ def setup_websocket_handlers():
     async def handle_challenge_response(ws_mgr, player_id, data):
         """Accept or decline a PVP challenge"""
         from database import json_db as db
-        from websocket.battle_sync import create_battle
+        from websocket.battle_sync import create_battle, is_player_in_battle
 
         challenger_id = data.get('challenger_id')
         accepted = data.get('accepted', False)
@@ -242,6 +393,12 @@ def setup_websocket_handlers():
         del pending_challenges[challenger_id]
 
         if accepted:
+            # Either side may have entered another battle since the challenge was sent
+            if is_player_in_battle(challenger_id) or is_player_in_battle(player_id):
+                await ws_mgr.send_to_player(player_id, 'challenge_failed', {'error': 'Player is in a battle'})
+                await ws_mgr.send_to_player(challenger_id, 'challenge_failed', {'error': 'Player is in a battle'})
+                return
+
             # Get both players' info
             player1 = await db.get_player(challenger_id)
             player2 = await db.get_player(player_id)
@@ -250,6 +407,10 @@ def setup_websocket_handlers():
                 await ws_mgr.send_to_player(player_id, 'error', {'error': 'Player data not found'})
                 return
 
+            # Drop both players from matchmaking so they aren't matched mid-battle
+            await matchmaking.leave_queue(challenger_id)
+            await matchmaking.leave_queue(player_id)
+
             # Create a PVP battle
             battle = create_battle(
                 player1_id=challenger_id,
@@ -299,13 +460,20 @@ def setup_websocket_handlers():
     # Register handlers
     ws_manager.register_handler('queue_join', handle_queue_join)
     ws_manager.register_handler('queue_leave', handle_queue_leave)
+    ws_manager.register_handler('party_invite', handle_party_invite)
+    ws_manager.register_handler('party_accept', handle_party_accept)
+    ws_manager.register_handler('party_leave', handle_party_leave)
     ws_manager.register_handler('battle_ready', handle_battle_ready)
+    ws_manager.register_handler('battle_rejoin', handle_battle_rejoin)
     ws_manager.register_handler('battle_action', handle_battle_action)
     ws_manager.register_handler('tower_damage', handle_tower_damage)
     ws_manager.register_handler('battle_end', handle_battle_end_request)
+    ws_manager.register_handler('spectate', handle_spectate)
+    ws_manager.register_handler('spectate_stop', handle_spectate_stop)
     ws_manager.register_handler('chat_send', handle_chat_send)
     ws_manager.register_handler('subscribe', handle_subscribe)
     ws_manager.register_handler('unsubscribe', handle_unsubscribe)
+    ws_manager.register_handler('clan_sync', handle_clan_sync)
     ws_manager.register_handler('get_online_players', handle_get_online_players)
     ws_manager.register_handler('challenge_player', handle_challenge_player)
     ws_manager.register_handler('challenge_response', handle_challenge_response)
@@ -320,6 +488,12 @@ async def start_background_tasks(app):
 
     app['matchmaking_task'] = asyncio.create_task(matchmaking_loop(ws_manager))
     app['battle_timer_task'] = asyncio.create_task(battle_timer_loop(ws_manager))
+    app['battle_results_task'] = asyncio.create_task(battle_result_loop())
+    app['spectator_task'] = asyncio.create_task(spectator_loop(ws_manager))
+    app['bot_task'] = asyncio.create_task(bot_loop(ws_manager))
+    app['rtt_task'] = asyncio.create_task(rtt_loop())
+    app['rating_task'] = asyncio.create_task(rating_loop())
+    app['clan_war_task'] = asyncio.create_task(clan_war_loop())
     print("Background tasks started")
 
 
@@ -327,11 +501,27 @@ async def cleanup_background_tasks(app):
     """Cleanup background tasks"""
     app['matchmaking_task'].cancel()
     app['battle_timer_task'].cancel()
+    app['battle_results_task'].cancel()
+    app['spectator_task'].cancel()
+    app['bot_task'].cancel()
+    app['rtt_task'].cancel()
+    app['rating_task'].cancel()
+    app['clan_war_task'].cancel()
     try:
         await app['matchmaking_task']
         await app['battle_timer_task']
+        await app['battle_results_task']
+        await app['spectator_task']
+        await app['bot_task']
+        await app['rtt_task']
+        await app['rating_task']
+        await app['clan_war_task']
     except asyncio.CancelledError:
         pass
+    # Persist any battle results still queued, then rate them
+    await battle_results.flush()
+    await ratings.close_periods(force=True)
+    await clan_wars.flush()
     print("Background tasks stopped")
 
 
@@ -354,6 +544,7 @@ def create_app() -> web.Application:
     app.router.add_routes(player_routes)
     app.router.add_routes(clan_routes)
     app.router.add_routes(trading_routes)
+    app.router.add_routes(replay_routes)
 
     # Add WebSocket route
     app.router.add_get('/ws', ws_manager.handle_connection)
@@ -378,12 +569,23 @@ def create_app() -> web.Application:
             'queue_sizes': {
                 mode: matchmaking.get_queue_size(mode)
                 for mode in ['normal', 'ranked', 'medals', '2v2', 'draft', 'chaos']
-            }
+            },
+            'spectators': spectators.get_metrics(),
+            'bots': bot_runner.get_metrics(),
+            'ratings': ratings.get_metrics(),
+            'clan_wars': clan_wars.get_metrics(),
+            'clan_events': clan_events.get_metrics(),
         })
 
     app.router.add_get('/health', health_check)
     app.router.add_get('/api/status', health_check)
 
+    # Matchmaking quality and wait time stats
+    async def matchmaking_stats(request):
+        return web.json_response(matchmaking.get_match_stats())
+
+    app.router.add_get('/api/matchmaking/stats', matchmaking_stats)
+
     # Serve the game HTML
     async def serve_game(request):
         import aiofiles
@@ -416,11 +618,16 @@ def main():
     GET  /api/player/:id         - Player profile
     POST /api/player/:id/sync    - Sync player data
     GET  /api/leaderboard/:type  - Leaderboards
+    GET  /api/player/:id/replays - Recent battle replays
+    GET  /api/replay/:battle_id  - Stream a battle replay
 
   Clan Endpoints:
     GET  /api/clans              - List/search clans
+    GET  /api/clans/leaderboard  - Clan leaderboard
     POST /api/clan               - Create clan
     GET  /api/clan/:id           - Get clan details
+    GET  /api/clan/:id/chat      - Clan chat history
+    GET  /api/clan/:id/events    - Clan events since a sequence number
     POST /api/clan/:id/join      - Join clan
     POST /api/clan/:id/leave     - Leave clan
     POST /api/clan/:id/promote   - Promote member
@@ -429,9 +636,13 @@ def main():
     POST /api/clan/:id/donate    - Donate cards
     POST /api/clan/:id/request   - Request cards
     POST /api/clan/:id/settings  - Update clan settings
+    GET  /api/clan/:id/war       - Clan war status
+    POST /api/clan/:id/war/join  - Sign up for the next clan war
+    POST /api/clan/:id/war/leave - Withdraw from the next clan war
 
   Other:
     GET  /health                 - Server status
+    GET  /api/matchmaking/stats  - Match quality / wait times
 
   Press Ctrl+C to stop
 ================================================================
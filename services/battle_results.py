@@ -0,0 +1,378 @@
+"""
+Battle Result Pipeline
+Computes battle rewards once and applies finished battles to player data in batches
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.clan_war_service import clan_wars
+from services.rating import ratings
+from websocket.battle_bots import is_bot
+
+# Pipeline tuning
+BATCH_SIZE = 500  # Max results committed in one batch
+BATCH_WINDOW = 0.05  # Seconds to wait for more results before committing
+APPLIED_HISTORY = 20  # Battle ids remembered per player for idempotency
+SYNC_WAIT_TIMEOUT = 2.0  # Max seconds a sync waits for that player's pending results
+RETRY_DELAY = 0.5  # First retry of a failed commit, doubling up to RETRY_DELAY_MAX
+RETRY_DELAY_MAX = 30.0
+
+# Rewards
+WIN_TROPHIES = 30
+TROPHIES_PER_CROWN = 5
+LOSS_TROPHIES = -20
+TIE_TROPHIES = -5
+WIN_GOLD = 50
+GOLD_PER_CROWN = 20
+CONSOLATION_GOLD = 10
+
+
+@dataclass(frozen=True)
+class PlayerResult:
+    player_id: str
+    won: bool
+    crowns: int
+    trophy_change: int
+    new_elo: int
+    gold_earned: int
+    side: str = ''  # 'player1' or 'player2'
+
+    def to_dict(self) -> Dict:
+        return {
+            'won': self.won,
+            'trophy_change': self.trophy_change,
+            'new_elo': self.new_elo,
+            'crowns': self.crowns,
+            'gold_earned': self.gold_earned,
+        }
+
+
+@dataclass(frozen=True)
+class BattleResult:
+    battle_id: str
+    mode: str
+    winner_id: Optional[str]
+    timeout: bool
+    start_time: float
+    end_time: float
+    player1: PlayerResult
+    player2: PlayerResult
+    replay: Optional[bytes] = None  # Encoded replay, written with the result
+    replay_actions: int = 0
+    partners: Tuple[PlayerResult, ...] = ()  # Teammates of player1/player2 in team modes
+
+    @property
+    def players(self) -> Tuple[PlayerResult, ...]:
+        return (self.player1, self.player2) + self.partners
+
+    def to_dict(self) -> Dict:
+        """Result in the battle_result message format"""
+        return {
+            'battle_id': self.battle_id,
+            'winner_id': self.winner_id,
+            'player1_crowns': self.player1.crowns,
+            'player2_crowns': self.player2.crowns,
+            'timeout': self.timeout,
+            'player1_result': self.player1.to_dict(),
+            'player2_result': self.player2.to_dict(),
+            **({'partner_results': {p.player_id: p.to_dict() for p in self.partners}} if self.partners else {}),
+        }
+
+    def to_history(self) -> Dict:
+        """Entry for the battle history log"""
+        winner = next((p.side for p in self.players if p.player_id == self.winner_id), None)
+        return {
+            'battle_id': self.battle_id,
+            'mode': self.mode,
+            'end_time': self.end_time,
+            'player1': [p.player_id for p in self.players if p.side == 'player1'],
+            'player2': [p.player_id for p in self.players if p.side == 'player2'],
+            'winner': winner,
+            'player1_crowns': self.player1.crowns,
+            'player2_crowns': self.player2.crowns,
+        }
+
+
+def compute_battle_result(battle, timeout: bool = False, replay: Optional[bytes] = None) -> BattleResult:
+    """Calculate trophy, ELO and gold changes for a finished battle"""
+    from services.matchmaking_service import matchmaking, is_war_mode
+
+    winner_crowns = max(battle.player1_crowns, battle.player2_crowns)
+    new_p1_elo, new_p2_elo = battle.player1_elo, battle.player2_elo
+    p1_trophy_change = p2_trophy_change = TIE_TROPHIES
+
+    if battle.winner_id == battle.player1_id:
+        new_p1_elo, new_p2_elo = matchmaking.calculate_elo_change(
+            battle.player1_elo, battle.player2_elo, winner_crowns
+        )
+        p1_trophy_change = WIN_TROPHIES + winner_crowns * TROPHIES_PER_CROWN
+        p2_trophy_change = LOSS_TROPHIES
+    elif battle.winner_id == battle.player2_id:
+        new_p2_elo, new_p1_elo = matchmaking.calculate_elo_change(
+            battle.player2_elo, battle.player1_elo, winner_crowns
+        )
+        p1_trophy_change = LOSS_TROPHIES
+        p2_trophy_change = WIN_TROPHIES + winner_crowns * TROPHIES_PER_CROWN
+
+    # Clan war battles count for the war, not for trophies
+    if is_war_mode(battle.mode):
+        p1_trophy_change = p2_trophy_change = 0
+
+    # Glicko-2 ratings change when the rating period closes, not per battle; bot battles rate
+    # nobody under either system (a bot has no rating of its own)
+    if ratings.deferred or any(is_bot(player_id) for player_id in battle.player1_team + battle.player2_team):
+        new_p1_elo, new_p2_elo = battle.player1_elo, battle.player2_elo
+
+    # Team battles rate each player by their team's ELO change (player ELOs are team averages)
+    p1_elo_change = new_p1_elo - battle.player1_elo
+    p2_elo_change = new_p2_elo - battle.player2_elo
+    winning_side = battle.side(battle.winner_id) if battle.winner_id else None
+
+    def player_result(player_id, crowns, trophy_change, new_elo) -> PlayerResult:
+        side = battle.side(player_id)
+        won = winning_side is not None and side == winning_side
+        return PlayerResult(
+            player_id=player_id,
+            won=won,
+            crowns=crowns,
+            trophy_change=trophy_change,
+            new_elo=new_elo,
+            gold_earned=WIN_GOLD + crowns * GOLD_PER_CROWN if won else CONSOLATION_GOLD,
+            side=side,
+        )
+
+    partners = tuple(
+        player_result(player_id, crowns, trophy_change, max(0, battle.member_elos.get(player_id, elo) + elo_change))
+        for team, crowns, trophy_change, elo, elo_change in (
+            (battle.player1_team, battle.player1_crowns, p1_trophy_change, battle.player1_elo, p1_elo_change),
+            (battle.player2_team, battle.player2_crowns, p2_trophy_change, battle.player2_elo, p2_elo_change),
+        )
+        for player_id in team[1:]
+    )
+
+    return BattleResult(
+        battle_id=battle.id,
+        mode=battle.mode,
+        winner_id=battle.winner_id,
+        timeout=timeout,
+        start_time=battle.start_time,
+        end_time=battle.end_time,
+        player1=player_result(
+            battle.player1_id, battle.player1_crowns, p1_trophy_change,
+            max(0, battle.member_elos.get(battle.player1_id, battle.player1_elo) + p1_elo_change),
+        ),
+        player2=player_result(
+            battle.player2_id, battle.player2_crowns, p2_trophy_change,
+            max(0, battle.member_elos.get(battle.player2_id, battle.player2_elo) + p2_elo_change),
+        ),
+        replay=replay,
+        replay_actions=len(battle.replay) if replay else 0,
+        partners=partners,
+    )
+
+
+class BattleResultPipeline:
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Recently submitted battle ids (bounded) for cheap duplicate rejection
+        self._submitted: 'OrderedDict[str, bool]' = OrderedDict()
+        # player_id -> [pending result count, event set when all are committed]
+        self._pending: Dict[str, list] = {}
+        self.batches_committed = 0
+        self.results_committed = 0
+        self.commit_failures = 0
+
+    def submit(self, result: BattleResult) -> bool:
+        """Queue a finished battle for persistence (ignored if already submitted)"""
+        if result.battle_id in self._submitted:
+            return False
+        self._submitted[result.battle_id] = True
+        if len(self._submitted) > 10000:
+            self._submitted.popitem(last=False)
+
+        for player in result.players:
+            if is_bot(player.player_id):
+                continue
+            pending = self._pending.setdefault(player.player_id, [0, asyncio.Event()])
+            pending[0] += 1
+        self._queue.put_nowait(result)
+        return True
+
+    def is_tracked(self, battle_id: str) -> bool:
+        """Check if a battle result is owned by the server pipeline"""
+        return battle_id in self._submitted
+
+    async def wait_for_player(self, player_id: str, timeout: float = SYNC_WAIT_TIMEOUT):
+        """Wait until every queued result for a player has been committed"""
+        pending = self._pending.get(player_id)
+        if not pending:
+            return
+        try:
+            await asyncio.wait_for(pending[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def _drain(self) -> List[BattleResult]:
+        batch = []
+        while len(batch) < BATCH_SIZE and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _commit(self, batch: List[BattleResult], done: Optional[Set[str]] = None):
+        """Apply a batch of results to all affected players with one write per player"""
+        from database import json_db as db
+        from database import replay_store, battle_history
+
+        # Steps already completed by a failed earlier attempt are skipped on retry
+        retry = done is not None
+        done = set() if done is None else done
+        players: Dict[str, Dict] = {}
+        dirty: Dict[str, Dict] = {}
+        if 'players' not in done:
+            # Held under the same locks as the API transactions, so neither overwrites the other's changes
+            player_ids = {p.player_id for result in batch for p in result.players if not is_bot(p.player_id)}
+            async with db.entity_locks(players=player_ids):
+                for player_id in player_ids:
+                    player = await db.get_player(player_id)
+                    if player:
+                        players[player_id] = player
+
+                # A retry saves every player again: their cached data already holds the results,
+                # and applied_battles keeps them from being applied twice
+                for result in batch:
+                    for player_result in result.players:
+                        player = players.get(player_result.player_id)
+                        if player and (_apply_player_result(player, result, player_result) or retry):
+                            dirty[player['id']] = player
+
+                if dirty and not await db.save_players(list(dirty.values())):
+                    raise IOError('saving players failed')
+            done.add('players')
+
+        if 'replays' not in done:
+            replays = [
+                (result.battle_id, result.replay, {
+                    'mode': result.mode,
+                    'players': [p.player_id for p in result.players],
+                    # Replay slot order, so actions can name the teammate who played them
+                    'participants': [p.player_id for side in ('player1', 'player2')
+                                     for p in result.players if p.side == side],
+                    'winner_id': result.winner_id,
+                    'player1_crowns': result.player1.crowns,
+                    'player2_crowns': result.player2.crowns,
+                    'start_time': result.start_time,
+                    'end_time': result.end_time,
+                    'actions': result.replay_actions,
+                })
+                for result in batch if result.replay
+            ]
+            if replays and not await replay_store.save_replays(replays):
+                raise IOError('saving replays failed')
+            done.add('replays')
+
+        history = [result.to_history() for result in batch]
+        if 'history' not in done:
+            if not await battle_history.append_battles(history):
+                raise IOError('appending battle history failed')
+            for entry in history:
+                ratings.record(entry)
+            done.add('history')
+
+        if 'wars' not in done:
+            await clan_wars.record(history)
+            done.add('wars')
+
+        for result in batch:
+            for player_result in result.players:
+                self._release(player_result.player_id)
+        self.batches_committed += 1
+        self.results_committed += len(batch)
+        print(f"Battle results committed: {len(batch)} battles, {len(dirty)} players")
+
+    async def _commit_with_retry(self, batch: List[BattleResult]):
+        """Commit a batch, retrying the remaining steps with backoff until it succeeds (results are never dropped)"""
+        done: Set[str] = set()
+        delay = RETRY_DELAY
+        while True:
+            try:
+                await self._commit(batch, done)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.commit_failures += 1
+                print(f"Battle result commit failed ({e}), retrying {len(batch)} battles in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(RETRY_DELAY_MAX, delay * 2)
+
+    def _release(self, player_id: str):
+        pending = self._pending.get(player_id)
+        if not pending:
+            return
+        pending[0] -= 1
+        if pending[0] <= 0:
+            pending[1].set()
+            del self._pending[player_id]
+
+    async def flush(self):
+        """Commit everything currently queued"""
+        while not self._queue.empty():
+            await self._commit_with_retry(self._drain())
+
+    async def run(self):
+        """Worker loop: wait for results, gather a batch, commit it"""
+        while True:
+            try:
+                first = await self._queue.get()
+                await asyncio.sleep(BATCH_WINDOW)
+                batch = [first] + self._drain()
+                await asyncio.shield(self._commit_with_retry(batch))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Battle result pipeline error: {e}")
+
+
+def _apply_player_result(player: Dict, battle: BattleResult, result: PlayerResult) -> bool:
+    """Apply one player's battle result (returns False if it was already applied)"""
+    applied = player.setdefault('applied_battles', [])
+    if battle.battle_id in applied:
+        return False
+    applied.append(battle.battle_id)
+    del applied[:-APPLIED_HISTORY]
+
+    stats = player.setdefault('stats', {})
+    stats['trophies'] = max(0, stats.get('trophies', 0) + result.trophy_change)
+    if not ratings.deferred:
+        stats['elo'] = result.new_elo
+    stats['crowns'] = stats.get('crowns', 0) + result.crowns
+
+    if result.won:
+        stats['wins'] = stats.get('wins', 0) + 1
+        stats['current_streak'] = stats.get('current_streak', 0) + 1
+        if stats['current_streak'] > stats.get('max_streak', 0):
+            stats['max_streak'] = stats['current_streak']
+    elif battle.winner_id is not None:
+        stats['losses'] = stats.get('losses', 0) + 1
+        stats['current_streak'] = 0
+    else:
+        stats['current_streak'] = 0
+
+    resources = player.setdefault('resources', {})
+    resources['gold'] = resources.get('gold', 0) + result.gold_earned
+    return True
+
+
+# Global battle result pipeline instance
+battle_results = BattleResultPipeline()
+
+
+async def battle_result_loop():
+    """Background task to commit finished battles"""
+    await battle_results.run()
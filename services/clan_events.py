@@ -0,0 +1,68 @@
+"""
+Clan Events
+Numbered deltas of clan changes, pushed on the clan channel and kept in memory for catch-up
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+EVENT_RING_SIZE = 200  # Recent events kept per clan for catch-up
+
+
+class ClanEventLog:
+    def __init__(self):
+        # clan_id -> recent events, oldest first
+        self.recent: Dict[str, Deque[Dict]] = {}
+        self.published = 0
+
+    def add(self, clan, event_type: str, data: Dict) -> Dict:
+        """Number an event with the clan's next sequence (event_seq is saved with the clan document)"""
+        seq = clan.get('event_seq', 0) + 1
+        clan['event_seq'] = seq
+        # Copy nested documents (a member, a request) so the kept event doesn't follow later changes
+        event = {'seq': seq, 'type': event_type, 'time': time.time()}
+        event.update({key: dict(value) if isinstance(value, dict) else value for key, value in data.items()})
+        ring = self.recent.get(clan.id)
+        if ring is None:
+            ring = self.recent[clan.id] = deque(maxlen=EVENT_RING_SIZE)
+        ring.append(event)
+        return event
+
+    def discard(self, clan, event: Dict):
+        """Take back the latest event of a clan change that was not saved (its seq is reused)"""
+        ring = self.recent.get(clan.id)
+        if ring and ring[-1] is event:
+            ring.pop()
+        if clan.get('event_seq') == event['seq']:
+            clan['event_seq'] = event['seq'] - 1
+
+    async def publish(self, clan_id: str, event: Dict):
+        """Push an event to everyone subscribed to the clan"""
+        from websocket.manager import ws_manager
+
+        self.published += 1
+        await ws_manager.broadcast_channel(f"clan:{clan_id}", 'clan_event', {'clan_id': clan_id, **event})
+
+    def since(self, clan, seq: int) -> Optional[List[Dict]]:
+        """Events after seq, or None if they are not all in memory (the client refetches the clan)"""
+        last = clan.get('event_seq', 0)
+        if seq == last:
+            return []
+        ring = self.recent.get(clan.id)
+        if seq > last or not ring or ring[0]['seq'] > seq + 1:
+            return None
+        return [event for event in ring if event['seq'] > seq]
+
+    def drop(self, clan_id: str):
+        self.recent.pop(clan_id, None)
+
+    def get_metrics(self) -> Dict:
+        return {
+            'published': self.published,
+            'clans': len(self.recent),
+        }
+
+
+# Global clan event log instance
+clan_events = ClanEventLog()
@@ -0,0 +1,326 @@
+"""
+Clan War Service
+Clans matched by aggregate strength, war battles fought in per-war queues, every war settled in one scheduled pass
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.matchmaking_service import matchmaking, WAR_MODE_PREFIX, is_war_mode
+
+WAR_DAY = float(os.environ.get('CLAN_WAR_DAY', 86400))  # Seconds per war; wars start and settle at war day boundaries
+MIN_WAR_PARTICIPANTS = 3  # Signed-up members a clan needs to be matched
+WAR_ATTACKS = 3  # War battles per participant per war
+FLUSH_INTERVAL = 10  # Seconds between saves of clans with new war battles
+
+# Clan war trophies for the result
+WAR_WIN_TROPHIES = 100
+WAR_TIE_TROPHIES = 20
+WAR_LOSS_TROPHIES = -50
+
+
+def war_day_of(timestamp: float) -> int:
+    return int(timestamp // WAR_DAY)
+
+
+def idle_war(participants: List[str] = None) -> Dict:
+    """War state of a clan between wars"""
+    return {'active': False, 'start_time': None, 'participants': participants or [], 'attacks': []}
+
+
+def attacks_used(war: Dict, player_id: str) -> int:
+    return sum(1 for attack in war.get('attacks', []) if attack['player_id'] == player_id)
+
+
+class ClanWarService:
+    def __init__(self):
+        # war_id -> the two clan ids fighting it
+        self.wars: Dict[str, Tuple[str, str]] = {}
+        # Clans with war battles recorded since the last save
+        self.dirty: Set[str] = set()
+        # war_id -> player_id -> ids of war battles started but not yet recorded (they count as attacks)
+        self.in_flight: Dict[str, Dict[str, Set[str]]] = {}
+        self.loaded = False
+        self.next_war_day = 0.0
+        self.last_flush = 0.0
+        self.metrics = {
+            'wars_started': 0,
+            'wars_settled': 0,
+            'war_battles': 0,
+            'last_settle_ms': 0.0,
+        }
+
+    async def load(self, now: float = None):
+        """Find the wars in progress from the clan cache and settle those that ended while the server was down"""
+        from database import json_db as db
+
+        if self.loaded:
+            return
+        now = time.time() if now is None else now
+        overdue = False
+        for clan in await db.get_all_clans():
+            war = clan.get('war') or {}
+            if war.get('active') and war.get('id'):
+                self.wars[war['id']] = (clan.id, war.get('opponent_id'))
+                overdue = overdue or war.get('end_time', 0) <= now
+        self.loaded = True
+        # New wars are only matched at the next war day boundary
+        self.next_war_day = (war_day_of(now) + 1) * WAR_DAY
+        if overdue:
+            await self.run_war_day(now, match=False)
+
+    def check_attack(self, clan, player_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """(war queue mode, None) if the player may fight a war battle now, else (None, error)"""
+        war = clan.get('war') or {}
+        if not war.get('active') or war.get('id') not in self.wars:
+            return None, 'Clan is not in a war'
+        if player_id not in war.get('participants', []):
+            return None, 'Not signed up for this war'
+        if war.get('end_time', 0) <= time.time():
+            return None, 'War is over'
+        if self.attacks_taken(war, player_id) >= WAR_ATTACKS:
+            return None, 'No war battles left'
+        return WAR_MODE_PREFIX + war['id'], None
+
+    def attacks_taken(self, war: Dict, player_id: str) -> int:
+        """Recorded war battles plus those still being fought or waiting in the result pipeline"""
+        return attacks_used(war, player_id) + len(self.in_flight.get(war.get('id'), {}).get(player_id, ()))
+
+    def start_battle(self, mode: str, battle_id: str, player_ids: List[str]):
+        """Count a newly created war battle against its players' attacks until its result is recorded"""
+        war_id = mode[len(WAR_MODE_PREFIX):]
+        if not is_war_mode(mode) or war_id not in self.wars:
+            return
+        players = self.in_flight.setdefault(war_id, {})
+        for player_id in player_ids:
+            players.setdefault(player_id, set()).add(battle_id)
+
+    def _land(self, war_id: str, battle: Dict):
+        players = self.in_flight.get(war_id, {})
+        for player_id in battle.get('player1', []) + battle.get('player2', []):
+            battles = players.get(player_id)
+            if battles is not None:
+                battles.discard(battle['battle_id'])
+                if not battles:
+                    del players[player_id]
+
+    async def record(self, battles: List[Dict]):
+        """Count finished war battles (battle history entries) toward their wars"""
+        from database import json_db as db
+
+        for battle in battles:
+            mode = battle.get('mode', '')
+            if not is_war_mode(mode):
+                continue
+            war_id = mode[len(WAR_MODE_PREFIX):]
+            self._land(war_id, battle)
+            if war_id not in self.wars:
+                continue  # Finished after its war was settled
+            async with db.entity_locks(clans=self.wars[war_id]):
+                clans = [await db.get_clan(clan_id) for clan_id in self.wars[war_id]]
+
+                for side, opponents in (('player1', 'player2'), ('player2', 'player1')):
+                    for player_id in battle.get(side, []):
+                        clan = next((c for c in clans if c and c.member(player_id)), None)
+                        war = clan.get('war') if clan else None
+                        if not war or war.get('id') != war_id or player_id not in war.get('participants', []):
+                            continue
+                        if attacks_used(war, player_id) >= WAR_ATTACKS:
+                            continue
+                        if any(a['battle_id'] == battle['battle_id'] and a['player_id'] == player_id
+                               for a in war.get('attacks', [])):
+                            continue  # Already counted by an earlier attempt at this batch
+                        won = battle.get('winner') == side
+                        crowns = battle.get(f'{side}_crowns', 0)
+                        war.setdefault('attacks', []).append({
+                            'battle_id': battle['battle_id'],
+                            'player_id': player_id,
+                            'opponent_ids': battle.get(opponents, []),
+                            'won': won,
+                            'crowns': crowns,
+                            'time': battle.get('end_time'),
+                        })
+                        war['score'] = war.get('score', 0) + (1 if won else 0)
+                        war['crowns'] = war.get('crowns', 0) + crowns
+                        self.dirty.add(clan.id)
+            self.metrics['war_battles'] += 1
+
+    async def flush(self):
+        """Save clans with new war battles in one batch"""
+        from database import json_db as db
+
+        self.last_flush = time.time()
+        dirty, self.dirty = self.dirty, set()
+        async with db.entity_locks(clans=dirty):
+            clans = [await db.get_clan(clan_id) for clan_id in dirty]
+            clans = [clan for clan in clans if clan]
+            if clans and not await db.save_clans(clans):
+                self.dirty |= dirty  # Try again at the next flush
+
+    async def tick(self, now: float = None):
+        """Run the war day when it is due, otherwise save recent war battles"""
+        now = time.time() if now is None else now
+        if now >= self.next_war_day:
+            await self.run_war_day(now)
+            self.next_war_day = (war_day_of(now) + 1) * WAR_DAY
+        elif self.dirty and now - self.last_flush >= FLUSH_INTERVAL:
+            await self.flush()
+
+    async def run_war_day(self, now: float = None, match: bool = True):
+        """Settle finished wars, then (if match) pair the clans that signed up, saving every change in one batch"""
+        from database import json_db as db
+
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        # Every clan is locked for the war day, like in the API transactions, so neither side overwrites
+        # or rolls back the other's changes
+        clan_ids = {clan.id for clan in await db.get_all_clans()}
+        async with db.entity_locks(clans=clan_ids):
+            clans = {clan.id: clan for clan in await db.get_all_clans() if clan.id in clan_ids}
+            changed: Dict[str, object] = {clan_id: clans[clan_id] for clan_id in self.dirty if clan_id in clans}
+            self.dirty.clear()
+            ended: List[Tuple[str, str, Dict]] = []
+            started_wars: List[Tuple[str, str, Dict]] = []
+
+            # Settle
+            for war_id, clan_ids in list(self.wars.items()):
+                sides = [clans.get(clan_id) for clan_id in clan_ids]
+                wars = [clan.get('war') if clan else None for clan in sides]
+                if any(war and war.get('end_time', 0) > now for war in wars):
+                    continue
+                del self.wars[war_id]
+                self.in_flight.pop(war_id, None)
+                for closed_id in await matchmaking.close_queue(WAR_MODE_PREFIX + war_id):
+                    ended.append((closed_id, 'queue_left', {'success': True, 'war_over': True}))
+
+                # Score by battles won, then crowns; a disbanded clan forfeits
+                totals = [(war.get('score', 0), war.get('crowns', 0)) if war else (-1, 0) for war in wars]
+                for i, clan in enumerate(sides):
+                    if not clan or not wars[i] or wars[i].get('id') != war_id:
+                        continue
+                    mine, theirs = totals[i], totals[1 - i]
+                    result = 'win' if mine > theirs else 'loss' if mine < theirs else 'tie'
+                    trophies = {'win': WAR_WIN_TROPHIES, 'tie': WAR_TIE_TROPHIES, 'loss': WAR_LOSS_TROPHIES}[result]
+                    stats = clan.setdefault('stats', {})
+                    stats['war_trophies'] = max(0, stats.get('war_trophies', 0) + trophies)
+                    if result == 'win':
+                        stats['war_wins'] = stats.get('war_wins', 0) + 1
+                    summary = {
+                        'id': war_id,
+                        'opponent_id': wars[i].get('opponent_id'),
+                        'opponent_name': wars[i].get('opponent_name'),
+                        'result': result,
+                        'score': mine[0],
+                        'opponent_score': max(0, theirs[0]),
+                        'crowns': mine[1],
+                        'war_trophies': trophies,
+                        'end_time': wars[i].get('end_time'),
+                    }
+                    clan['war'] = {**idle_war(), 'last_war': summary}
+                    changed[clan.id] = clan
+                    ended.append((clan.id, 'clan_war_ended', summary))
+                self.metrics['wars_settled'] += 1
+
+            # Match clans of similar strength: the signed-up members' total trophies
+            ready = []
+            for clan in clans.values() if match else ():
+                war = clan.get('war') or {}
+                if war.get('active'):
+                    continue
+                participants = [p for p in war.get('participants', []) if clan.member(p)]
+                if len(participants) >= MIN_WAR_PARTICIPANTS:
+                    strength = sum(db.get_member_trophies(p) for p in participants)
+                    ready.append((strength, clan.id, participants))
+            ready.sort()
+
+            end_time = (war_day_of(now) + 1) * WAR_DAY
+            for (strength1, id1, roster1), (strength2, id2, roster2) in zip(ready[0::2], ready[1::2]):
+                war_id = str(uuid.uuid4())
+                for clan_id, roster, strength, opponent_id in (
+                    (id1, roster1, strength1, id2), (id2, roster2, strength2, id1),
+                ):
+                    clan = clans[clan_id]
+                    previous = clan.get('war') or {}
+                    clan['war'] = {
+                        'active': True,
+                        'id': war_id,
+                        'opponent_id': opponent_id,
+                        'opponent_name': clans[opponent_id].get('name'),
+                        'start_time': now,
+                        'end_time': end_time,
+                        'participants': roster,
+                        'attacks': [],
+                        'score': 0,
+                        'crowns': 0,
+                        'strength': strength,
+                        **({'last_war': previous['last_war']} if 'last_war' in previous else {}),
+                    }
+                    changed[clan_id] = clan
+                    started_wars.append((clan_id, 'clan_war_started', {
+                        'war_id': war_id,
+                        'opponent_id': opponent_id,
+                        'opponent_name': clans[opponent_id].get('name'),
+                        'end_time': end_time,
+                    }))
+                self.wars[war_id] = (id1, id2)
+                self.metrics['wars_started'] += 1
+
+            if changed:
+                await db.save_clans(list(changed.values()))
+        self.last_flush = time.time()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.metrics['last_settle_ms'] = round(elapsed, 2)
+        print(f"War day: {len(ended)} results, {len(started_wars) // 2} wars started, "
+              f"{len(changed)} clans saved ({elapsed:.1f} ms)")
+        await self._notify(ended + started_wars)
+
+    async def _notify(self, events: List[Tuple[str, str, Dict]]):
+        """Tell clans about war results and new wars (and queued players that their war ended)"""
+        from websocket.manager import ws_manager
+
+        for target, msg_type, data in events:
+            if msg_type == 'queue_left':
+                await ws_manager.send_to_player(target, msg_type, data)
+            else:
+                await ws_manager.broadcast_channel(f"clan:{target}", msg_type, data)
+
+    def war_status(self, clan, player_id: Optional[str] = None) -> Dict:
+        """A clan's war state for the API (opponent from the clan cache)"""
+        war = clan.get('war') or idle_war()
+        status = {
+            **war,
+            'attacks_per_participant': WAR_ATTACKS,
+            'min_participants': MIN_WAR_PARTICIPANTS,
+            'next_war_day': (war_day_of(time.time()) + 1) * WAR_DAY,
+        }
+        if player_id:
+            status['attacks_left'] = max(0, WAR_ATTACKS - self.attacks_taken(war, player_id)) \
+                if player_id in war.get('participants', []) else 0
+        return status
+
+    def get_metrics(self) -> Dict:
+        return {
+            **self.metrics,
+            'active_wars': len(self.wars),
+            'battles_in_flight': len({b for players in self.in_flight.values() for ids in players.values() for b in ids}),
+            'unsaved_clans': len(self.dirty),
+        }
+
+
+# Global clan war service instance
+clan_wars = ClanWarService()
+
+
+async def clan_war_loop():
+    """Background task to run war days and save war battles"""
+    await clan_wars.load()
+    while True:
+        try:
+            await clan_wars.tick()
+        except Exception as e:
+            print(f"Clan war loop error: {e}")
+
+        await asyncio.sleep(1)
@@ -4,10 +4,37 @@ Handles player queuing and matching using Trophy + ELO system
 """
 
 import asyncio
+import os
 import time
-from typing import Dict, List, Optional, Tuple, Any
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple, Any
+from collections import deque
 from dataclasses import dataclass, field
 
+from database.rank_index import SortedKeyList
+from services.wait_estimator import WaitEstimator, trophy_band
+
+MATCH_CANDIDATES = 8  # Nearest-by-trophy neighbours scored on each side of an entry
+MATCH_CHUNK = 2000  # Trophy index entries the greedy matcher pairs per hold of the mode lock
+MATCH_TICK_ENTRIES = 10000  # Entries the greedy matcher scans per tick; a larger queue is covered over several ticks
+BATCH_WINDOW = 4  # Batch matcher pairs each entry with one of the previous N by ELO
+MATCHERS = ('greedy', 'batch')
+MATCH_HISTORY = 1000  # Recent matches kept per mode for quality/wait stats
+QUEUE_STATUS_MIN_INTERVAL = float(os.environ.get('QUEUE_STATUS_MIN_INTERVAL', 2.0))  # Seconds between pushes per player
+QUEUE_STATUS_ETA_DELTA = 5  # ETA must move at least this many seconds (or 20%) to be pushed
+SEARCH_RANGE_START = 100  # Trophy range a new entry searches
+SEARCH_RANGE_STEP = 50  # Added every SEARCH_RANGE_INTERVAL seconds of waiting
+SEARCH_RANGE_INTERVAL = 5
+SEARCH_RANGE_MAX = 1000
+BOT_BACKFILL_WAIT = float(os.environ.get('BOT_BACKFILL_WAIT', 45))  # Seconds before a bot opponent is offered
+BOT_BACKFILL_MODES = tuple(os.environ.get('BOT_BACKFILL_MODES', 'draft,medals').split(','))
+TEAM_MODES = ('2v2',)  # Modes matched as two teams of two
+WAR_MODE_PREFIX = 'clan_war:'  # Each clan war has its own queue, 'clan_war:<war id>'
+TEAM_CANDIDATES = 3  # Solo pairs tried around the target ELO when filling a party's opponents
+RTT_TARGET = float(os.environ.get('MATCH_RTT_TARGET', 120))  # RTT (ms) both sides must exceed to be penalized
+RTT_WEIGHT = 2.0  # Score added per ms the faster side is above the target
+RTT_RELAX_SECONDS = 30  # The penalty fades to nothing as the longest waiter approaches this wait
+
 @dataclass
 class QueueEntry:
     player_id: str
@@ -16,101 +43,549 @@ class QueueEntry:
     deck: List[str]
     mode: str
     joined_at: float = field(default_factory=time.time)
-    search_range: int = 100  # Initial search range
-
-    def expand_range(self):
+    search_range: int = SEARCH_RANGE_START
+    seq: int = 0  # Join order within the mode queue (set by ModeQueue)
+    # Last queue_status pushed: (position, size bucket, ETA) and when
+    last_status: Optional[Tuple[int, int, float]] = None
+    status_sent_at: float = 0.0
+    # Party member queued together with this player (team modes)
+    partner: Optional['QueueEntry'] = None
+    # Measured connection round trip time in ms (None if not yet measured)
+    rtt: Optional[float] = None
+    # Clan in a clan war queue (never matched against a clanmate)
+    clan_id: Optional[str] = None
+
+    def expand_range(self, now: float = None):
         """Expand search range based on wait time"""
-        wait_time = time.time() - self.joined_at
+        wait_time = (now or time.time()) - self.joined_at
         # Expand by 50 every 5 seconds, max 1000
-        self.search_range = min(1000, 100 + int(wait_time / 5) * 50)
+        self.search_range = min(
+            SEARCH_RANGE_MAX,
+            SEARCH_RANGE_START + int(wait_time / SEARCH_RANGE_INTERVAL) * SEARCH_RANGE_STEP,
+        )
+
+    @property
+    def members(self) -> List['QueueEntry']:
+        return [self, self.partner] if self.partner else [self]
+
+    @property
+    def player_ids(self) -> List[str]:
+        return [member.player_id for member in self.members]
+
+    @property
+    def team_elo(self) -> int:
+        return sum(member.elo for member in self.members)
+
+
+class FenwickTree:
+    """Prefix counts over join sequence numbers, for O(log n) queue positions"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index: int) -> int:
+        """Sum of counts at positions 0..index"""
+        total = 0
+        i = index + 1
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+
+class ModeQueue:
+    """One mode's queue: entries by player id, a trophy index and its own lock"""
+
+    def __init__(self, mode: str, capacity: int = 1024):
+        self.mode = mode
+        # player_id -> entry, in join order (parties are keyed by the player who queued them)
+        self.entries: Dict[str, QueueEntry] = {}
+        # party partner id -> id of the player who queued the party
+        self.partners: Dict[str, str] = {}
+        # (trophies, player_id) sorted, for range searches by trophy count
+        self.trophy_index = SortedKeyList()
+        self.lock = asyncio.Lock()
+        self._positions = FenwickTree(capacity)
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.entries or player_id in self.partners
+
+    def add(self, entry: QueueEntry):
+        if self._next_seq >= self._positions.size:
+            self._renumber()
+        entry.seq = self._next_seq
+        self._next_seq += 1
+        self.entries[entry.player_id] = entry
+        if entry.partner:
+            self.partners[entry.partner.player_id] = entry.player_id
+        self._positions.add(entry.seq, 1)
+        self.trophy_index.add((entry.trophies, entry.player_id))
+
+    def remove(self, player_id: str) -> Optional[QueueEntry]:
+        """Remove a player's entry (removing either party member removes the party)"""
+        player_id = self.partners.get(player_id, player_id)
+        entry = self.entries.pop(player_id, None)
+        if entry is None:
+            return None
+        if entry.partner:
+            self.partners.pop(entry.partner.player_id, None)
+        self._positions.add(entry.seq, -1)
+        self.trophy_index.remove((entry.trophies, player_id))
+        return entry
+
+    def remove_many(self, player_ids: set):
+        """Remove a batch of players (ids of queued entries; partners are removed with their party)"""
+        for player_id in player_ids:
+            self.remove(player_id)
+
+    def position(self, player_id: str) -> Optional[int]:
+        """1-based position in join order"""
+        entry = self.entries.get(self.partners.get(player_id, player_id))
+        if entry is None:
+            return None
+        return self._positions.prefix_sum(entry.seq)
+
+    def _renumber(self):
+        """Compact sequence numbers (and grow if the queue itself is large)"""
+        capacity = max(self._positions.size, len(self.entries) * 2)
+        self._positions = FenwickTree(capacity)
+        for seq, entry in enumerate(self.entries.values()):
+            entry.seq = seq
+            self._positions.add(seq, 1)
+        self._next_seq = len(self.entries)
 
 
 class MatchmakingService:
     def __init__(self):
-        # mode -> list of QueueEntry
-        self.queues: Dict[str, List[QueueEntry]] = {}
+        # mode -> ModeQueue (each with its own lock, so modes never block each other)
+        self.queues: Dict[str, ModeQueue] = {}
         # player_id -> mode (to track which queue a player is in)
         self.player_queues: Dict[str, str] = {}
         # ELO K-factor
         self.K_FACTOR = 32
-        # Lock for thread-safe queue operations
-        self._lock = asyncio.Lock()
-
-    async def join_queue(self, player_id: str, mode: str, trophies: int, elo: int, deck: List[str]) -> bool:
-        """Add a player to the matchmaking queue"""
-        async with self._lock:
-            # Remove from any existing queue
-            await self._remove_from_queue(player_id)
-
+        # Match score weights (ELO matters more for fair matches)
+        self.ELO_WEIGHT = 0.7
+        self.TROPHY_WEIGHT = 0.3
+        # mode -> trophy index key the greedy matcher stopped at (the next tick continues from there)
+        self.match_cursors: Dict[str, Tuple[int, str]] = {}
+        # Time source (replaceable so simulations can run on simulated time)
+        self.clock: Callable[[], float] = time.time
+        # Pairing strategy: 'greedy' (best pairs first) or 'batch' (windowed optimal matching)
+        self.matcher = os.environ.get('MATCHMAKER', 'greedy')
+        if self.matcher not in MATCHERS:
+            self.matcher = 'greedy'
+        # mode -> recent (score, elo diff, battle RTT, then each matched player's wait)
+        self.match_history: Dict[str, deque] = {}
+        self.matches_made: Dict[str, int] = {}
+        # mode -> recent finished battles' (mean, max) participant RTT, as measured at the end
+        self.battle_latency: Dict[str, deque] = {}
+        # Observed match rates and wait times, for ETAs
+        self.wait_estimator = WaitEstimator()
+        # Parties for team modes: player_id -> partner_id (both directions)
+        self.parties: Dict[str, str] = {}
+        # Pending party invites: invitee_id -> inviter_id
+        self.party_invites: Dict[str, str] = {}
+
+    def _queue(self, mode: str) -> ModeQueue:
+        queue = self.queues.get(mode)
+        if queue is None:
+            queue = self.queues[mode] = ModeQueue(mode)
+        return queue
+
+    def create_party(self, player_id: str, partner_id: str) -> bool:
+        """Pair two players for team modes (leaving any previous parties)"""
+        if player_id == partner_id:
+            return False
+        self.leave_party(player_id)
+        self.leave_party(partner_id)
+        self.parties[player_id] = partner_id
+        self.parties[partner_id] = player_id
+        return True
+
+    def leave_party(self, player_id: str) -> Optional[str]:
+        """Dissolve a player's party, returning the former partner"""
+        partner_id = self.parties.pop(player_id, None)
+        if partner_id is not None:
+            self.parties.pop(partner_id, None)
+        return partner_id
+
+    def get_partner(self, player_id: str) -> Optional[str]:
+        return self.parties.get(player_id)
+
+    async def join_queue(self, player_id: str, mode: str, trophies: int, elo: int, deck: List[str],
+                         partner: Optional[QueueEntry] = None, rtt: Optional[float] = None,
+                         clan_id: Optional[str] = None) -> bool:
+        """Add a player (and optionally their party partner) to the matchmaking queue"""
+        # Remove from any existing queue
+        await self.leave_queue(player_id)
+        if partner:
+            await self.leave_queue(partner.player_id)
+
+        queue = self._queue(mode)
+        async with queue.lock:
             # Create queue entry
             entry = QueueEntry(
                 player_id=player_id,
                 trophies=trophies,
                 elo=elo,
                 deck=deck,
-                mode=mode
+                mode=mode,
+                joined_at=self.clock(),
+                partner=partner,
+                rtt=rtt,
+                clan_id=clan_id,
             )
 
-            # Add to queue
-            if mode not in self.queues:
-                self.queues[mode] = []
-            self.queues[mode].append(entry)
-            self.player_queues[player_id] = mode
+            # A concurrent join may have queued the players again meanwhile
+            for member_id in entry.player_ids:
+                self._remove_from_queue(member_id)
+            queue.add(entry)
+            for member_id in entry.player_ids:
+                self.player_queues[member_id] = mode
 
-            print(f"Player {player_id} joined {mode} queue (trophies: {trophies}, elo: {elo})")
+            party = f" with {partner.player_id}" if partner else ""
+            print(f"Player {player_id} joined {mode} queue{party} (trophies: {trophies}, elo: {elo})")
             return True
 
     async def leave_queue(self, player_id: str) -> bool:
         """Remove a player from the queue"""
-        async with self._lock:
-            return await self._remove_from_queue(player_id)
-
-    async def _remove_from_queue(self, player_id: str) -> bool:
-        """Internal: Remove player from queue (must hold lock)"""
-        if player_id in self.player_queues:
-            mode = self.player_queues[player_id]
-            if mode in self.queues:
-                self.queues[mode] = [e for e in self.queues[mode] if e.player_id != player_id]
-            del self.player_queues[player_id]
+        mode = self.player_queues.get(player_id)
+        if mode is None:
+            return False
+        async with self._queue(mode).lock:
+            return self._remove_from_queue(player_id)
+
+    async def requeue(self, entry: QueueEntry) -> bool:
+        """Put a matched entry back as it was (keeping its wait and search range), unless its players requeued"""
+        if is_war_mode(entry.mode) and entry.mode not in self.queues:
+            return False  # The war ended meanwhile
+        queue = self._queue(entry.mode)
+        async with queue.lock:
+            if any(player_id in self.player_queues for player_id in entry.player_ids):
+                return False
+            queue.add(entry)
+            for member_id in entry.player_ids:
+                self.player_queues[member_id] = entry.mode
             return True
-        return False
+
+    def _remove_from_queue(self, player_id: str) -> bool:
+        """Internal: Remove player from queue (must hold that mode's lock)"""
+        mode = self.player_queues.pop(player_id, None)
+        if mode is None:
+            return False
+        entry = self._queue(mode).remove(player_id)
+        if entry:
+            for member_id in entry.player_ids:
+                self.player_queues.pop(member_id, None)
+        return True
 
     async def find_match(self, mode: str) -> Optional[Tuple[QueueEntry, QueueEntry]]:
         """Find the best match in a queue"""
-        async with self._lock:
-            queue = self.queues.get(mode, [])
-            if len(queue) < 2:
-                return None
+        matches = await self.find_matches(mode, limit=1)
+        return matches[0] if matches else None
+
+    async def find_matches(self, mode: str, limit: int = None) -> List[Tuple[QueueEntry, QueueEntry]]:
+        """Find all 1v1 matches in a queue in one pass (best scoring pairs first)"""
+        mode_queue = self._queue(mode)
+        if self.matcher == 'greedy' and limit is None:
+            return await self._find_matches_chunked(mode, mode_queue)
+        async with mode_queue.lock:
+            now = self.clock()
+            self.wait_estimator.tick(mode, now)
+            if len(mode_queue) < 2 or mode in TEAM_MODES:
+                return []
+            queue = list(mode_queue.entries.values())
 
             # Expand search ranges for all waiting players
             for entry in queue:
-                entry.expand_range()
-
-            # Find best match
-            best_match = None
-            best_score = float('inf')
-
-            for i, p1 in enumerate(queue):
-                for j, p2 in enumerate(queue[i + 1:], i + 1):
-                    score = self._match_score(p1, p2)
-                    if score is not None and score < best_score:
-                        best_score = score
-                        best_match = (i, j)
-
-            if best_match:
-                i, j = best_match
-                # Remove from queue (higher index first)
-                player2 = queue.pop(j)
-                player1 = queue.pop(i)
-
-                # Remove from tracking
-                del self.player_queues[player1.player_id]
-                del self.player_queues[player2.player_id]
-
-                print(f"Match found: {player1.player_id} vs {player2.player_id} (score: {best_score:.1f})")
-                return (player1, player2)
-
+                entry.expand_range(now)
+
+            index = list(mode_queue.trophy_index)
+            if self.matcher == 'batch':
+                pairs = self._batch_pairs(queue)
+                # Entries the ELO window could not pair may still have feasible partners by trophies
+                paired = {p.player_id for _, p1, p2 in pairs for p in (p1, p2)}
+                pairs += self._greedy_pairs(mode_queue.entries, [key for key in index if key[1] not in paired])
+                pairs.sort(key=lambda pair: pair[0])
+            else:
+                pairs = self._greedy_pairs(mode_queue.entries, index)
+            if limit is not None:
+                pairs = pairs[:limit]
+            return self._take_matches(mode, mode_queue, pairs, now)
+
+    async def _find_matches_chunked(self, mode: str, mode_queue: ModeQueue) -> List[Tuple[QueueEntry, QueueEntry]]:
+        """Greedy matches over the trophy index, MATCH_CHUNK entries per lock hold so joins and leaves never stall"""
+        matches = []
+        cursor = self.match_cursors.pop(mode, None)
+        budget = MATCH_TICK_ENTRIES
+        now = self.clock()
+        self.wait_estimator.tick(mode, now)
+        while True:
+            async with mode_queue.lock:
+                # The queue may have been closed (a finished clan war) between chunks
+                if self.queues.get(mode) is not mode_queue or len(mode_queue) < 2 or mode in TEAM_MODES:
+                    return matches
+                index = mode_queue.trophy_index
+                start = 0 if cursor is None else index.bisect_right(cursor)
+                # Keys past the chunk are only partners for the chunk's last entries; they lead the next chunk
+                keys = index.islice(start, start + MATCH_CHUNK + MATCH_CANDIDATES)
+                if not keys:
+                    return matches
+                chunk = min(len(keys), MATCH_CHUNK)
+                last = start + chunk >= len(index)
+                cursor = keys[chunk - 1]
+                for _, player_id in keys:
+                    mode_queue.entries[player_id].expand_range(now)
+                matches += self._take_matches(mode, mode_queue, self._greedy_pairs(mode_queue.entries, keys, chunk), now)
+            if last:
+                return matches
+            budget -= chunk
+            if budget <= 0:
+                self.match_cursors[mode] = cursor
+                return matches
+            await asyncio.sleep(0)
+
+    def _take_matches(self, mode: str, mode_queue: ModeQueue, pairs: List[Tuple[float, QueueEntry, QueueEntry]],
+                      now: float) -> List[Tuple[QueueEntry, QueueEntry]]:
+        """Remove matched pairs from the queue (must hold that mode's lock)"""
+        matches = []
+        matched_ids = set()
+        for score, player1, player2 in pairs:
+            # Longest waiting player is player1
+            if player2.joined_at < player1.joined_at:
+                player1, player2 = player2, player1
+            matches.append((player1, player2))
+            matched_ids.update((player1.player_id, player2.player_id))
+            self._record_match(mode, score, abs(player1.elo - player2.elo), [player1, player2], now)
+            print(f"Match found: {player1.player_id} vs {player2.player_id} (score: {score:.1f})")
+
+        mode_queue.remove_many(matched_ids)
+        for player_id in matched_ids:
+            self.player_queues.pop(player_id, None)
+        return matches
+
+    async def find_team_matches(self, mode: str) -> List[Tuple[List[QueueEntry], List[QueueEntry]]]:
+        """Find all 2v2 matches: party vs party, party vs two solos, then four solos split evenly"""
+        mode_queue = self._queue(mode)
+        async with mode_queue.lock:
+            now = self.clock()
+            self.wait_estimator.tick(mode, now)
+            if not mode_queue.entries:
+                return []
+            queue = list(mode_queue.entries.values())
+            for entry in queue:
+                entry.expand_range(now)
+
+            # Sorted indexes by combined ELO (parties) and ELO (solos)
+            parties = sorted((e for e in queue if e.partner), key=lambda e: (e.team_elo, e.player_id))
+            solos = sorted((e for e in queue if not e.partner), key=lambda e: (e.elo, e.player_id))
+            solo_elos = [e.elo for e in solos]
+            teams: List[Tuple[float, List[QueueEntry], List[QueueEntry], List[QueueEntry]]] = []
+
+            # Parties against the next party up by combined ELO
+            leftover = []
+            i = 0
+            while i < len(parties):
+                if i + 1 < len(parties):
+                    score = self._team_score(parties[i].members, parties[i + 1].members, [parties[i], parties[i + 1]])
+                    if score is not None:
+                        teams.append((score, parties[i].members, parties[i + 1].members, [parties[i], parties[i + 1]]))
+                        i += 2
+                        continue
+                leftover.append(parties[i])
+                i += 1
+
+            # Remaining parties against the two solos whose ELOs straddle half the party's total
+            for party in leftover:
+                pos = bisect_left(solo_elos, party.team_elo / 2)
+                best = None
+                for lo in range(max(0, pos - TEAM_CANDIDATES), min(len(solos) - 1, pos + TEAM_CANDIDATES)):
+                    pair = [solos[lo], solos[lo + 1]]
+                    score = self._team_score(party.members, pair, [party] + pair)
+                    if score is not None and (best is None or score < best[0]):
+                        best = (score, lo)
+                if best:
+                    score, lo = best
+                    pair = solos[lo:lo + 2]
+                    teams.append((score, party.members, pair, [party] + pair))
+                    del solos[lo:lo + 2]
+                    del solo_elos[lo:lo + 2]
+
+            # Four neighbouring solos by ELO: lowest and highest against the middle two
+            i = 0
+            while i + 3 < len(solos):
+                low, mid1, mid2, high = solos[i:i + 4]
+                score = self._team_score([low, high], [mid1, mid2], solos[i:i + 4])
+                if score is not None:
+                    teams.append((score, [low, high], [mid1, mid2], solos[i:i + 4]))
+                    i += 4
+                else:
+                    i += 1
+
+            matches = []
+            matched_ids = set()
+            for score, team1, team2, units in teams:
+                # Team with the longest waiting player is player1's side
+                if min(e.joined_at for e in team2) < min(e.joined_at for e in team1):
+                    team1, team2 = team2, team1
+                matches.append((team1, team2))
+                matched_ids.update(unit.player_id for unit in units)
+                self._record_match(mode, score, abs(sum(e.elo for e in team1) - sum(e.elo for e in team2)) / 2,
+                                   team1 + team2, now)
+                print(f"Match found: {' & '.join(e.player_id for e in team1)} vs "
+                      f"{' & '.join(e.player_id for e in team2)} (score: {score:.1f})")
+
+            mode_queue.remove_many(matched_ids)
+            for team1, team2 in matches:
+                for entry in team1 + team2:
+                    self.player_queues.pop(entry.player_id, None)
+
+            return matches
+
+    async def take_backfill(self, mode: str) -> List[QueueEntry]:
+        """Remove and return solo entries that have waited long enough to get a bot opponent"""
+        if mode not in BOT_BACKFILL_MODES or mode in TEAM_MODES:
+            return []
+        mode_queue = self._queue(mode)
+        async with mode_queue.lock:
+            now = self.clock()
+            waited = [
+                entry for entry in mode_queue.entries.values()
+                if not entry.partner and now - entry.joined_at >= BOT_BACKFILL_WAIT
+            ]
+            if waited:
+                mode_queue.remove_many({entry.player_id for entry in waited})
+                for entry in waited:
+                    self.player_queues.pop(entry.player_id, None)
+                    self.wait_estimator.record_match(mode, entry.trophies, now - entry.joined_at)
+            return waited
+
+    def _team_score(self, team1: List[QueueEntry], team2: List[QueueEntry],
+                    units: List[QueueEntry]) -> Optional[float]:
+        """Match score for two teams: combined ELO gap (70%) and trophy spread (30%)"""
+        trophies = [e.trophies for e in team1 + team2]
+        trophy_spread = max(trophies) - min(trophies)
+        if trophy_spread > max(unit.search_range for unit in units):
             return None
+        elo_gap = abs(sum(e.elo for e in team1) - sum(e.elo for e in team2)) / 2
+        return elo_gap * self.ELO_WEIGHT + trophy_spread * self.TROPHY_WEIGHT + self._rtt_penalty(team1, team2)
+
+    def _greedy_pairs(self, entries: Dict[str, QueueEntry], index: List[Tuple[int, str]],
+                      first: int = None) -> List[Tuple[float, QueueEntry, QueueEntry]]:
+        """Best-first pairs from each entry's nearest neighbours by trophies (pairs starting in the first keys)"""
+        first = len(index) if first is None else first
+        candidates = []
+        # Scores are symmetric, so each entry is scored against its next neighbours only
+        for pos in range(first):
+            trophies, player_id = index[pos]
+            p1 = entries[player_id]
+            for other in range(pos + 1, min(len(index), pos + 1 + MATCH_CANDIDATES)):
+                other_trophies, other_id = index[other]
+                if other_trophies - trophies > SEARCH_RANGE_MAX:
+                    break
+                score = self._match_score(p1, entries[other_id])
+                if score is not None:
+                    candidates.append((score, pos, other))
+
+        # Greedily take the best pairs whose players are both still free
+        candidates.sort()
+        matched = set()
+        pairs = []
+        for score, i, j in candidates:
+            if i in matched or j in matched:
+                continue
+            matched.add(i)
+            matched.add(j)
+            pairs.append((score, entries[index[i][1]], entries[index[j][1]]))
+        return pairs
+
+    def _batch_pairs(self, queue: List[QueueEntry]) -> List[Tuple[float, QueueEntry, QueueEntry]]:
+        """Most matches with the lowest total score, over a window of the ELO-sorted queue"""
+        ordered = sorted(queue, key=lambda e: (e.elo, e.player_id))
+        n = len(ordered)
+        # best[i] = (unmatched count, total score) for the first i entries; choice[i] = partner index
+        best: List[Tuple[int, float]] = [(0, 0.0)] * (n + 1)
+        choice: List[int] = [-1] * (n + 1)
+        for i in range(1, n + 1):
+            unmatched, total = best[i - 1]
+            best[i] = (unmatched + 1, total)
+            choice[i] = -1
+            p2 = ordered[i - 1]
+            # Pair entry i-1 with one of the previous BATCH_WINDOW entries, skipping those between
+            for j in range(max(0, i - 1 - BATCH_WINDOW), i - 1):
+                score = self._match_score(ordered[j], p2)
+                if score is None:
+                    continue
+                prev_unmatched, prev_total = best[j]
+                candidate = (prev_unmatched + (i - 2 - j), prev_total + score)
+                if candidate < best[i]:
+                    best[i] = candidate
+                    choice[i] = j
+
+        pairs = []
+        i = n
+        while i > 0:
+            j = choice[i]
+            if j < 0:
+                i -= 1
+                continue
+            pairs.append((self._match_score(ordered[j], ordered[i - 1]), ordered[j], ordered[i - 1]))
+            i = j
+        return pairs
+
+    def _record_match(self, mode: str, score: float, elo_diff: float, players: List[QueueEntry], now: float):
+        history = self.match_history.get(mode)
+        if history is None:
+            history = self.match_history[mode] = deque(maxlen=MATCH_HISTORY)
+        # (score, elo diff, battle RTT, then each matched player's wait)
+        history.append((score, elo_diff, _battle_rtt(players)) + tuple(now - player.joined_at for player in players))
+        self.matches_made[mode] = self.matches_made.get(mode, 0) + 1
+        for player in players:
+            self.wait_estimator.record_match(mode, player.trophies, now - player.joined_at)
+
+    def record_battle_latency(self, mode: str, rtts: List[Optional[float]]):
+        """Record the RTTs measured for a finished battle's players (unmeasured ones are skipped)"""
+        rtts = [rtt for rtt in rtts if rtt is not None]
+        if not rtts:
+            return
+        latency = self.battle_latency.get(mode)
+        if latency is None:
+            latency = self.battle_latency[mode] = deque(maxlen=MATCH_HISTORY)
+        latency.append((sum(rtts) / len(rtts), max(rtts)))
+
+    def get_match_stats(self) -> Dict[str, Any]:
+        """Match quality, latency and wait time distributions over recent matches, per mode"""
+        modes = {}
+        for mode, latency in self.battle_latency.items():
+            modes[mode] = {
+                'battle_rtt_ms': _distribution(sorted(sample[0] for sample in latency)),
+                'battle_max_rtt_ms': _distribution(sorted(sample[1] for sample in latency)),
+            }
+        for mode, history in self.match_history.items():
+            scores = sorted(sample[0] for sample in history)
+            elo_diffs = sorted(sample[1] for sample in history)
+            rtts = sorted(sample[2] for sample in history if sample[2] is not None)
+            waits = sorted(wait for sample in history for wait in sample[3:])
+            modes.setdefault(mode, {}).update({
+                'matches': self.matches_made.get(mode, 0),
+                'recent': len(history),
+                'score': _distribution(scores),
+                'elo_diff': _distribution(elo_diffs),
+                'rtt_ms': _distribution(rtts),
+                'wait_seconds': _distribution(waits),
+            })
+        return {'matcher': self.matcher, 'modes': modes, 'wait_model': self.wait_estimator.get_metrics()}
 
     def _match_score(self, p1: QueueEntry, p2: QueueEntry) -> Optional[float]:
         """Calculate match quality score (lower is better)"""
@@ -121,9 +596,24 @@ class MatchmakingService:
         max_range = max(p1.search_range, p2.search_range)
         if trophy_diff > max_range:
             return None
+        if p1.clan_id is not None and p1.clan_id == p2.clan_id:
+            return None
 
-        # Weight: 70% ELO, 30% trophies (ELO matters more for fair matches)
-        return elo_diff * 0.7 + trophy_diff * 0.3
+        # Weight: 70% ELO, 30% trophies (ELO matters more for fair matches), plus a soft latency penalty
+        score = elo_diff * self.ELO_WEIGHT + trophy_diff * self.TROPHY_WEIGHT
+        if p1.rtt is None or p2.rtt is None or min(p1.rtt, p2.rtt) <= RTT_TARGET:
+            return score  # No penalty (the common case, checked without building sides)
+        return score + self._rtt_penalty([p1], [p2])
+
+    def _rtt_penalty(self, side1: List[QueueEntry], side2: List[QueueEntry]) -> float:
+        """Penalty when both sides have high RTT, relaxing as the longest waiter's wait grows"""
+        # A laggy player facing a fast one is fine; two laggy sides make the battle laggy for everyone
+        rtt1, rtt2 = _battle_rtt(side1), _battle_rtt(side2)
+        if rtt1 is None or rtt2 is None or min(rtt1, rtt2) <= RTT_TARGET:
+            return 0.0
+        waited = self.clock() - min(player.joined_at for player in side1 + side2)
+        relax = max(0.0, 1 - waited / RTT_RELAX_SECONDS)
+        return (min(rtt1, rtt2) - RTT_TARGET) * RTT_WEIGHT * relax
 
     def calculate_elo_change(self, winner_elo: int, loser_elo: int, winner_crowns: int) -> Tuple[int, int]:
         """Calculate ELO changes after a match"""
@@ -147,28 +637,134 @@ class MatchmakingService:
         if player_id not in self.player_queues:
             return None
 
-        mode = self.player_queues[player_id]
-        queue = self.queues.get(mode, [])
+        queue = self.queues.get(self.player_queues[player_id])
+        return queue.position(player_id) if queue else None
 
-        for i, entry in enumerate(queue):
-            if entry.player_id == player_id:
-                return i + 1
-        return None
+    def get_queued_players(self, player_id: str) -> List[str]:
+        """Players queued in the same entry as this player (the player and any party partner)"""
+        queue = self.queues.get(self.player_queues.get(player_id))
+        if not queue:
+            return []
+        entry = queue.entries.get(queue.partners.get(player_id, player_id))
+        return entry.player_ids if entry else []
 
     def get_queue_size(self, mode: str) -> int:
         """Get the number of players in a queue"""
-        return len(self.queues.get(mode, []))
+        queue = self.queues.get(mode)
+        return len(queue) if queue else 0
+
+    async def close_queue(self, mode: str) -> List[str]:
+        """Drop a queue that no longer takes players (e.g. a finished clan war); returns who was queued"""
+        queue = self.queues.get(mode)
+        if queue is None:
+            return []
+        async with queue.lock:
+            player_ids = [player_id for entry in queue.entries.values() for player_id in entry.player_ids]
+            for player_id in player_ids:
+                self.player_queues.pop(player_id, None)
+            del self.queues[mode]
+        self.match_history.pop(mode, None)
+        self.match_cursors.pop(mode, None)
+        self.battle_latency.pop(mode, None)
+        self.matches_made.pop(mode, None)
+        return player_ids
 
     def get_estimated_wait(self, player_id: str) -> Optional[float]:
         """Estimate wait time in seconds"""
         if player_id not in self.player_queues:
             return None
 
-        mode = self.player_queues[player_id]
-        queue_size = self.get_queue_size(mode)
+        queue = self.queues.get(self.player_queues[player_id])
+        if not queue:
+            return None
+        entry = queue.entries[queue.partners.get(player_id, player_id)]
+        band = trophy_band(entry.trophies)
+        ahead = 0
+        for other in queue.entries.values():
+            if other is entry:
+                break
+            if trophy_band(other.trophies) == band:
+                ahead += 1
+        return self._estimate_wait(queue, entry, ahead)['p50']
+
+    def _estimate_wait(self, queue: ModeQueue, entry: QueueEntry, ahead: int, now: float = None) -> Dict[str, float]:
+        """p50/p90 remaining wait from observed match rates for the entry's trophy band"""
+        now = now or self.clock()
+        return self.wait_estimator.estimate(queue.mode, entry.trophies, ahead, now - entry.joined_at, len(queue))
+
+    def queue_status_updates(self, mode: str, now: float = None) -> List[Tuple[str, Dict]]:
+        """queue_status payloads for players whose status changed meaningfully since the last push"""
+        queue = self.queues.get(mode)
+        if not queue:
+            return []
+        now = now or self.clock()
+        size = len(queue)
+        bucket = _size_bucket(size)
+        updates = []
+        # Players of the same trophy band ahead of each entry
+        band_counts: Dict[int, int] = {}
+        for position, entry in enumerate(queue.entries.values(), 1):
+            band = trophy_band(entry.trophies)
+            ahead = band_counts.get(band, 0)
+            band_counts[band] = ahead + 1
+            if now - entry.status_sent_at < QUEUE_STATUS_MIN_INTERVAL:
+                continue
+            eta = self._estimate_wait(queue, entry, ahead, now)
+            wait = eta['p50']
+            if entry.last_status is not None:
+                last_position, last_bucket, last_wait = entry.last_status
+                if (position == last_position and bucket == last_bucket
+                        and abs(wait - last_wait) < max(QUEUE_STATUS_ETA_DELTA, last_wait * 0.2)):
+                    continue
+            entry.last_status = (position, bucket, wait)
+            entry.status_sent_at = now
+            status = {
+                'position': position,
+                'queue_size': size,
+                'estimated_wait': wait,
+                'estimated_wait_p90': eta['p90'],
+                'mode': mode
+            }
+            for player_id in entry.player_ids:
+                updates.append((player_id, status))
+        return updates
+
+
+def is_war_mode(mode: str) -> bool:
+    return mode.startswith(WAR_MODE_PREFIX)
+
+
+def _battle_rtt(players) -> Optional[float]:
+    """Expected action delay between players: the mean of their measured RTTs"""
+    rtts = [player.rtt for player in players if player.rtt is not None]
+    if not rtts:
+        return None
+    return sum(rtts) / len(rtts)
+
+
+def _size_bucket(size: int) -> int:
+    """Coarse queue size so small fluctuations don't trigger status pushes"""
+    if size < 10:
+        return size
+    step = 10 ** (len(str(size)) - 1)
+    return size // step * step
 
-        # Rough estimate: 10 seconds per player in queue (assuming matches happen)
-        return max(5, queue_size * 10)
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    """Summary of already-sorted values"""
+    if not values:
+        return {'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+
+    def pct(p):
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 1)
+
+    return {
+        'mean': round(sum(values) / len(values), 1),
+        'p50': pct(50),
+        'p90': pct(90),
+        'p99': pct(99),
+        'max': round(values[-1], 1),
+    }
 
 
 # Global matchmaking service instance
@@ -177,19 +773,37 @@ matchmaking = MatchmakingService()
 
 async def matchmaking_loop(ws_manager):
     """Background task to continuously find matches"""
-    from websocket.battle_sync import create_battle
+    from websocket.battle_sync import create_battle_from_match, is_player_in_battle
+    from websocket.battle_bots import start_bot_battle
+    from services.clan_war_service import clan_wars
 
     while True:
         try:
             # Check all queue modes
             modes = ['normal', 'ranked', 'medals', '2v2', 'draft', 'chaos']
+            modes += [mode for mode in matchmaking.queues if is_war_mode(mode)]
             for mode in modes:
-                match = await matchmaking.find_match(mode)
-                if match:
-                    player1, player2 = match
-
-                    # Create battle
-                    battle = await create_battle(player1, player2, mode)
+                if mode in TEAM_MODES:
+                    for team1, team2 in await matchmaking.find_team_matches(mode):
+                        await _start_team_match(ws_manager, mode, team1, team2)
+
+                # Players nobody could be found for get a bot instead
+                for entry in await matchmaking.take_backfill(mode):
+                    await start_bot_battle(ws_manager, entry, mode)
+
+                for player1, player2 in await matchmaking.find_matches(mode):
+                    # Skip players that got into a battle (e.g. a challenge) while queued
+                    busy1 = is_player_in_battle(player1.player_id)
+                    busy2 = is_player_in_battle(player2.player_id)
+                    if busy1 or busy2:
+                        for entry, busy in ((player1, busy1), (player2, busy2)):
+                            if not busy:
+                                await matchmaking.requeue(entry)
+                        continue
+
+                    # Create battle (a war battle counts against both players' attacks from now on)
+                    battle = await create_battle_from_match(player1, player2, mode)
+                    clan_wars.start_battle(mode, battle['id'], [player1.player_id, player2.player_id])
 
                     # Notify both players
                     await ws_manager.send_to_player(player1.player_id, 'match_found', {
@@ -218,19 +832,52 @@ async def matchmaking_loop(ws_manager):
                     await ws_manager.subscribe(player1.player_id, f"battle:{battle['id']}")
                     await ws_manager.subscribe(player2.player_id, f"battle:{battle['id']}")
 
-            # Send queue status updates to waiting players
-            for player_id, mode in list(matchmaking.player_queues.items()):
-                position = matchmaking.get_queue_position(player_id)
-                wait = matchmaking.get_estimated_wait(player_id)
-                await ws_manager.send_to_player(player_id, 'queue_status', {
-                    'position': position,
-                    'queue_size': matchmaking.get_queue_size(mode),
-                    'estimated_wait': wait,
-                    'mode': mode
-                })
+                # Send queue status to waiting players whose status changed (built per mode, then sent)
+                frames = [
+                    (player_id, ws_manager.encode('queue_status', status))
+                    for player_id, status in matchmaking.queue_status_updates(mode)
+                ]
+                for player_id, message in frames:
+                    await ws_manager.send_encoded(player_id, message)
 
         except Exception as e:
             print(f"Matchmaking loop error: {e}")
 
         # Run every second
         await asyncio.sleep(1)
+
+
+async def _start_team_match(ws_manager, mode: str, team1: List[QueueEntry], team2: List[QueueEntry]):
+    """Create a team battle and tell each player who is with and against them"""
+    from websocket.battle_sync import create_team_battle, is_player_in_battle
+
+    # Requeue the parties/solos that are still free if anyone got into another battle
+    entries = team1 + team2
+    if any(is_player_in_battle(entry.player_id) for entry in entries):
+        partner_ids = {entry.partner.player_id for entry in entries if entry.partner}
+        for entry in entries:
+            if entry.player_id in partner_ids:
+                continue
+            if not any(is_player_in_battle(player_id) for player_id in entry.player_ids):
+                await matchmaking.requeue(entry)
+        return
+
+    battle = await create_team_battle(team1, team2, mode)
+
+    def summary(entry: QueueEntry) -> Dict[str, Any]:
+        return {'id': entry.player_id, 'trophies': entry.trophies, 'deck': entry.deck}
+
+    for side, team, opponents in (('player1', team1, team2), ('player2', team2, team1)):
+        for entry in team:
+            await ws_manager.send_to_player(entry.player_id, 'match_found', {
+                'battle_id': battle['id'],
+                'opponent': summary(opponents[0]),
+                'opponents': [summary(opponent) for opponent in opponents],
+                'teammates': [summary(mate) for mate in team if mate is not entry],
+                'mode': mode,
+                'you_are': side
+            })
+
+    # Subscribe everyone to the battle channel
+    for entry in entries:
+        await ws_manager.subscribe(entry.player_id, f"battle:{battle['id']}")
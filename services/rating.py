@@ -0,0 +1,243 @@
+"""
+Rating Service
+Optional Glicko-2 ratings: battles are batched into rating periods and every player is updated in one NumPy pass
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+RATING_SYSTEM = os.environ.get('RATING_SYSTEM', 'elo')  # 'elo' (per battle) or 'glicko2' (rating periods)
+RATING_SYSTEMS = ('elo', 'glicko2')
+RATING_PERIOD = float(os.environ.get('RATING_PERIOD', 300))  # Seconds of battles per Glicko-2 period
+PERIOD_GRACE = 5  # Seconds after a period ends before it is closed (results still in the pipeline)
+
+# Glicko-2 constants (ratings stay on the ELO scale stored in stats['elo'])
+GLICKO_SCALE = 173.7178
+DEFAULT_RATING = 1000
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+TAU = 0.5  # Constrains volatility change
+CONVERGENCE = 1e-6
+MAX_ITERATIONS = 100
+
+
+def rate_period(rating: np.ndarray, deviation: np.ndarray, volatility: np.ndarray,
+                member_player: np.ndarray, member_side: np.ndarray, side_score: np.ndarray,
+                tau: float = TAU) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Glicko-2 update of every player for one period of battles"""
+    # Sides 2b and 2b+1 face each other in battle b; member_player/member_side say who played on which
+    # side and side_score is each side's score (1 win, 0.5 tie, 0 loss). Teams count as one opponent.
+    mu = rating / GLICKO_SCALE
+    phi = deviation / GLICKO_SCALE
+
+    # Each side's combined rating and deviation
+    side_size = np.bincount(member_side, minlength=len(side_score))
+    side_mu = np.bincount(member_side, mu[member_player], minlength=len(side_score)) / np.maximum(side_size, 1)
+    side_phi2 = np.bincount(member_side, phi[member_player] ** 2, minlength=len(side_score)) / np.maximum(side_size, 1)
+
+    # One game per member against the opposing side
+    opponent = member_side ^ 1
+    g = 1 / np.sqrt(1 + 3 * side_phi2[opponent] / math.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu[member_player] - side_mu[opponent])))
+    v_inv = np.bincount(member_player, g * g * expected * (1 - expected), minlength=len(rating))
+    delta_sum = np.bincount(member_player, g * (side_score[member_side] - expected), minlength=len(rating))
+
+    # Players without games only grow less certain
+    new_mu = mu.copy()
+    new_phi = np.sqrt(phi ** 2 + volatility ** 2)
+    new_volatility = volatility.copy()
+
+    played = v_inv > 0
+    if played.any():
+        v = 1 / v_inv[played]
+        delta = v * delta_sum[played]
+        sigma = _solve_volatility(delta, phi[played] ** 2, v, volatility[played], tau)
+        phi_star2 = phi[played] ** 2 + sigma ** 2
+        phi_new = 1 / np.sqrt(1 / phi_star2 + 1 / v)
+        new_mu[played] = mu[played] + phi_new ** 2 * delta_sum[played]
+        new_phi[played] = phi_new
+        new_volatility[played] = sigma
+
+    return new_mu * GLICKO_SCALE, np.minimum(new_phi * GLICKO_SCALE, DEFAULT_DEVIATION), new_volatility
+
+
+def _solve_volatility(delta: np.ndarray, phi2: np.ndarray, v: np.ndarray, sigma: np.ndarray,
+                      tau: float) -> np.ndarray:
+    """New volatilities by the Illinois method, iterated for all players at once"""
+    a = np.log(sigma ** 2)
+    delta2 = delta ** 2
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    # Bracket the root
+    A = a.copy()
+    large = delta2 > phi2 + v
+    B = np.where(large, np.log(np.where(large, delta2 - phi2 - v, 1.0)), a - tau)
+    below = ~large & (f(B) < 0)
+    while below.any():
+        B[below] -= tau
+        below &= f(B) < 0
+
+    fA, fB = f(A), f(B)
+    active = np.abs(B - A) > CONVERGENCE
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(MAX_ITERATIONS):
+            if not active.any():
+                break
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            swap = fC * fB <= 0
+            A = np.where(active, np.where(swap, B, A), A)
+            fA = np.where(active, np.where(swap, fB, fA / 2), fA)
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+            active &= np.abs(B - A) > CONVERGENCE
+    return np.exp(A / 2)
+
+
+def inflate_deviation(deviation: np.ndarray, volatility: np.ndarray, idle_periods: np.ndarray) -> np.ndarray:
+    """Deviation after some rating periods without battles"""
+    phi = deviation / GLICKO_SCALE
+    phi = np.sqrt(phi ** 2 + np.maximum(idle_periods, 0) * volatility ** 2)
+    return np.minimum(phi * GLICKO_SCALE, DEFAULT_DEVIATION)
+
+
+def period_of(timestamp: float) -> int:
+    return int(timestamp // RATING_PERIOD)
+
+
+def battle_sides(battle: Dict) -> Tuple[List[str], List[str], float]:
+    """(player1 side, player2 side, player1's score) from a battle history entry"""
+    winner = battle.get('winner')
+    score = 1.0 if winner == 'player1' else 0.0 if winner == 'player2' else 0.5
+    return battle['player1'], battle['player2'], score
+
+
+def flatten_battles(battles: List[Tuple[List[str], List[str], float]],
+                    index: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Arrays for rate_period, adding unseen players to index"""
+    member_player: List[int] = []
+    member_side: List[int] = []
+    side_score = np.empty(2 * len(battles))
+    for b, (side1, side2, score) in enumerate(battles):
+        side_score[2 * b] = score
+        side_score[2 * b + 1] = 1 - score
+        for side, members in ((2 * b, side1), (2 * b + 1, side2)):
+            for player_id in members:
+                member_player.append(index.setdefault(player_id, len(index)))
+                member_side.append(side)
+    return np.array(member_player, dtype=np.int64), np.array(member_side, dtype=np.int64), side_score
+
+
+class RatingService:
+    def __init__(self):
+        self.system = RATING_SYSTEM if RATING_SYSTEM in RATING_SYSTEMS else 'elo'
+        # period number -> battles as (player1 side, player2 side, player1's score)
+        self.pending: Dict[int, List[Tuple[List[str], List[str], float]]] = {}
+        self.last_closed = period_of(time.time()) - 1
+        self.metrics = {
+            'periods_closed': 0,
+            'battles_rated': 0,
+            'players_rated': 0,
+            'last_update_ms': 0.0,
+        }
+
+    @property
+    def deferred(self) -> bool:
+        """True when ratings change at period ends instead of after each battle"""
+        return self.system == 'glicko2'
+
+    def record(self, battle: Dict):
+        """Queue a battle history entry for its rating period"""
+        if not self.deferred:
+            return
+        from websocket.battle_bots import is_bot
+
+        side1, side2, score = battle_sides(battle)
+        # Bots have no rating of their own
+        if any(is_bot(player_id) for player_id in side1 + side2):
+            return
+        # A result arriving after its period closed counts in the next one
+        period = max(period_of(battle['end_time']), self.last_closed + 1)
+        self.pending.setdefault(period, []).append((side1, side2, score))
+
+    async def close_periods(self, now: float = None, force: bool = False):
+        """Rate every period that has ended (or all pending ones when forced, e.g. at shutdown)"""
+        now = time.time() if now is None else now
+        current = period_of(now - PERIOD_GRACE)
+        for period in sorted(self.pending):
+            if period >= current and not force:
+                break
+            await self._close_period(period, self.pending.pop(period))
+        if not force:
+            self.last_closed = max(self.last_closed, current - 1)
+
+    async def _close_period(self, period: int, battles: List[Tuple[List[str], List[str], float]]):
+        """Load everyone who played, update them in one pass and save them in one batch"""
+        from database import json_db as db
+
+        index: Dict[str, int] = {}
+        member_player, member_side, side_score = flatten_battles(battles, index)
+        # Locked like the API transactions, so a concurrent trade or transfer is neither lost nor rolled back
+        async with db.entity_locks(players=index):
+            players = [await db.get_player(player_id) for player_id in index]
+
+            started = time.perf_counter()
+            stats = [player.get('stats', {}) if player else {} for player in players]
+            rating = np.array([s.get('elo', DEFAULT_RATING) for s in stats], dtype=np.float64)
+            deviation = np.array([s.get('rating_deviation', DEFAULT_DEVIATION) for s in stats], dtype=np.float64)
+            volatility = np.array([s.get('rating_volatility', DEFAULT_VOLATILITY) for s in stats], dtype=np.float64)
+            idle = np.array([period - s.get('rating_period', period - 1) - 1 for s in stats])
+            deviation = inflate_deviation(deviation, volatility, idle)
+
+            rating, deviation, volatility = rate_period(rating, deviation, volatility, member_player, member_side, side_score)
+
+            updated = []
+            for i, player in enumerate(players):
+                if not player:
+                    continue
+                player_stats = player.setdefault('stats', {})
+                player_stats['elo'] = max(0, int(round(rating[i])))
+                player_stats['rating_deviation'] = round(float(deviation[i]), 2)
+                player_stats['rating_volatility'] = round(float(volatility[i]), 6)
+                player_stats['rating_period'] = period
+                updated.append(player)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            if updated:
+                await db.save_players(updated)
+        self.last_closed = max(self.last_closed, period)
+        self.metrics['periods_closed'] += 1
+        self.metrics['battles_rated'] += len(battles)
+        self.metrics['players_rated'] += len(updated)
+        self.metrics['last_update_ms'] = round(elapsed, 2)
+        print(f"Rating period {period} closed: {len(battles)} battles, {len(updated)} players ({elapsed:.1f} ms)")
+
+    def get_metrics(self) -> Dict:
+        return {
+            **self.metrics,
+            'system': self.system,
+            'pending_battles': sum(len(battles) for battles in self.pending.values()),
+        }
+
+
+# Global rating service instance
+ratings = RatingService()
+
+
+async def rating_loop():
+    """Background task to close Glicko-2 rating periods"""
+    while True:
+        try:
+            await ratings.close_periods()
+        except Exception as e:
+            print(f"Rating loop error: {e}")
+
+        await asyncio.sleep(1)
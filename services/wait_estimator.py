@@ -0,0 +1,115 @@
+"""
+Wait Estimator
+Matchmaking ETAs from observed match rates and wait time histograms per mode and trophy band
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+TROPHY_BAND = 1000  # Trophies per band
+MAX_BAND = 7  # Everything above 7000 trophies shares a band
+RATE_TIME_CONSTANT = 60.0  # Seconds; EWMA weight of older match rate samples
+WAIT_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, math.inf)  # Upper bounds in seconds
+HISTOGRAM_WINDOW = 2000  # Counts are halved past this so the histogram tracks recent conditions
+MIN_SAMPLES = 20  # Histogram samples needed before it is trusted over the match rate
+DEFAULT_WAIT_PER_PLAYER = 10  # Fallback before anything has been observed
+
+
+def trophy_band(trophies: int) -> int:
+    return min(MAX_BAND, max(0, trophies) // TROPHY_BAND)
+
+
+class WaitEstimator:
+    def __init__(self):
+        # (mode, band) -> EWMA of players matched per second
+        self.rates: Dict[Tuple[str, int], float] = {}
+        # (mode, band) -> wait counts per WAIT_BUCKETS bucket
+        self.histograms: Dict[Tuple[str, int], List[float]] = {}
+        # (mode, band) -> players matched since the last tick
+        self._matched: Dict[Tuple[str, int], int] = {}
+        self._last_tick: Dict[str, float] = {}
+
+    def record_match(self, mode: str, trophies: int, waited: float):
+        """Count one matched player and the time they waited"""
+        key = (mode, trophy_band(trophies))
+        self._matched[key] = self._matched.get(key, 0) + 1
+
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0.0] * len(WAIT_BUCKETS)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if waited <= bound:
+                histogram[i] += 1
+                break
+        if sum(histogram) > HISTOGRAM_WINDOW:
+            histogram[:] = [count / 2 for count in histogram]
+
+    def tick(self, mode: str, now: float):
+        """Fold the players matched since the last tick into the EWMA match rates"""
+        last = self._last_tick.get(mode)
+        self._last_tick[mode] = now
+        if last is None or now <= last:
+            return
+        dt = now - last
+        alpha = 1 - math.exp(-dt / RATE_TIME_CONSTANT)
+        bands = {band for (m, band) in self.rates if m == mode}
+        bands.update(band for (m, band) in self._matched if m == mode)
+        for band in bands:
+            key = (mode, band)
+            sample = self._matched.pop(key, 0) / dt
+            self.rates[key] = alpha * sample + (1 - alpha) * self.rates.get(key, sample)
+
+    def estimate(self, mode: str, trophies: int, ahead: int, waited: float,
+                 queue_size: int) -> Dict[str, float]:
+        """p50/p90 seconds of remaining wait for an entry with `ahead` players of its band before it"""
+        key = (mode, trophy_band(trophies))
+        histogram = self.histograms.get(key)
+        if histogram and sum(histogram) >= MIN_SAMPLES:
+            p50 = self._remaining(histogram, waited, 0.5)
+            p90 = self._remaining(histogram, waited, 0.9)
+            if p50 is not None:
+                return {'p50': p50, 'p90': max(p50, p90)}
+
+        rate = self.rates.get(key, 0)
+        if rate > 0:
+            # Players match in pairs, so this entry is done once everyone ahead (and it) is
+            p50 = (ahead + 1) / rate
+            return {'p50': round(max(1.0, p50), 1), 'p90': round(max(1.0, p50 * 2), 1)}
+
+        fallback = float(max(5, queue_size * DEFAULT_WAIT_PER_PLAYER))
+        return {'p50': fallback, 'p90': fallback * 2}
+
+    def _remaining(self, histogram: List[float], waited: float, quantile: float) -> Optional[float]:
+        """Quantile of total wait among waits longer than `waited`, minus `waited`"""
+        start = 0
+        while start < len(WAIT_BUCKETS) and WAIT_BUCKETS[start] <= waited:
+            start += 1
+        total = sum(histogram[start:])
+        if total <= 0:
+            return None
+        target = total * quantile
+        running = 0.0
+        for i in range(start, len(WAIT_BUCKETS)):
+            running += histogram[i]
+            if running >= target:
+                bound = WAIT_BUCKETS[i]
+                if math.isinf(bound):
+                    bound = WAIT_BUCKETS[-2] * 2
+                return round(max(1.0, bound - waited), 1)
+        return None
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """Match rates and wait histograms per mode and trophy band"""
+        metrics: Dict[str, Dict] = {}
+        for key in sorted(set(self.rates) | set(self.histograms)):
+            mode, band = key
+            histogram = self.histograms.get(key, [0.0] * len(WAIT_BUCKETS))
+            metrics.setdefault(mode, {})[f'{band * TROPHY_BAND}+'] = {
+                'match_rate': round(self.rates.get(key, 0.0), 4),
+                'samples': round(sum(histogram), 1),
+                'wait_histogram': {
+                    ('inf' if math.isinf(bound) else f'<={bound}'): round(count, 1)
+                    for bound, count in zip(WAIT_BUCKETS, histogram)
+                },
+            }
+        return metrics
@@ -0,0 +1,292 @@
+"""
+Battle Simulator
+Headless, seeded battle load generator for benchmarking the battle sync path
+
+Usage: python -m tools.battle_sim --battles 1000 --concurrency 100 --seed 1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.battle_results as battle_results_module
+import websocket.battle_sync as battle_sync
+from services.matchmaking_service import QueueEntry
+from websocket.battle_table import battle_table
+
+SIM_CARDS = [
+    'knight', 'archers', 'giant', 'musketeer', 'fireball',
+    'arrows', 'minions', 'hog_rider', 'valkyrie', 'skeleton_army',
+]
+DAMAGE_CHANCE = 0.4  # Chance a step also reports tower damage
+DUPLICATE_CHANCE = 0.5  # Chance both clients report the same hit
+
+
+class SimSocketManager:
+    """Stand-in for WebSocketManager that serializes and counts instead of sending"""
+
+    def __init__(self, serialize: bool = True):
+        self.serialize = serialize
+        self.channels: Dict[str, set] = {}
+        self.messages = 0
+        self.bytes = 0
+
+    def encode(self, msg_type: str, data) -> str:
+        return json.dumps({'type': msg_type, 'data': data, 'timestamp': time.time()})
+
+    async def send_encoded(self, player_id: str, message: str):
+        self.messages += 1
+        self.bytes += len(message)
+
+    async def send_to_player(self, player_id: str, msg_type: str, data):
+        self.messages += 1
+        if self.serialize:
+            self.bytes += len(self.encode(msg_type, data))
+
+    async def broadcast_channel(self, channel: str, msg_type: str, data, exclude: str = None):
+        message = self.encode(msg_type, data) if self.serialize else ''
+        for player_id in self.channels.get(channel, ()):
+            if player_id != exclude:
+                self.messages += 1
+                self.bytes += len(message)
+
+    async def subscribe(self, player_id: str, channel: str):
+        self.channels.setdefault(channel, set()).add(player_id)
+
+    async def unsubscribe(self, player_id: str, channel: str):
+        members = self.channels.get(channel)
+        if members is not None:
+            members.discard(player_id)
+            if not members:
+                del self.channels[channel]
+
+    def is_online(self, player_id: str) -> bool:
+        return True
+
+    def get_rtt(self, player_id: str):
+        return None
+
+
+class ResultCollector:
+    """Replaces the result pipeline so simulated battles never touch player data"""
+
+    def __init__(self):
+        self.results = []
+
+    def submit(self, result) -> bool:
+        self.results.append(result)
+        return True
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _sim_entry(rng: random.Random, player_id: str, mode: str) -> QueueEntry:
+    return QueueEntry(
+        player_id=player_id,
+        trophies=rng.randint(0, 6000),
+        elo=rng.randint(800, 2200),
+        deck=rng.sample(SIM_CARDS, 8),
+        mode=mode,
+    )
+
+
+async def simulate_battle(index: int, seed: int, mode: str, max_steps: int,
+                          ws_manager: SimSocketManager, latencies: List[float]) -> Dict:
+    """Play one scripted battle to completion and return its outcome"""
+    rng = random.Random(f"{seed}:{index}")
+    p1 = _sim_entry(rng, f"sim_{index}_a", mode)
+    p2 = _sim_entry(rng, f"sim_{index}_b", mode)
+
+    battle_id = (await battle_sync.create_battle_from_match(p1, p2, mode))['id']
+    for entry in (p1, p2):
+        await ws_manager.subscribe(entry.player_id, f"battle:{battle_id}")
+        await battle_sync.player_ready(battle_id, entry.player_id, ws_manager)
+    battle = battle_sync.get_battle(battle_id)
+
+    steps = rng.randint(max_steps // 2, max_steps)
+    actions = 0
+    for _ in range(steps):
+        if battle.status != 'active':
+            break
+        attacker, defender = (p1, 'player2') if rng.random() < 0.5 else (p2, 'player1')
+        action = {
+            'type': 'play_card',
+            'card_id': rng.choice(attacker.deck),
+            'x': round(rng.random(), 3),
+            'y': round(rng.random(), 3),
+            'level': rng.randint(1, 14),
+        }
+        start = time.perf_counter()
+        await battle_sync.handle_battle_action(battle_id, attacker.player_id, action, ws_manager)
+        latencies.append(time.perf_counter() - start)
+        actions += 1
+
+        if rng.random() < DAMAGE_CHANCE:
+            hit = {
+                'target': rng.choice(battle_sync.TOWERS),
+                'target_player': defender,
+                'damage': rng.randint(100, 900),
+            }
+            reporters = [p1, p2] if rng.random() < DUPLICATE_CHANCE else [attacker]
+            for reporter in reporters:
+                start = time.perf_counter()
+                await battle_sync.handle_tower_damage(battle_id, reporter.player_id, dict(hit), ws_manager)
+                latencies.append(time.perf_counter() - start)
+                actions += 1
+
+        # Yield so concurrent battles interleave as they would on a live server
+        await asyncio.sleep(0)
+
+    if battle.status != 'finished':
+        await battle_sync.end_battle(battle_id, ws_manager, timeout=True)
+
+    winner = 0
+    if battle.winner_id == p1.player_id:
+        winner = 1
+    elif battle.winner_id == p2.player_id:
+        winner = 2
+    return {
+        'index': index,
+        'winner': winner,
+        'crowns': (battle.player1_crowns, battle.player2_crowns),
+        'actions': actions,
+        'replay_actions': len(battle.replay),
+    }
+
+
+def _release_battles():
+    """Drop finished battles instead of waiting out the 30 second cleanup delay"""
+    for battle_id, battle in list(battle_sync.active_battles.items()):
+        if battle.status == 'finished':
+            battle_sync.active_battles.pop(battle_id)
+            battle_sync.keyframe_due.discard(battle_id)
+            battle_table.release(battle.slot)
+
+
+async def run_simulation(battles: int = 1000, concurrency: int = 100, seed: int = 1,
+                         mode: str = 'normal', max_steps: int = 60,
+                         trace_memory: bool = True, serialize: bool = True) -> Dict:
+    """Run a seeded batch of battles and return throughput, latency and memory stats"""
+    ws_manager = SimSocketManager(serialize=serialize)
+    collector = ResultCollector()
+    original_pipeline = battle_results_module.battle_results
+    original_flush_window = battle_sync.STATE_FLUSH_WINDOW
+    battle_results_module.battle_results = collector
+    battle_sync.STATE_FLUSH_WINDOW = 0  # Flush deltas inline so runs don't depend on timers
+
+    latencies: List[float] = []
+    outcomes: List[Dict] = []
+    peak_memory: Optional[int] = None
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for first in range(0, battles, concurrency):
+                wave = range(first, min(battles, first + concurrency))
+                outcomes.extend(await asyncio.gather(*(
+                    simulate_battle(i, seed, mode, max_steps, ws_manager, latencies) for i in wave
+                )))
+                _release_battles()
+        elapsed = time.perf_counter() - started
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        battle_results_module.battle_results = original_pipeline
+        battle_sync.STATE_FLUSH_WINDOW = original_flush_window
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    # Outcomes depend only on the seed, so the digest catches behavior changes
+    digest = hashlib.sha256(json.dumps(
+        [(o['winner'], o['crowns'], o['actions'], o['replay_actions']) for o in outcomes]
+    ).encode()).hexdigest()[:16]
+
+    latencies.sort()
+    total_actions = sum(o['actions'] for o in outcomes)
+    return {
+        'seed': seed,
+        'battles': len(outcomes),
+        'actions': total_actions,
+        'elapsed': round(elapsed, 3),
+        'battles_per_sec': round(len(outcomes) / elapsed, 1) if elapsed else 0,
+        'actions_per_sec': round(total_actions / elapsed, 1) if elapsed else 0,
+        'latency_us': {
+            'p50': round(_percentile(latencies, 50) * 1e6, 1),
+            'p95': round(_percentile(latencies, 95) * 1e6, 1),
+            'p99': round(_percentile(latencies, 99) * 1e6, 1),
+            'max': round(latencies[-1] * 1e6, 1) if latencies else 0,
+        },
+        'peak_memory_kb': round(peak_memory / 1024, 1) if peak_memory is not None else None,
+        'messages': ws_manager.messages,
+        'message_bytes': ws_manager.bytes,
+        'results': len(collector.results),
+        'wins': {
+            'player1': sum(1 for o in outcomes if o['winner'] == 1),
+            'player2': sum(1 for o in outcomes if o['winner'] == 2),
+            'tie': sum(1 for o in outcomes if o['winner'] == 0),
+        },
+        'digest': digest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless battle simulator')
+    parser.add_argument('--battles', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='Battles in flight at once')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mode', default='normal')
+    parser.add_argument('--max-steps', type=int, default=60, help='Max card plays per battle')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc (lower overhead)')
+    parser.add_argument('--no-serialize', action='store_true', help='Skip JSON encoding of messages')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run_simulation(
+        battles=args.battles,
+        concurrency=max(1, args.concurrency),
+        seed=args.seed,
+        mode=args.mode,
+        max_steps=max(2, args.max_steps),
+        trace_memory=not args.no_memory,
+        serialize=not args.no_serialize,
+    ))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Battles:     {report['battles']} in {report['elapsed']}s "
+          f"({report['battles_per_sec']} battles/sec)")
+    print(f"Actions:     {report['actions']} ({report['actions_per_sec']} actions/sec)")
+    latency = report['latency_us']
+    print(f"Latency:     p50 {latency['p50']}us  p95 {latency['p95']}us  "
+          f"p99 {latency['p99']}us  max {latency['max']}us")
+    if report['peak_memory_kb'] is not None:
+        print(f"Memory:      peak {report['peak_memory_kb']} KB")
+    print(f"Messages:    {report['messages']} ({report['message_bytes']} bytes)")
+    print(f"Wins:        {report['wins']}")
+    print(f"Digest:      {report['digest']} (seed {report['seed']})")
+
+
+if __name__ == '__main__':
+    main()
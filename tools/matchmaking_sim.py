@@ -0,0 +1,304 @@
+"""
+Matchmaking Simulator
+Offline benchmark of MatchmakingService on simulated time with synthetic player populations
+
+Usage: python -m tools.matchmaking_sim --players 10000 --duration 300 --matchers greedy,batch
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.matchmaking_service as matchmaking_service
+from services.matchmaking_service import MatchmakingService, MATCHERS
+
+TICK = 1.0  # Simulated seconds per matchmaking tick (the live loop runs every second)
+BATTLE_SECONDS = 180  # Matched players are away this long before they may queue again
+MAX_ELO = 3000
+
+
+class TimedLock(asyncio.Lock):
+    """asyncio.Lock that records how long it is held"""
+
+    def __init__(self, samples: List[float]):
+        super().__init__()
+        self._samples = samples
+        self._acquired_at = 0.0
+
+    async def acquire(self):
+        result = await super().acquire()
+        self._acquired_at = time.perf_counter()
+        return result
+
+    def release(self):
+        self._samples.append(time.perf_counter() - self._acquired_at)
+        super().release()
+
+
+class SimPlayer:
+    __slots__ = ('player_id', 'skill', 'elo', 'trophies', 'deck', 'rtt')
+
+    def __init__(self, player_id: str, skill: float, trophies: int, elo: int, rtt: float = None):
+        self.player_id = player_id
+        self.skill = skill  # True strength; ELO should converge towards it
+        self.elo = elo
+        self.trophies = trophies
+        self.deck = []
+        self.rtt = rtt  # Connection round trip time in ms
+
+
+class Population:
+    """Synthetic players: skill ~ Normal(mean, sd), trophies loosely following skill, log-normal RTTs"""
+
+    def __init__(self, rng: random.Random, skill_mean: float, skill_sd: float, trophy_noise: float,
+                 fresh: bool = False, rtt_median: float = 60):
+        self.rng = rng
+        # RTTs come from their own stream so skill/trophy draws stay the same as before
+        self.rtt_rng = random.Random(rng.random())
+        self.rtt_median = rtt_median
+        self.skill_mean = skill_mean
+        self.skill_sd = skill_sd
+        self.trophy_noise = trophy_noise
+        self.fresh = fresh  # New accounts start at 1000 ELO instead of an established rating
+        self.count = 0
+
+    def new_player(self) -> SimPlayer:
+        self.count += 1
+        skill = min(MAX_ELO, max(0, self.rng.gauss(self.skill_mean, self.skill_sd)))
+        trophies = int(max(0, (skill - 600) * 3 + self.rng.gauss(0, self.trophy_noise)))
+        elo = 1000 if self.fresh else int(self.rng.gauss(skill, 150))
+        rtt = self.rtt_median * math.exp(self.rtt_rng.gauss(0, 0.6))
+        return SimPlayer(f"sim_{self.count}", skill, trophies, max(0, elo), rtt)
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    """Poisson sample (normal approximation for large means)"""
+    if mean <= 0:
+        return 0
+    if mean > 50:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    threshold = math.exp(-mean)
+    k, p = 0, rng.random()
+    while p > threshold:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def _summary(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    if not values:
+        return {'count': 0, 'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * scale, 2)
+
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values) * scale, 2),
+        'p50': pct(50),
+        'p90': pct(90),
+        'p99': pct(99),
+        'max': round(values[-1] * scale, 2),
+    }
+
+
+async def simulate(matcher: str, players: int, arrival_rate: float, duration: float, seed: int,
+                   mode: str = 'ranked', skill_mean: float = 1200, skill_sd: float = 300,
+                   trophy_noise: float = 300, return_chance: float = 0.7, patience: float = 600,
+                   k_factor: int = None, fresh: bool = False, rtt_median: float = 60) -> Dict:
+    """Run one matcher over a synthetic population and return its report"""
+    rng = random.Random(seed)
+    population = Population(rng, skill_mean, skill_sd, trophy_noise, fresh, rtt_median)
+    service = MatchmakingService()
+    service.matcher = matcher
+    if k_factor is not None:
+        service.K_FACTOR = k_factor
+
+    now = 0.0
+    service.clock = lambda: now
+    lock_holds: List[float] = []
+    service._queue(mode).lock = TimedLock(lock_holds)
+
+    by_id: Dict[str, SimPlayer] = {}
+    returning: List[tuple] = []  # (time back in queue, player)
+    waits: List[float] = []
+    scores: List[float] = []
+    elo_diffs: List[float] = []
+    battle_rtts: List[float] = []
+    tick_cpu: List[float] = []
+    abandoned = 0
+    laggy = 0
+    upsets = 0
+    matches = 0
+
+    async def enqueue(player: SimPlayer):
+        by_id[player.player_id] = player
+        await service.join_queue(player.player_id, mode, player.trophies, player.elo, player.deck,
+                                 rtt=player.rtt)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Start with a full queue, joined over the last minute
+        for _ in range(players):
+            now = -rng.uniform(0, 60)
+            await enqueue(population.new_player())
+        now = 0.0
+
+        while now < duration:
+            # Arrivals: new players plus those back from their battles
+            for _ in range(_poisson(rng, arrival_rate * TICK)):
+                await enqueue(population.new_player())
+            while returning and returning[0][0] <= now:
+                _, player = returning.pop(0)
+                await enqueue(player)
+
+            started = time.perf_counter()
+            pairs = await service.find_matches(mode)
+            service.queue_status_updates(mode, now)
+            tick_cpu.append(time.perf_counter() - started)
+
+            for entry1, entry2 in pairs:
+                matches += 1
+                waits.extend((now - entry1.joined_at, now - entry2.joined_at))
+                scores.append(service._match_score(entry1, entry2) or 0)
+                elo_diffs.append(abs(entry1.elo - entry2.elo))
+                battle_rtts.append((entry1.rtt + entry2.rtt) / 2)
+                if min(entry1.rtt, entry2.rtt) > matchmaking_service.RTT_TARGET:
+                    laggy += 1
+
+                # Outcome from true skill; ratings move with the service's ELO formula
+                p1, p2 = by_id[entry1.player_id], by_id[entry2.player_id]
+                p1_wins = rng.random() < 1 / (1 + 10 ** ((p2.skill - p1.skill) / 400))
+                winner, loser = (p1, p2) if p1_wins else (p2, p1)
+                if (winner.elo < loser.elo) != (winner.skill < loser.skill):
+                    upsets += 1
+                winner.elo, loser.elo = service.calculate_elo_change(winner.elo, loser.elo, rng.randint(1, 3))
+                winner.trophies += 30
+                loser.trophies = max(0, loser.trophies - 20)
+
+                for player in (p1, p2):
+                    if rng.random() < return_chance:
+                        returning.append((now + BATTLE_SECONDS * rng.uniform(0.5, 1.0), player))
+            returning.sort(key=lambda item: item[0])
+
+            # Players give up after waiting too long
+            queue = service.queues[mode]
+            for entry in [e for e in queue.entries.values() if now - e.joined_at > patience]:
+                abandoned += 1
+                await service.leave_queue(entry.player_id)
+
+            now += TICK
+
+    rating_error = [abs(p.elo - p.skill) for p in by_id.values()]
+    return {
+        'matcher': matcher,
+        'matches': matches,
+        'queued_at_end': service.get_queue_size(mode),
+        'abandoned': abandoned,
+        'players_seen': population.count,
+        'wait_seconds': _summary(waits),
+        'match_score': _summary(scores),
+        'elo_diff': _summary(elo_diffs),
+        'battle_rtt_ms': _summary(battle_rtts),
+        'both_laggy_pct': round(laggy / matches * 100, 1) if matches else 0,
+        'tick_cpu_ms': _summary(tick_cpu, 1000),
+        'lock_hold_ms': _summary(lock_holds, 1000),
+        'rating_error': _summary(rating_error),
+        'favourite_lost_pct': round(upsets / matches * 100, 1) if matches else 0,
+    }
+
+
+def _print_table(reports: List[Dict]):
+    rows = [
+        ('matches', lambda r: r['matches']),
+        ('queued at end', lambda r: r['queued_at_end']),
+        ('abandoned', lambda r: r['abandoned']),
+        ('wait p50 (s)', lambda r: r['wait_seconds']['p50']),
+        ('wait p90 (s)', lambda r: r['wait_seconds']['p90']),
+        ('wait p99 (s)', lambda r: r['wait_seconds']['p99']),
+        ('score mean', lambda r: r['match_score']['mean']),
+        ('score p90', lambda r: r['match_score']['p90']),
+        ('elo diff p50', lambda r: r['elo_diff']['p50']),
+        ('elo diff p90', lambda r: r['elo_diff']['p90']),
+        ('battle rtt p50 (ms)', lambda r: r['battle_rtt_ms']['p50']),
+        ('battle rtt p90 (ms)', lambda r: r['battle_rtt_ms']['p90']),
+        ('both laggy %', lambda r: r['both_laggy_pct']),
+        ('tick cpu mean (ms)', lambda r: r['tick_cpu_ms']['mean']),
+        ('tick cpu p99 (ms)', lambda r: r['tick_cpu_ms']['p99']),
+        ('lock hold p99 (ms)', lambda r: r['lock_hold_ms']['p99']),
+        ('lock hold max (ms)', lambda r: r['lock_hold_ms']['max']),
+        ('rating error mean', lambda r: r['rating_error']['mean']),
+        ('favourite lost %', lambda r: r['favourite_lost_pct']),
+    ]
+    print(f"{'':<22}" + ''.join(f"{r['matcher']:>14}" for r in reports))
+    for label, value in rows:
+        print(f"{label:<22}" + ''.join(f"{value(r):>14}" for r in reports))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Matchmaking simulator')
+    parser.add_argument('--players', type=int, default=1000, help='Players queued at the start')
+    parser.add_argument('--arrival-rate', type=float, default=None, help='New players per second (default players/60)')
+    parser.add_argument('--duration', type=float, default=300, help='Simulated seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--matchers', default=','.join(MATCHERS), help='Comma separated matchers to compare')
+    parser.add_argument('--skill-mean', type=float, default=1200)
+    parser.add_argument('--skill-sd', type=float, default=300)
+    parser.add_argument('--trophy-noise', type=float, default=300, help='Trophy spread around skill')
+    parser.add_argument('--return-chance', type=float, default=0.7, help='Chance a player queues again after a battle')
+    parser.add_argument('--patience', type=float, default=600, help='Seconds before a player gives up')
+    parser.add_argument('--fresh', action='store_true', help='Everyone starts at 1000 ELO')
+    parser.add_argument('--k-factor', type=int, default=None)
+    parser.add_argument('--rtt-median', type=float, default=60, help='Median player RTT in ms')
+    parser.add_argument('--rtt-target', type=float, default=None, help='Battle RTT the matcher starts penalizing at')
+    parser.add_argument('--range-start', type=int, default=None)
+    parser.add_argument('--range-step', type=int, default=None)
+    parser.add_argument('--range-interval', type=float, default=None)
+    parser.add_argument('--range-max', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='Print the reports as JSON')
+    args = parser.parse_args()
+
+    # Search range expansion and the RTT target are module-level; override them for this run
+    for name, value in (('SEARCH_RANGE_START', args.range_start), ('SEARCH_RANGE_STEP', args.range_step),
+                        ('SEARCH_RANGE_INTERVAL', args.range_interval), ('SEARCH_RANGE_MAX', args.range_max),
+                        ('RTT_TARGET', args.rtt_target)):
+        if value is not None:
+            setattr(matchmaking_service, name, value)
+
+    reports = []
+    for matcher in [m.strip() for m in args.matchers.split(',') if m.strip()]:
+        if matcher not in MATCHERS:
+            parser.error(f"unknown matcher {matcher!r} (choose from {', '.join(MATCHERS)})")
+        reports.append(asyncio.run(simulate(
+            matcher=matcher,
+            players=args.players,
+            arrival_rate=args.arrival_rate if args.arrival_rate is not None else args.players / 60,
+            duration=args.duration,
+            seed=args.seed,
+            skill_mean=args.skill_mean,
+            skill_sd=args.skill_sd,
+            trophy_noise=args.trophy_noise,
+            return_chance=args.return_chance,
+            patience=args.patience,
+            k_factor=args.k_factor,
+            fresh=args.fresh,
+            rtt_median=args.rtt_median,
+        )))
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        _print_table(reports)
+
+
+if __name__ == '__main__':
+    main()
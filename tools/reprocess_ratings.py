@@ -0,0 +1,228 @@
+"""
+Rating Reprocessor
+Recomputes every player's rating from the stored battle history (Glicko-2 periods or per-battle ELO)
+
+Usage: python -m tools.reprocess_ratings --system glicko2 [--apply]
+       python -m tools.reprocess_ratings --synthetic 1000000 --players 50000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.rating as rating_module
+from database.battle_history import HISTORY_PATH, read_battles
+from services.matchmaking_service import MatchmakingService
+from services.rating import (
+    DEFAULT_RATING, DEFAULT_DEVIATION, DEFAULT_VOLATILITY, RATING_SYSTEMS,
+    battle_sides, flatten_battles, inflate_deviation, rate_period,
+)
+from websocket.battle_bots import is_bot
+
+Battle = Tuple[List[str], List[str], float]
+HistoryEntry = Tuple[float, Battle, int]  # (end time, sides, winner's crowns)
+SYNTHETIC_BATTLES_PER_PERIOD = 5  # Per player
+
+
+def load_history(path: str) -> List[HistoryEntry]:
+    """(end time, sides, winner's crowns) for every stored battle without bots, oldest first"""
+    battles = []
+    for entry in read_battles(path):
+        side1, side2, score = battle_sides(entry)
+        if not side1 or not side2 or any(is_bot(p) for p in side1 + side2):
+            continue
+        winner_crowns = max(entry.get('player1_crowns', 1), entry.get('player2_crowns', 1))
+        battles.append((entry.get('end_time', 0), (side1, side2, score), winner_crowns))
+    battles.sort(key=lambda item: item[0])
+    return battles
+
+
+def synthetic_history(battles: int, players: int, seed: int, period: float) -> List[HistoryEntry]:
+    """Random one-crown 1v1 battles between players of hidden skill, about five per player per rating period"""
+    rng = random.Random(seed)
+    skill = [rng.gauss(1000, 300) for _ in range(players)]
+    spacing = period / (players * SYNTHETIC_BATTLES_PER_PERIOD / 2)
+    history = []
+    for i in range(battles):
+        a, b = rng.sample(range(players), 2)
+        p_a = 1 / (1 + 10 ** ((skill[b] - skill[a]) / 400))
+        history.append((i * spacing, ([f"p{a}"], [f"p{b}"], 1.0 if rng.random() < p_a else 0.0), 1))
+    return history
+
+
+def _by_period(history: Iterable[HistoryEntry], period: float) -> Dict[int, List[Battle]]:
+    periods: Dict[int, List[Battle]] = {}
+    for end_time, battle, _ in history:
+        periods.setdefault(int(end_time // period), []).append(battle)
+    return periods
+
+
+def reprocess_glicko2(history: List[HistoryEntry], period: float) -> Tuple[Dict[str, Dict], Dict]:
+    """Replay the history period by period, updating only each period's players"""
+    index: Dict[str, int] = {}
+    size = 1024
+    rating = np.full(size, float(DEFAULT_RATING))
+    deviation = np.full(size, DEFAULT_DEVIATION)
+    volatility = np.full(size, DEFAULT_VOLATILITY)
+    last_period = np.full(size, -1, dtype=np.int64)
+    correct = decided = 0
+
+    periods = _by_period(history, period)
+    for number in sorted(periods):
+        member_player, member_side, side_score = flatten_battles(periods[number], index)
+        if len(index) > size:
+            grow = max(len(index), size * 2) - size
+            rating = np.concatenate([rating, np.full(grow, float(DEFAULT_RATING))])
+            deviation = np.concatenate([deviation, np.full(grow, DEFAULT_DEVIATION)])
+            volatility = np.concatenate([volatility, np.full(grow, DEFAULT_VOLATILITY)])
+            last_period = np.concatenate([last_period, np.full(grow, -1, dtype=np.int64)])
+            size += grow
+
+        # Work on this period's players only
+        players, local = np.unique(member_player, return_inverse=True)
+        idle = np.where(last_period[players] < 0, 0, number - last_period[players] - 1)
+        dev = inflate_deviation(deviation[players], volatility[players], idle)
+
+        # How often the higher rated side won, before the update
+        side_rating = np.bincount(member_side, rating[member_player], minlength=len(side_score)) / np.maximum(
+            np.bincount(member_side, minlength=len(side_score)), 1)
+        favourite_won = (side_rating[0::2] > side_rating[1::2]) == (side_score[0::2] > 0.5)
+        decisive = (side_score[0::2] != 0.5) & (side_rating[0::2] != side_rating[1::2])
+        correct += int(np.count_nonzero(favourite_won & decisive))
+        decided += int(np.count_nonzero(decisive))
+
+        new_rating, new_dev, new_vol = rate_period(
+            rating[players], dev, volatility[players], local.reshape(-1), member_side, side_score
+        )
+        rating[players] = new_rating
+        deviation[players] = new_dev
+        volatility[players] = new_vol
+        last_period[players] = number
+
+    results = {
+        player_id: {
+            'elo': max(0, int(round(rating[i]))),
+            'rating_deviation': round(float(deviation[i]), 2),
+            'rating_volatility': round(float(volatility[i]), 6),
+            'rating_period': int(last_period[i]),
+        }
+        for player_id, i in index.items()
+    }
+    return results, {'periods': len(periods), 'favourite_won_pct': round(correct / decided * 100, 1) if decided else 0}
+
+
+def reprocess_elo(history: List[HistoryEntry]) -> Tuple[Dict[str, Dict], Dict]:
+    """Replay the history one battle at a time with the live K-factor formula and crown multiplier"""
+    service = MatchmakingService()
+    elo: Dict[str, int] = {}
+    correct = decided = 0
+    for _, (side1, side2, score), winner_crowns in history:
+        for player_id in side1 + side2:
+            elo.setdefault(player_id, DEFAULT_RATING)
+        # Team battles move every member by their team average's change (rounded, as when the battle is created)
+        elo1 = round(sum(elo[p] for p in side1) / len(side1))
+        elo2 = round(sum(elo[p] for p in side2) / len(side2))
+        if score != 0.5 and elo1 != elo2:
+            decided += 1
+            correct += (elo1 > elo2) == (score > 0.5)
+        if score == 1.0:
+            new1, new2 = service.calculate_elo_change(elo1, elo2, winner_crowns)
+        elif score == 0.0:
+            new2, new1 = service.calculate_elo_change(elo2, elo1, winner_crowns)
+        else:
+            continue
+        for side, change in ((side1, new1 - elo1), (side2, new2 - elo2)):
+            for player_id in side:
+                elo[player_id] = max(0, elo[player_id] + change)
+    results = {player_id: {'elo': value} for player_id, value in elo.items()}
+    return results, {'favourite_won_pct': round(correct / decided * 100, 1) if decided else 0}
+
+
+async def apply_ratings(results: Dict[str, Dict]) -> int:
+    """Write recomputed ratings into player stats (one batched save)"""
+    from database import json_db as db
+
+    players = []
+    for player_id, values in results.items():
+        player = await db.get_player(player_id)
+        if player:
+            player.setdefault('stats', {}).update(values)
+            players.append(player)
+    if players:
+        await db.save_players(players)
+    return len(players)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute ratings from the battle history')
+    parser.add_argument('--system', default='glicko2', choices=RATING_SYSTEMS)
+    parser.add_argument('--history', default=HISTORY_PATH, help='Battle history JSONL')
+    parser.add_argument('--period', type=float, default=rating_module.RATING_PERIOD, help='Seconds per rating period')
+    parser.add_argument('--synthetic', type=int, default=0, help='Rate this many random battles instead of the history')
+    parser.add_argument('--players', type=int, default=10000, help='Players in the synthetic history')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--top', type=int, default=10, help='Highest ratings to print')
+    parser.add_argument('--apply', action='store_true', help='Write the ratings to player data')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    if args.synthetic and args.apply:
+        parser.error('--apply cannot be used with --synthetic')
+
+    started = time.perf_counter()
+    if args.synthetic:
+        history = synthetic_history(args.synthetic, max(2, args.players), args.seed, args.period)
+    else:
+        history = load_history(args.history)
+    loaded = time.perf_counter()
+
+    if args.system == 'glicko2':
+        results, summary = reprocess_glicko2(history, args.period)
+    else:
+        results, summary = reprocess_elo(history)
+    elapsed = time.perf_counter() - loaded
+
+    report = {
+        'system': args.system,
+        'battles': len(history),
+        'players': len(results),
+        **summary,
+        'load_seconds': round(loaded - started, 3),
+        'rate_seconds': round(elapsed, 3),
+        'battles_per_sec': round(len(history) / elapsed) if elapsed else 0,
+        'top': sorted(
+            ({'player_id': player_id, **values} for player_id, values in results.items()),
+            key=lambda r: -r['elo'],
+        )[:args.top],
+    }
+    if args.apply:
+        report['applied'] = asyncio.run(apply_ratings(results))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"System:      {report['system']}")
+    print(f"Battles:     {report['battles']} ({report['players']} players"
+          + (f", {report['periods']} periods)" if 'periods' in report else ')'))
+    print(f"Time:        load {report['load_seconds']}s  rate {report['rate_seconds']}s "
+          f"({report['battles_per_sec']} battles/sec)")
+    print(f"Favourite won: {report['favourite_won_pct']}% of decided battles")
+    for row in report['top']:
+        extra = f"  rd {row['rating_deviation']}" if 'rating_deviation' in row else ''
+        print(f"  {row['player_id']:<24} {row['elo']:>6}{extra}")
+    if 'applied' in report:
+        print(f"Applied:     {report['applied']} players updated")
+
+
+if __name__ == '__main__':
+    main()
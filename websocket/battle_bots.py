@@ -0,0 +1,149 @@
+"""
+Battle Bots
+Server-side opponents for players the matchmaker could not pair in time
+"""
+
+import asyncio
+import random
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List
+
+from websocket.battle_table import battle_table
+
+BOT_PREFIX = 'bot_'
+BOT_TICK = 1.0  # Seconds between bot decisions (all bots share one loop)
+BOT_ELO_SPREAD = 50  # Bot rating is the player's rating +/- this
+BOT_TROPHY_SPREAD = 100
+BOT_MIN_ELIXIR = 3  # Bots save up at least this much before playing a card
+BOT_MAX_ELIXIR = 8
+BOT_CARD_LEVEL = 9
+SPELL_CARDS = {
+    'arrows', 'fb', 'goblinbarrel', 'graveyard', 'lightning', 'mirror',
+    'poison', 'rage', 'rocket', 'snowball', 'tornado', 'zap',
+}
+
+
+def is_bot(player_id: str) -> bool:
+    return bool(player_id) and player_id.startswith(BOT_PREFIX)
+
+
+@dataclass(slots=True)
+class BotState:
+    battle_id: str
+    bot_id: str
+    side: int  # Elixir column of the bot's side (0 = player1, 1 = player2)
+    deck: List[str]
+    rng: random.Random
+    # Elixir the bot waits for before its next card
+    threshold: float = BOT_MIN_ELIXIR
+    actions: int = 0
+
+
+class BotRunner:
+    def __init__(self):
+        # battle_id -> bot playing in it
+        self.bots: Dict[str, BotState] = {}
+        self.battles_started = 0
+
+    def add(self, battle_id: str, bot_id: str, side: int, deck: List[str]):
+        rng = random.Random(battle_id)
+        self.bots[battle_id] = BotState(
+            battle_id=battle_id,
+            bot_id=bot_id,
+            side=side,
+            deck=list(deck) or ['knight'],
+            rng=rng,
+            threshold=rng.uniform(BOT_MIN_ELIXIR, BOT_MAX_ELIXIR),
+        )
+        self.battles_started += 1
+
+    def get_metrics(self) -> Dict:
+        return {'active_bots': len(self.bots), 'bot_battles': self.battles_started}
+
+    async def tick(self, ws_manager):
+        """Let every bot with enough elixir play one card"""
+        from websocket.battle_sync import get_battle, handle_battle_action
+
+        for battle_id, bot in list(self.bots.items()):
+            battle = get_battle(battle_id)
+            if not battle or battle.status == 'finished':
+                del self.bots[battle_id]
+                continue
+            if battle.status != 'active':
+                continue
+
+            elixir = battle_table.elixir[battle.slot, bot.side]
+            if elixir < bot.threshold:
+                continue
+
+            battle_table.elixir[battle.slot, bot.side] = elixir - bot.threshold
+            bot.threshold = bot.rng.uniform(BOT_MIN_ELIXIR, BOT_MAX_ELIXIR)
+            bot.actions += 1
+            await handle_battle_action(battle_id, bot.bot_id, _bot_action(bot), ws_manager)
+
+
+def _bot_action(bot: BotState) -> Dict:
+    """A card play in the bot's own half (or a spell anywhere on the opponent's side)"""
+    card_id = bot.rng.choice(bot.deck)
+    x = round(bot.rng.uniform(0.1, 0.9), 3)
+    if card_id in SPELL_CARDS:
+        return {'type': 'cast_spell', 'card_id': card_id, 'x': x, 'y': round(bot.rng.uniform(0.1, 0.4), 3)}
+    return {
+        'type': 'spawn_troop',
+        'card_id': card_id,
+        'level': BOT_CARD_LEVEL,
+        'x': x,
+        'y': round(bot.rng.uniform(0.6, 0.9), 3),
+        'lane': 'left' if x < 0.5 else 'right',
+    }
+
+
+# Global bot runner instance
+bot_runner = BotRunner()
+
+
+async def start_bot_battle(ws_manager, entry, mode: str) -> Dict:
+    """Create a battle between a queued player and a bot of similar strength"""
+    from services.matchmaking_service import QueueEntry
+    from websocket.battle_sync import create_battle_from_match, player_ready
+
+    rng = random.Random(entry.player_id + str(entry.joined_at))
+    bot = QueueEntry(
+        player_id=f"{BOT_PREFIX}{uuid.uuid4().hex[:12]}",
+        trophies=max(0, entry.trophies + rng.randint(-BOT_TROPHY_SPREAD, BOT_TROPHY_SPREAD)),
+        elo=max(0, entry.elo + rng.randint(-BOT_ELO_SPREAD, BOT_ELO_SPREAD)),
+        deck=rng.sample(entry.deck, len(entry.deck)) if entry.deck else [],
+        mode=mode,
+    )
+
+    battle = await create_battle_from_match(entry, bot, mode)
+    bot_runner.add(battle['id'], bot.player_id, 1, bot.deck)
+    await player_ready(battle['id'], bot.player_id, ws_manager)
+
+    await ws_manager.send_to_player(entry.player_id, 'match_found', {
+        'battle_id': battle['id'],
+        'opponent': {
+            'id': bot.player_id,
+            'trophies': bot.trophies,
+            'deck': bot.deck,
+            'bot': True,
+        },
+        'mode': mode,
+        'you_are': 'player1'
+    })
+    await ws_manager.subscribe(entry.player_id, f"battle:{battle['id']}")
+
+    print(f"Bot backfill: {entry.player_id} vs {bot.player_id} ({mode})")
+    return battle
+
+
+async def bot_loop(ws_manager):
+    """Background task driving every bot at a low tick rate"""
+    while True:
+        try:
+            await bot_runner.tick(ws_manager)
+        except Exception as e:
+            print(f"Bot loop error: {e}")
+
+        await asyncio.sleep(BOT_TICK)
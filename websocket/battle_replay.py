@@ -0,0 +1,160 @@
+"""
+Battle Replay Recording
+Compact, array-backed action log for a running battle
+"""
+
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional
+
+# Binary layout: header, string table, then one column per field
+REPLAY_MAGIC = b'ARRP'
+REPLAY_VERSION = 1
+_HEADER = struct.Struct('<4sBdHI')  # magic, version, start_time, string count, action count
+
+NO_VALUE = 0xFFFF  # Missing card / coordinate / lane
+COORD_SCALE = 65534  # Normalized 0-1 coordinates are stored as uint16
+
+
+class ReplayRecorder:
+    """Records battle actions as delta-timestamped columns instead of dicts"""
+
+    def __init__(self):
+        self.start_time: float = 0
+        self._last_ms: int = 0
+        # Interned strings (action types, card ids, lanes)
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        # Columns, one entry per action
+        self.deltas = array('I')   # ms since previous action
+        self.players = array('B')  # participant slot (index in player1's team + player2's team)
+        self.types = array('H')    # string id of action type
+        self.cards = array('H')    # string id of card, NO_VALUE if none
+        self.xs = array('H')       # quantized x, NO_VALUE if none
+        self.ys = array('H')       # quantized y, NO_VALUE if none
+        self.levels = array('B')   # card level, 0 if none
+        self.lanes = array('H')    # string id of lane, NO_VALUE if none
+
+    def __len__(self) -> int:
+        return len(self.deltas)
+
+    def start(self, start_time: float):
+        """Set the battle start time all deltas are relative to"""
+        self.start_time = start_time
+        self._last_ms = 0
+
+    def _intern(self, value) -> int:
+        if value is None:
+            return NO_VALUE
+        value = str(value)[:64]
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            if len(self._strings) >= NO_VALUE:
+                return NO_VALUE
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    @staticmethod
+    def _quantize(value) -> int:
+        if value is None:
+            return NO_VALUE
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return NO_VALUE
+        return int(round(min(1.0, max(0.0, value)) * COORD_SCALE))
+
+    def record(self, player_slot: int, action: Dict, timestamp: float):
+        """Append an action taken at the given wall-clock time"""
+        battle_ms = max(0, int((timestamp - self.start_time) * 1000))
+        self.deltas.append(max(0, battle_ms - self._last_ms))
+        self._last_ms = max(self._last_ms, battle_ms)
+
+        level = action.get('level')
+        self.players.append(player_slot)
+        self.types.append(self._intern(action.get('type', 'unknown')))
+        self.cards.append(self._intern(action.get('card_id')))
+        self.xs.append(self._quantize(action.get('x')))
+        self.ys.append(self._quantize(action.get('y')))
+        self.levels.append(level if isinstance(level, int) and 0 < level < 256 else 0)
+        self.lanes.append(self._intern(action.get('lane')))
+
+    def _columns(self) -> List[array]:
+        return [self.deltas, self.players, self.types, self.cards,
+                self.xs, self.ys, self.levels, self.lanes]
+
+    def encode(self) -> bytes:
+        """Serialize the recording to the compact binary replay format"""
+        parts = [_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.start_time,
+                              len(self._strings), len(self.deltas))]
+        for value in self._strings:
+            data = value.encode('utf-8')[:255]
+            parts.append(struct.pack('<B', len(data)))
+            parts.append(data)
+        for column in self._columns():
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'ReplayRecorder':
+        """Load a recording from the binary replay format"""
+        magic, version, start_time, string_count, count = _HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError('Not a replay')
+
+        recorder = cls()
+        recorder.start_time = start_time
+        offset = _HEADER.size
+        for _ in range(string_count):
+            length = data[offset]
+            recorder._intern(data[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+
+        for column in recorder._columns():
+            size = column.itemsize * count
+            column.frombytes(data[offset:offset + size])
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column.byteswap()
+            offset += size
+
+        recorder._last_ms = sum(recorder.deltas)
+        return recorder
+
+    def _string(self, string_id: int) -> Optional[str]:
+        return None if string_id == NO_VALUE else self._strings[string_id]
+
+    def to_actions(self, start: int = 0, participants: Optional[List[str]] = None) -> List[Dict]:
+        """Expand recorded actions (from index start) back into dicts, naming each player if participants is given"""
+        # Slots index the participants (both teams, player1's first); without them a slot is read as a side,
+        # as in replays recorded before team slots
+        team_size = max(1, len(participants) // 2) if participants else 1
+        actions = []
+        battle_ms = sum(self.deltas[:start])
+        for i in range(start, len(self.deltas)):
+            battle_ms += self.deltas[i]
+            slot = self.players[i]
+            action = {
+                'from': f'player{min(slot // team_size, 1) + 1}',
+                'type': self._string(self.types[i]),
+                'battle_time': battle_ms / 1000,
+            }
+            if participants and slot < len(participants):
+                action['player_id'] = participants[slot]
+            if self.cards[i] != NO_VALUE:
+                action['card_id'] = self._string(self.cards[i])
+            if self.xs[i] != NO_VALUE:
+                action['x'] = round(self.xs[i] / COORD_SCALE, 4)
+            if self.ys[i] != NO_VALUE:
+                action['y'] = round(self.ys[i] / COORD_SCALE, 4)
+            if self.levels[i]:
+                action['level'] = self.levels[i]
+            if self.lanes[i] != NO_VALUE:
+                action['lane'] = self._string(self.lanes[i])
+            actions.append(action)
+        return actions
@@ -1,18 +1,39 @@
 """
 Battle Synchronization
-Handles real-time battle state between two players
+Handles real-time battle state between two players (or two teams of two)
 """
 
 import asyncio
 import time
 import uuid
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from dataclasses import dataclass, field
+from websocket.battle_replay import ReplayRecorder
+from websocket.battle_table import (
+    battle_table, table_column, HP_COLUMNS, STATUS_CODES, STATUS_NAMES,
+)
+from websocket.spectators import spectators
 
 # Active battles: battle_id -> Battle
 active_battles: Dict[str, 'Battle'] = {}
-
-@dataclass
+# Player index: player_id -> battle_id (only for waiting/active battles)
+player_battles: Dict[str, str] = {}
+# Battles that sent deltas since their last keyframe
+keyframe_due: Set[str] = set()
+# Battles with a player inside the reconnect grace window
+awaiting_reconnect: Set[str] = set()
+
+# State sync tuning
+STATE_FLUSH_WINDOW = 0.1  # Coalesce tower damage for this long before sending a delta
+KEYFRAME_INTERVAL = 5  # Seconds between full battle_state keyframes
+DUPLICATE_HIT_WINDOW = 0.5  # Identical reports from both clients within this window count once
+TOWERS = ('king', 'left', 'right')
+
+# Reconnects
+RECONNECT_GRACE = 20  # Seconds a disconnected player has to rejoin before forfeiting
+SNAPSHOT_ACTION_TAIL = 30  # Recent actions sent with a reconnect snapshot
+
+@dataclass(slots=True)
 class Battle:
     id: str
     mode: str
@@ -25,39 +46,115 @@ class Battle:
     player1_elo: int
     player2_elo: int
 
-    # Battle state
-    status: str = 'waiting'  # waiting, active, finished
-    start_time: float = 0
+    # Row in battle_table holding status, timing, tower HP, crowns and elixir
+    slot: int = -1
     end_time: float = 0
-    duration: int = 180  # 3 minutes default
+
+    # Actions log (for replay/validation)
+    replay: ReplayRecorder = field(default_factory=ReplayRecorder)
+
+    # Teams (player1/player2 lead their side; 2v2 adds a partner to each)
+    player1_team: List[str] = field(default_factory=list)
+    player2_team: List[str] = field(default_factory=list)
+    # Each participant's own ELO in team battles (player1_elo/player2_elo are team averages)
+    member_elos: Dict[str, int] = field(default_factory=dict)
+
+    # Ready status
+    ready: Set[str] = field(default_factory=set)
+
+    # Result
+    winner_id: Optional[str] = None
+    result_reported: bool = False
+
+    # State sync: sequence number, changes waiting to be flushed, recent hit reports
+    state_seq: int = 0
+    pending_state: Dict[str, Any] = field(default_factory=dict)
+    flush_scheduled: bool = False
+    last_keyframe: float = 0
+    recent_hits: Dict[tuple, List[Tuple[float, Set[str]]]] = field(default_factory=dict)
+
+    # Disconnected players: player_id -> time they forfeit unless they rejoin
+    disconnected: Dict[str, float] = field(default_factory=dict)
+    # Players whose reconnect window ran out (a side forfeits once all its players have)
+    abandoned: Set[str] = field(default_factory=set)
+
+    def __post_init__(self):
+        self.slot = battle_table.allocate(self.id)
+        if not self.player1_team:
+            self.player1_team = [self.player1_id]
+        if not self.player2_team:
+            self.player2_team = [self.player2_id]
+
+    @property
+    def participants(self) -> List[str]:
+        return self.player1_team + self.player2_team
+
+    def side(self, player_id: str) -> Optional[str]:
+        """'player1' or 'player2' for the side a participant plays on"""
+        if player_id in self.player1_team:
+            return 'player1'
+        if player_id in self.player2_team:
+            return 'player2'
+        return None
+
+    def team(self, side: str) -> List[str]:
+        return self.player1_team if side == 'player1' else self.player2_team
+
+    # Battle state (stored in battle_table)
+    @property
+    def status(self) -> str:  # waiting, active, finished
+        return STATUS_NAMES[int(battle_table.status[self.slot])]
+
+    @status.setter
+    def status(self, value: str):
+        battle_table.status[self.slot] = STATUS_CODES[value]
+
+    @property
+    def start_time(self) -> float:
+        return float(battle_table.start_time[self.slot])
+
+    @start_time.setter
+    def start_time(self, value: float):
+        battle_table.set_timing(self.slot, start_time=value)
+
+    @property
+    def duration(self) -> int:  # 3 minutes default
+        return int(battle_table.duration[self.slot])
+
+    @duration.setter
+    def duration(self, value: int):
+        battle_table.set_timing(self.slot, duration=value)
 
     # Tower health
-    player1_king_hp: int = 4000
-    player1_left_hp: int = 2000
-    player1_right_hp: int = 2000
-    player2_king_hp: int = 4000
-    player2_left_hp: int = 2000
-    player2_right_hp: int = 2000
+    player1_king_hp = table_column('hp', HP_COLUMNS['player1_king_hp'], int)
+    player1_left_hp = table_column('hp', HP_COLUMNS['player1_left_hp'], int)
+    player1_right_hp = table_column('hp', HP_COLUMNS['player1_right_hp'], int)
+    player2_king_hp = table_column('hp', HP_COLUMNS['player2_king_hp'], int)
+    player2_left_hp = table_column('hp', HP_COLUMNS['player2_left_hp'], int)
+    player2_right_hp = table_column('hp', HP_COLUMNS['player2_right_hp'], int)
 
     # Crowns
-    player1_crowns: int = 0
-    player2_crowns: int = 0
+    player1_crowns = table_column('crowns', 0, int)
+    player2_crowns = table_column('crowns', 1, int)
 
     # Elixir
-    player1_elixir: float = 5.0
-    player2_elixir: float = 5.0
-    elixir_rate: float = 1.0  # per second
+    player1_elixir = table_column('elixir', 0)
+    player2_elixir = table_column('elixir', 1)
+    elixir_rate = table_column('elixir_rate')  # per second
 
-    # Actions log (for replay/validation)
-    actions: List[Dict] = field(default_factory=list)
 
-    # Ready status
-    player1_ready: bool = False
-    player2_ready: bool = False
+def _index_battle(battle: Battle):
+    """Add a battle's players to the player index"""
+    for player_id in battle.participants:
+        player_battles[player_id] = battle.id
 
-    # Result
-    winner_id: Optional[str] = None
-    result_reported: bool = False
+
+def _unindex_battle(battle: Battle):
+    """Remove a battle's players from the player index"""
+    for player_id in battle.participants:
+        # Only drop the entry if it still points at this battle
+        if player_battles.get(player_id) == battle.id:
+            del player_battles[player_id]
 
 
 def create_battle(player1_id: str, player2_id: str, mode: str = 'pvp') -> Battle:
@@ -83,6 +180,7 @@ def create_battle(player1_id: str, player2_id: str, mode: str = 'pvp') -> Battle
         battle.duration = 180
 
     active_battles[battle_id] = battle
+    _index_battle(battle)
 
     print(f"Battle created: {battle_id} ({player1_id} vs {player2_id})")
 
@@ -112,6 +210,7 @@ async def create_battle_from_match(player1, player2, mode: str) -> Dict:
         battle.duration = 180
 
     active_battles[battle_id] = battle
+    _index_battle(battle)
 
     print(f"Battle created: {battle_id} ({player1.player_id} vs {player2.player_id})")
 
@@ -123,6 +222,42 @@ async def create_battle_from_match(player1, player2, mode: str) -> Dict:
     }
 
 
+async def create_team_battle(team1: List, team2: List, mode: str) -> Dict:
+    """Create a battle between two teams from matchmaking (the first entry of each team leads it)"""
+    battle_id = str(uuid.uuid4())
+    leader1, leader2 = team1[0], team2[0]
+
+    battle = Battle(
+        id=battle_id,
+        mode=mode,
+        player1_id=leader1.player_id,
+        player2_id=leader2.player_id,
+        player1_deck=leader1.deck,
+        player2_deck=leader2.deck,
+        player1_trophies=leader1.trophies,
+        player2_trophies=leader2.trophies,
+        player1_elo=round(sum(e.elo for e in team1) / len(team1)),
+        player2_elo=round(sum(e.elo for e in team2) / len(team2)),
+        player1_team=[e.player_id for e in team1],
+        player2_team=[e.player_id for e in team2],
+        member_elos={e.player_id: e.elo for e in team1 + team2},
+    )
+
+    active_battles[battle_id] = battle
+    _index_battle(battle)
+
+    print(f"Battle created: {battle_id} ({' & '.join(battle.player1_team)} vs {' & '.join(battle.player2_team)})")
+
+    return {
+        'id': battle_id,
+        'mode': mode,
+        'player1': leader1.player_id,
+        'player2': leader2.player_id,
+        'player1_team': battle.player1_team,
+        'player2_team': battle.player2_team,
+    }
+
+
 async def player_ready(battle_id: str, player_id: str, ws_manager) -> bool:
     """Mark a player as ready to start"""
     if battle_id not in active_battles:
@@ -130,17 +265,16 @@ async def player_ready(battle_id: str, player_id: str, ws_manager) -> bool:
 
     battle = active_battles[battle_id]
 
-    if player_id == battle.player1_id:
-        battle.player1_ready = True
-    elif player_id == battle.player2_id:
-        battle.player2_ready = True
-    else:
+    if battle.side(player_id) is None:
         return False
+    battle.ready.add(player_id)
 
-    # Both ready? Start the battle
-    if battle.player1_ready and battle.player2_ready:
+    # Everyone ready? Start the battle
+    if battle.status == 'waiting' and battle.ready.issuperset(battle.participants):
         battle.status = 'active'
         battle.start_time = time.time()
+        battle.last_keyframe = battle.start_time
+        battle.replay.start(battle.start_time)
 
         # Notify both players
         await ws_manager.broadcast_channel(f"battle:{battle_id}", 'battle_start', {
@@ -166,20 +300,24 @@ async def handle_battle_action(battle_id: str, player_id: str, action: Dict, ws_
         return False
 
     # Validate player is in this battle
-    if player_id not in [battle.player1_id, battle.player2_id]:
+    side = battle.side(player_id)
+    if side is None:
         return False
 
     # Record action with timestamp
+    now = time.time()
     action['player_id'] = player_id
-    action['timestamp'] = time.time()
-    action['battle_time'] = time.time() - battle.start_time
-    battle.actions.append(action)
+    action['timestamp'] = now
+    action['battle_time'] = now - battle.start_time
+    battle.replay.record(battle.participants.index(player_id), action, now)
 
-    # Broadcast action to opponent
-    await ws_manager.broadcast_channel(f"battle:{battle_id}", 'battle_action', {
+    # Broadcast action to everyone else in the battle
+    message = {
         'action': action,
-        'from': 'player1' if player_id == battle.player1_id else 'player2',
-    }, exclude=player_id)
+        'from': side,
+    }
+    await ws_manager.broadcast_channel(f"battle:{battle_id}", 'battle_action', message, exclude=player_id)
+    spectators.record_action(battle_id, message)
 
     return True
 
@@ -191,43 +329,96 @@ async def handle_tower_damage(battle_id: str, player_id: str, damage_data: Dict,
 
     battle = active_battles[battle_id]
 
-    if battle.status != 'active':
+    if battle.status != 'active' or battle.side(player_id) is None:
         return False
 
     target = damage_data.get('target')  # 'king', 'left', 'right'
     damage = damage_data.get('damage', 0)
     target_player = damage_data.get('target_player')  # 'player1' or 'player2'
 
+    if target not in TOWERS or not isinstance(damage, (int, float)) or damage <= 0:
+        return False
+    if target_player != 'player1':
+        target_player = 'player2'
+
+    # Both clients report the same hit; only apply it once
+    if _is_duplicate_hit(battle, player_id, (target_player, target, damage)):
+        return True
+
     # Apply damage (trust client for now, can add validation later)
-    if target_player == 'player1':
-        if target == 'king':
-            battle.player1_king_hp = max(0, battle.player1_king_hp - damage)
-        elif target == 'left':
-            battle.player1_left_hp = max(0, battle.player1_left_hp - damage)
-        elif target == 'right':
-            battle.player1_right_hp = max(0, battle.player1_right_hp - damage)
-    else:
-        if target == 'king':
-            battle.player2_king_hp = max(0, battle.player2_king_hp - damage)
-        elif target == 'left':
-            battle.player2_left_hp = max(0, battle.player2_left_hp - damage)
-        elif target == 'right':
-            battle.player2_right_hp = max(0, battle.player2_right_hp - damage)
+    hp_field = f'{target_player}_{target}_hp'
+    old_hp = getattr(battle, hp_field)
+    new_hp = max(0, int(old_hp - damage))
+    if new_hp == old_hp:
+        return True
+    setattr(battle, hp_field, new_hp)
+    changes = {f'{target_player}_hp': {target: new_hp}}
 
     # Update crowns
-    battle.player1_crowns = _calculate_crowns(
-        battle.player2_king_hp, battle.player2_left_hp, battle.player2_right_hp
-    )
-    battle.player2_crowns = _calculate_crowns(
-        battle.player1_king_hp, battle.player1_left_hp, battle.player1_right_hp
-    )
+    old_crowns = (battle.player1_crowns, battle.player2_crowns)
+    battle_table.update_crowns(battle.slot)
+    if battle.player1_crowns != old_crowns[0]:
+        changes['player1_crowns'] = battle.player1_crowns
+    if battle.player2_crowns != old_crowns[1]:
+        changes['player2_crowns'] = battle.player2_crowns
+
+    _merge_state(battle.pending_state, changes)
 
-    # Check for 3-crown victory
+    # Check for 3-crown victory (send the final state before the result)
     if battle.player1_crowns >= 3 or battle.player2_crowns >= 3:
+        await _flush_state(battle, ws_manager)
         await end_battle(battle_id, ws_manager)
+        return True
 
-    # Sync state to both players
-    await ws_manager.broadcast_channel(f"battle:{battle_id}", 'battle_state', {
+    # Sync state to both players, coalescing hits within the flush window
+    if STATE_FLUSH_WINDOW <= 0:
+        await _flush_state(battle, ws_manager)
+    elif not battle.flush_scheduled:
+        battle.flush_scheduled = True
+        asyncio.create_task(_flush_state_later(battle, ws_manager))
+
+    return True
+
+
+def _is_duplicate_hit(battle: Battle, player_id: str, hit: tuple) -> bool:
+    """Match a hit report against an applied hit with the same values that this client has not reported yet"""
+    # Every applied hit waits (up to the window) for the other clients' reports of it, so two real hits
+    # with the same values stay two hits however the reports interleave
+    now = time.time()
+    applied = [(reported_at, reporters) for reported_at, reporters in battle.recent_hits.get(hit, [])
+               if now - reported_at <= DUPLICATE_HIT_WINDOW]
+    match = next((reporters for _, reporters in applied if player_id not in reporters), None)
+    if match is not None:
+        match.add(player_id)
+        # Every client has reported it, nothing more to pair
+        if len(match) >= len(battle.participants):
+            applied = [entry for entry in applied if entry[1] is not match]
+    else:
+        applied.append((now, {player_id}))
+
+    if applied:
+        battle.recent_hits[hit] = applied
+    else:
+        battle.recent_hits.pop(hit, None)
+    if len(battle.recent_hits) > 32:
+        for key, entries in list(battle.recent_hits.items()):
+            if now - entries[-1][0] > DUPLICATE_HIT_WINDOW:
+                del battle.recent_hits[key]
+    return match is not None
+
+
+def _merge_state(pending: Dict, changes: Dict):
+    """Merge state changes into a pending delta"""
+    for key, value in changes.items():
+        if isinstance(value, dict):
+            pending.setdefault(key, {}).update(value)
+        else:
+            pending[key] = value
+
+
+def _full_state(battle: Battle) -> Dict:
+    """Build the complete tower/crown state of a battle"""
+    return {
         'player1_hp': {
             'king': battle.player1_king_hp,
             'left': battle.player1_left_hp,
@@ -240,22 +431,46 @@ async def handle_tower_damage(battle_id: str, player_id: str, damage_data: Dict,
         },
         'player1_crowns': battle.player1_crowns,
         'player2_crowns': battle.player2_crowns,
-    })
+    }
 
-    return True
 
+async def _flush_state_later(battle: Battle, ws_manager):
+    """Send the coalesced delta once the flush window has passed"""
+    await asyncio.sleep(STATE_FLUSH_WINDOW)
+    battle.flush_scheduled = False
+    if battle.status == 'active':
+        await _flush_state(battle, ws_manager)
 
-def _calculate_crowns(king_hp: int, left_hp: int, right_hp: int) -> int:
-    """Calculate crowns based on tower HP"""
-    crowns = 0
-    if king_hp <= 0:
-        crowns = 3  # King tower = instant 3 crowns
-    else:
-        if left_hp <= 0:
-            crowns += 1
-        if right_hp <= 0:
-            crowns += 1
-    return crowns
+
+async def _flush_state(battle: Battle, ws_manager):
+    """Broadcast pending state changes as a battle_delta frame"""
+    if not battle.pending_state:
+        return
+    changes = battle.pending_state
+    battle.pending_state = {}
+    battle.state_seq += 1
+    keyframe_due.add(battle.id)
+    if spectators.is_watched(battle.id):
+        spectators.record_state(battle.id, _full_state(battle))
+    await ws_manager.broadcast_channel(f"battle:{battle.id}", 'battle_delta', {
+        'battle_id': battle.id,
+        'seq': battle.state_seq,
+        'changes': changes,
+    })
+
+
+async def _send_keyframe(battle: Battle, ws_manager):
+    """Broadcast the full battle state (supersedes any pending delta)"""
+    battle.pending_state = {}
+    battle.state_seq += 1
+    battle.last_keyframe = time.time()
+    keyframe_due.discard(battle.id)
+    await ws_manager.broadcast_channel(f"battle:{battle.id}", 'battle_state', {
+        'battle_id': battle.id,
+        'seq': battle.state_seq,
+        'keyframe': True,
+        **_full_state(battle),
+    })
 
 
 async def end_battle(battle_id: str, ws_manager, timeout: bool = False) -> Optional[Dict]:
@@ -270,6 +485,7 @@ async def end_battle(battle_id: str, ws_manager, timeout: bool = False) -> Optio
 
     battle.status = 'finished'
     battle.end_time = time.time()
+    _unindex_battle(battle)
 
     # Determine winner
     if battle.player1_crowns > battle.player2_crowns:
@@ -287,68 +503,35 @@ async def end_battle(battle_id: str, ws_manager, timeout: bool = False) -> Optio
         else:
             battle.winner_id = None  # True tie
 
-    # Calculate rewards and ELO changes
-    from services.matchmaking_service import matchmaking
+    # Calculate rewards and hand the result to the persistence pipeline
+    from services.battle_results import battle_results, compute_battle_result
 
-    winner_crowns = max(battle.player1_crowns, battle.player2_crowns)
-
-    if battle.winner_id == battle.player1_id:
-        new_p1_elo, new_p2_elo = matchmaking.calculate_elo_change(
-            battle.player1_elo, battle.player2_elo, winner_crowns
-        )
-        p1_trophy_change = 30 + winner_crowns * 5
-        p2_trophy_change = -20
-    elif battle.winner_id == battle.player2_id:
-        new_p2_elo, new_p1_elo = matchmaking.calculate_elo_change(
-            battle.player2_elo, battle.player1_elo, winner_crowns
-        )
-        p1_trophy_change = -20
-        p2_trophy_change = 30 + winner_crowns * 5
-    else:
-        # Tie - small trophy loss for both, no ELO change
-        new_p1_elo = battle.player1_elo
-        new_p2_elo = battle.player2_elo
-        p1_trophy_change = -5
-        p2_trophy_change = -5
-
-    result = {
-        'battle_id': battle_id,
+    battle_result = compute_battle_result(
+        battle, timeout, replay=battle.replay.encode() if len(battle.replay) else None
+    )
+    battle.result_reported = battle_results.submit(battle_result)
+    result = battle_result.to_dict()
+
+    # Latency the players actually had, to judge the matchmaking RTT policy
+    from services.matchmaking_service import matchmaking
+    matchmaking.record_battle_latency(battle.mode, [ws_manager.get_rtt(player_id) for player_id in battle.participants])
+    spectators.record_result(battle_id, {
         'winner_id': battle.winner_id,
         'player1_crowns': battle.player1_crowns,
         'player2_crowns': battle.player2_crowns,
         'timeout': timeout,
-        'player1_result': {
-            'won': battle.winner_id == battle.player1_id,
-            'trophy_change': p1_trophy_change,
-            'new_elo': new_p1_elo,
-            'crowns': battle.player1_crowns,
-            'gold_earned': 50 + battle.player1_crowns * 20 if battle.winner_id == battle.player1_id else 10,
-        },
-        'player2_result': {
-            'won': battle.winner_id == battle.player2_id,
-            'trophy_change': p2_trophy_change,
-            'new_elo': new_p2_elo,
-            'crowns': battle.player2_crowns,
-            'gold_earned': 50 + battle.player2_crowns * 20 if battle.winner_id == battle.player2_id else 10,
-        }
-    }
-
-    # Notify both players
-    await ws_manager.send_to_player(battle.player1_id, 'battle_result', {
-        **result,
-        'your_result': result['player1_result'],
-    })
-    await ws_manager.send_to_player(battle.player2_id, 'battle_result', {
-        **result,
-        'your_result': result['player2_result'],
     })
 
-    # Unsubscribe from battle channel
-    await ws_manager.unsubscribe(battle.player1_id, f"battle:{battle_id}")
-    await ws_manager.unsubscribe(battle.player2_id, f"battle:{battle_id}")
+    # Notify every player of their own result
+    for player_result in battle_result.players:
+        await ws_manager.send_to_player(player_result.player_id, 'battle_result', {
+            **result,
+            'your_result': player_result.to_dict(),
+        })
 
-    # Save stats to database
-    await save_battle_stats(battle_id, ws_manager)
+    # Unsubscribe from battle channel
+    for player_id in battle.participants:
+        await ws_manager.unsubscribe(player_id, f"battle:{battle_id}")
 
     # Clean up after 30 seconds (in case of reconnects)
     asyncio.create_task(_cleanup_battle(battle_id))
@@ -362,33 +545,46 @@ async def _cleanup_battle(battle_id: str):
     """Clean up battle data after delay"""
     await asyncio.sleep(30)
     if battle_id in active_battles:
-        del active_battles[battle_id]
+        battle = active_battles.pop(battle_id)
+        _unindex_battle(battle)
+        keyframe_due.discard(battle_id)
+        awaiting_reconnect.discard(battle_id)
+        battle_table.release(battle.slot)
 
 
 async def battle_timer_loop(ws_manager):
     """Background task to check for battle timeouts"""
+    last_tick = time.time()
     while True:
         try:
             current_time = time.time()
 
-            for battle_id, battle in list(active_battles.items()):
-                if battle.status == 'active':
-                    elapsed = current_time - battle.start_time
-                    remaining = battle.duration - elapsed
-
-                    # Time up
-                    if remaining <= 0:
-                        await end_battle(battle_id, ws_manager, timeout=True)
-                    # 30 second warning
-                    elif remaining <= 30 and remaining > 29:
-                        await ws_manager.broadcast_channel(f"battle:{battle_id}", 'time_warning', {
-                            'remaining': 30
-                        })
-                    # 10 second warning
-                    elif remaining <= 10 and remaining > 9:
-                        await ws_manager.broadcast_channel(f"battle:{battle_id}", 'time_warning', {
-                            'remaining': 10
-                        })
+            # Vectorized passes over every active battle in the table
+            battle_table.regen_elixir(current_time - last_tick)
+            last_tick = current_time
+
+            # Time up
+            for slot in battle_table.expired(current_time):
+                await end_battle(battle_table.owners[slot], ws_manager, timeout=True)
+
+            # 30 and 10 second warnings
+            for seconds in (30, 10):
+                for slot in battle_table.entering_window(current_time, seconds):
+                    await ws_manager.broadcast_channel(f"battle:{battle_table.owners[slot]}", 'time_warning', {
+                        'remaining': seconds
+                    })
+
+            # Forfeit players whose reconnect window ran out
+            for battle_id in list(awaiting_reconnect):
+                await _check_reconnect_deadline(battle_id, current_time, ws_manager)
+
+            # Periodic full state so clients recover from any missed delta
+            for battle_id in list(keyframe_due):
+                battle = active_battles.get(battle_id)
+                if not battle or battle.status != 'active':
+                    keyframe_due.discard(battle_id)
+                elif current_time - battle.last_keyframe >= KEYFRAME_INTERVAL:
+                    await _send_keyframe(battle, ws_manager)
 
         except Exception as e:
             print(f"Battle timer error: {e}")
@@ -403,89 +599,125 @@ def get_battle(battle_id: str) -> Optional[Battle]:
 
 def get_player_battle(player_id: str) -> Optional[Battle]:
     """Get the active battle for a player"""
-    for battle in active_battles.values():
-        if battle.status in ['waiting', 'active']:
-            if player_id in [battle.player1_id, battle.player2_id]:
-                return battle
+    battle_id = player_battles.get(player_id)
+    if battle_id is None:
+        return None
+    battle = active_battles.get(battle_id)
+    if battle and battle.status in ['waiting', 'active']:
+        return battle
     return None
 
 
+def is_player_in_battle(player_id: str) -> bool:
+    """Check if a player is busy in a waiting or active battle"""
+    return get_player_battle(player_id) is not None
+
+
 async def handle_player_disconnect(player_id: str, ws_manager):
-    """Handle when a player disconnects during a battle"""
+    """Handle when a player disconnects during a battle (they get a window to rejoin)"""
     battle = get_player_battle(player_id)
     if not battle:
         return
 
-    # Give the win to the remaining player
-    if player_id == battle.player1_id:
-        battle.player2_crowns = 3
-        battle.winner_id = battle.player2_id
-    else:
-        battle.player1_crowns = 3
-        battle.winner_id = battle.player1_id
+    battle.disconnected[player_id] = time.time() + RECONNECT_GRACE
+    awaiting_reconnect.add(battle.id)
+
+    await ws_manager.broadcast_channel(f"battle:{battle.id}", 'opponent_disconnected', {
+        'battle_id': battle.id,
+        'player_id': player_id,
+        'grace': RECONNECT_GRACE,
+    }, exclude=player_id)
 
     print(f"Player {player_id} disconnected from battle {battle.id}")
-    await end_battle(battle.id, ws_manager)
 
 
-async def save_battle_stats(battle_id: str, ws_manager):
-    """Save battle results to player profiles in database"""
-    if battle_id not in active_battles:
+async def _check_reconnect_deadline(battle_id: str, now: float, ws_manager):
+    """Give the win to the opponent of a player who didn't rejoin in time"""
+    battle = active_battles.get(battle_id)
+    if not battle or battle.status == 'finished' or not battle.disconnected:
+        awaiting_reconnect.discard(battle_id)
         return
 
-    battle = active_battles[battle_id]
-    if battle.result_reported:
+    for player_id, deadline in list(battle.disconnected.items()):
+        if deadline > now:
+            continue
+        del battle.disconnected[player_id]
+        battle.abandoned.add(player_id)
+
+        # A side only forfeits once none of its players are left
+        side = battle.side(player_id)
+        if not battle.abandoned.issuperset(battle.team(side)):
+            print(f"Player {player_id} left battle {battle_id} (teammate plays on)")
+            continue
+
+        awaiting_reconnect.discard(battle_id)
+        if side == 'player1':
+            battle.player2_crowns = 3
+            battle.winner_id = battle.player2_id
+        else:
+            battle.player1_crowns = 3
+            battle.winner_id = battle.player1_id
+
+        print(f"Player {player_id} forfeited battle {battle_id} (did not reconnect)")
+        await end_battle(battle_id, ws_manager)
         return
 
-    battle.result_reported = True
-
-    from database import json_db as db
-
-    # Determine trophy and stat changes
-    if battle.winner_id == battle.player1_id:
-        p1_won = True
-        p1_trophy_change = 30 + battle.player1_crowns * 5
-        p2_trophy_change = -20
-        p1_gold = 50 + battle.player1_crowns * 20
-        p2_gold = 10
-    elif battle.winner_id == battle.player2_id:
-        p1_won = False
-        p1_trophy_change = -20
-        p2_trophy_change = 30 + battle.player2_crowns * 5
-        p1_gold = 10
-        p2_gold = 50 + battle.player2_crowns * 20
-    else:
-        # Tie
-        p1_won = None
-        p1_trophy_change = -5
-        p2_trophy_change = -5
-        p1_gold = 15
-        p2_gold = 15
-
-    # Update player 1
-    player1 = await db.get_player(battle.player1_id)
-    if player1:
-        if 'stats' not in player1:
-            player1['stats'] = {}
-        stats = player1['stats']
-        stats['trophies'] = max(0, stats.get('trophies', 0) + p1_trophy_change)
-        stats['wins'] = stats.get('wins', 0) + (1 if p1_won == True else 0)
-        stats['losses'] = stats.get('losses', 0) + (1 if p1_won == False else 0)
-        stats['crowns'] = stats.get('crowns', 0) + battle.player1_crowns
-        player1['gold'] = player1.get('gold', 0) + p1_gold
-        await db.save_player(player1)
-
-    # Update player 2
-    player2 = await db.get_player(battle.player2_id)
-    if player2:
-        if 'stats' not in player2:
-            player2['stats'] = {}
-        stats = player2['stats']
-        stats['trophies'] = max(0, stats.get('trophies', 0) + p2_trophy_change)
-        stats['wins'] = stats.get('wins', 0) + (1 if p1_won == False else 0)
-        stats['losses'] = stats.get('losses', 0) + (1 if p1_won == True else 0)
-        stats['crowns'] = stats.get('crowns', 0) + battle.player2_crowns
-        player2['gold'] = player2.get('gold', 0) + p2_gold
-        await db.save_player(player2)
-
-    print(f"Battle stats saved for battle {battle_id}")
+    if not battle.disconnected:
+        awaiting_reconnect.discard(battle_id)
+
+
+def spectate_battle(battle_id: str, player_id: str) -> Optional[str]:
+    """Add a spectator to a battle (returns an error message on failure)"""
+    battle = active_battles.get(battle_id)
+    if not battle or battle.status == 'finished':
+        return 'Battle not found'
+    if is_player_in_battle(player_id):
+        return 'Cannot spectate while in a battle'
+    return spectators.add_spectator(battle, player_id, _full_state(battle))
+
+
+def build_snapshot(battle: Battle, action_tail: int = SNAPSHOT_ACTION_TAIL) -> Dict:
+    """Full battle state plus the most recent actions, for a rejoining client"""
+    elapsed = time.time() - battle.start_time if battle.status == 'active' else 0
+    return {
+        'battle_id': battle.id,
+        'mode': battle.mode,
+        'status': battle.status,
+        'seq': battle.state_seq,
+        'duration': battle.duration,
+        'elapsed': elapsed,
+        'remaining': max(0, battle.duration - elapsed),
+        'elixir_rate': battle.elixir_rate,
+        'player1_elixir': battle.player1_elixir,
+        'player2_elixir': battle.player2_elixir,
+        **_full_state(battle),
+        'actions': battle.replay.to_actions(max(0, len(battle.replay) - action_tail), battle.participants),
+    }
+
+
+async def rejoin_battle(player_id: str, ws_manager) -> bool:
+    """Put a reconnecting player back into their battle and send them a snapshot"""
+    battle = get_player_battle(player_id)
+    if not battle:
+        return False
+
+    battle.disconnected.pop(player_id, None)
+    battle.abandoned.discard(player_id)
+    if not battle.disconnected:
+        awaiting_reconnect.discard(battle.id)
+
+    channel = f"battle:{battle.id}"
+    await ws_manager.subscribe(player_id, channel)
+    await ws_manager.send_to_player(player_id, 'battle_snapshot', {
+        **build_snapshot(battle),
+        'you_are': battle.side(player_id),
+        'player1_team': battle.player1_team,
+        'player2_team': battle.player2_team,
+    })
+    await ws_manager.broadcast_channel(channel, 'opponent_reconnected', {
+        'battle_id': battle.id,
+        'player_id': player_id,
+    }, exclude=player_id)
+
+    print(f"Player {player_id} rejoined battle {battle.id}")
+    return True
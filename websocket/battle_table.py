@@ -0,0 +1,151 @@
+"""
+Battle State Table
+Struct-of-arrays storage for per-battle hot state, indexed by battle slot
+"""
+
+from typing import List, Optional, Union
+
+import numpy as np
+
+# Slot status codes
+STATUS_FREE = 0
+STATUS_WAITING = 1
+STATUS_ACTIVE = 2
+STATUS_FINISHED = 3
+STATUS_CODES = {'waiting': STATUS_WAITING, 'active': STATUS_ACTIVE, 'finished': STATUS_FINISHED}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# Tower HP columns: player1 king/left/right, then player2 king/left/right
+HP_COLUMNS = {
+    f'player{p}_{tower}_hp': (p - 1) * 3 + i
+    for p in (1, 2)
+    for i, tower in enumerate(('king', 'left', 'right'))
+}
+KING_HP = 4000
+PRINCESS_HP = 2000
+STARTING_HP = np.array([KING_HP, PRINCESS_HP, PRINCESS_HP] * 2, dtype=np.int32)
+
+STARTING_ELIXIR = 5.0
+MAX_ELIXIR = 10.0
+DEFAULT_DURATION = 180
+DEFAULT_ELIXIR_RATE = 1.0
+
+
+class BattleTable:
+    """Hot battle state in NumPy columns so ticks run across all battles at once"""
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = 0
+        self.hp = np.zeros((0, 6), dtype=np.int32)
+        self.crowns = np.zeros((0, 2), dtype=np.int8)
+        self.elixir = np.zeros((0, 2), dtype=np.float32)
+        self.elixir_rate = np.zeros(0, dtype=np.float32)
+        self.start_time = np.zeros(0, dtype=np.float64)
+        self.duration = np.zeros(0, dtype=np.float32)
+        self.deadline = np.zeros(0, dtype=np.float64)
+        self.status = np.zeros(0, dtype=np.int8)
+        # slot -> battle_id, so vectorized results can be mapped back to battles
+        self.owners: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._grow(capacity)
+
+    def _grow(self, capacity: int):
+        """Resize every column to the new capacity"""
+        old = self.capacity
+        for name in ('hp', 'crowns', 'elixir', 'elixir_rate', 'start_time',
+                     'duration', 'deadline', 'status'):
+            column = getattr(self, name)
+            grown = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.deadline[old:] = np.inf
+        self.owners.extend([None] * (capacity - old))
+        # Hand out low slots first
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def allocate(self, battle_id: str) -> int:
+        """Claim a slot for a new battle and reset it to starting state"""
+        if not self._free:
+            self._grow(max(1024, self.capacity * 2))
+        slot = self._free.pop()
+        self.hp[slot] = STARTING_HP
+        self.crowns[slot] = 0
+        self.elixir[slot] = STARTING_ELIXIR
+        self.elixir_rate[slot] = DEFAULT_ELIXIR_RATE
+        self.start_time[slot] = 0
+        self.duration[slot] = DEFAULT_DURATION
+        self.deadline[slot] = np.inf
+        self.status[slot] = STATUS_WAITING
+        self.owners[slot] = battle_id
+        return slot
+
+    def release(self, slot: int):
+        """Return a slot to the free list"""
+        if self.owners[slot] is None:
+            return
+        self.status[slot] = STATUS_FREE
+        self.deadline[slot] = np.inf
+        self.owners[slot] = None
+        self._free.append(slot)
+
+    def active_count(self) -> int:
+        return int(np.count_nonzero(self.status == STATUS_ACTIVE))
+
+    def set_timing(self, slot: int, start_time: float = None, duration: float = None):
+        """Update start time / duration and keep the deadline column in step"""
+        if start_time is not None:
+            self.start_time[slot] = start_time
+        if duration is not None:
+            self.duration[slot] = duration
+        if self.start_time[slot] > 0:
+            self.deadline[slot] = self.start_time[slot] + self.duration[slot]
+
+    def update_crowns(self, slots: Union[int, np.ndarray, None] = None):
+        """Recalculate crowns from tower HP (king down = 3, else one per princess tower)"""
+        if slots is None:
+            slots = np.flatnonzero(self.status == STATUS_ACTIVE)
+        hp = self.hp[slots]
+        dead = hp <= 0
+        # player1 earns crowns from player2's towers (columns 3-5) and vice versa
+        p1 = np.where(dead[..., 3], 3, dead[..., 4].astype(np.int8) + dead[..., 5])
+        p2 = np.where(dead[..., 0], 3, dead[..., 1].astype(np.int8) + dead[..., 2])
+        self.crowns[slots, 0] = p1
+        self.crowns[slots, 1] = p2
+
+    def regen_elixir(self, dt: float):
+        """Add dt seconds of elixir to every active battle, capped at MAX_ELIXIR"""
+        active = self.status == STATUS_ACTIVE
+        gain = (self.elixir_rate[active] * dt)[:, None]
+        self.elixir[active] = np.minimum(self.elixir[active] + gain, MAX_ELIXIR)
+
+    def expired(self, now: float) -> np.ndarray:
+        """Slots of active battles whose time is up"""
+        return np.flatnonzero((self.status == STATUS_ACTIVE) & (self.deadline <= now))
+
+    def entering_window(self, now: float, seconds: float, tick: float = 1.0) -> np.ndarray:
+        """Slots of active battles whose remaining time just dropped into the last `seconds`"""
+        remaining = self.deadline - now
+        return np.flatnonzero(
+            (self.status == STATUS_ACTIVE) & (remaining <= seconds) & (remaining > seconds - tick)
+        )
+
+
+def table_column(column: str, index: int = None, cast=float) -> property:
+    """Property that reads/writes one battle's value in a BattleTable column"""
+    def getter(self):
+        values = getattr(battle_table, column)
+        return cast(values[self.slot] if index is None else values[self.slot, index])
+
+    def setter(self, value):
+        values = getattr(battle_table, column)
+        if index is None:
+            values[self.slot] = value
+        else:
+            values[self.slot, index] = value
+
+    return property(getter, setter)
+
+
+# Global battle state table
+battle_table = BattleTable()
@@ -5,10 +5,15 @@ Handles WebSocket connections, authentication, and message routing
 
 import json
 import asyncio
+import time
 from typing import Dict, Set, Optional, Callable, Any
 from aiohttp import web, WSMsgType
 from services.auth_service import decode_token
 
+RTT_PING_INTERVAL = 10  # Seconds between RTT pings per connection
+RTT_EWMA_ALPHA = 0.2  # Weight of the newest RTT sample
+
+
 class WebSocketManager:
     def __init__(self):
         # player_id -> WebSocket connection
@@ -19,6 +24,8 @@ class WebSocketManager:
         self.channels: Dict[str, Set[str]] = {}
         # Message handlers: message_type -> handler function
         self.handlers: Dict[str, Callable] = {}
+        # player_id -> smoothed round trip time in ms (from our own ping/pong)
+        self.rtt: Dict[str, float] = {}
 
     def register_handler(self, message_type: str, handler: Callable):
         """Register a handler for a message type"""
@@ -26,7 +33,8 @@ class WebSocketManager:
 
     async def handle_connection(self, request: web.Request) -> web.WebSocketResponse:
         """Handle a new WebSocket connection"""
-        ws = web.WebSocketResponse()
+        # Pings are sent (and answered) by us so we can time the pongs
+        ws = web.WebSocketResponse(autoping=False)
         await ws.prepare(request)
 
         player_id = None
@@ -61,6 +69,12 @@ class WebSocketManager:
                                         'username': payload.get('username')
                                     })
                                     print(f"Player {player_id} connected via WebSocket")
+                                    # Put the player back into a battle they dropped out of
+                                    try:
+                                        from websocket.battle_sync import rejoin_battle
+                                        await rejoin_battle(player_id, self)
+                                    except Exception as e:
+                                        print(f"Error rejoining battle: {e}")
                                     # Broadcast updated online count to all players
                                     await self.broadcast_online_count()
                                 else:
@@ -87,12 +101,19 @@ class WebSocketManager:
                     except json.JSONDecodeError:
                         await self.send(ws, 'error', {'error': 'Invalid JSON'})
 
+                elif msg.type == WSMsgType.PING:
+                    await ws.pong(msg.data)
+
+                elif msg.type == WSMsgType.PONG:
+                    if player_id:
+                        self._record_rtt(player_id, msg.data)
+
                 elif msg.type == WSMsgType.ERROR:
                     print(f'WebSocket error: {ws.exception()}')
 
         finally:
-            # Cleanup on disconnect
-            if player_id:
+            # Cleanup on disconnect (unless the player already reconnected on a new socket)
+            if player_id and self.connections.get(player_id, ws) is ws:
                 await self.disconnect(player_id)
 
         return ws
@@ -107,6 +128,7 @@ class WebSocketManager:
             except Exception:
                 pass
             del self.connections[player_id]
+        self.rtt.pop(player_id, None)
 
         # Unsubscribe from all channels
         if player_id in self.subscriptions:
@@ -115,7 +137,11 @@ class WebSocketManager:
                     self.channels[channel].discard(player_id)
             del self.subscriptions[player_id]
 
-        # Handle battle disconnect (give win to opponent)
+        # Stop spectating
+        from websocket.spectators import spectators
+        spectators.remove_spectator(player_id)
+
+        # Handle battle disconnect (opponent wins if they don't reconnect in time)
         try:
             from websocket.battle_sync import handle_player_disconnect
             await handle_player_disconnect(player_id, self)
@@ -138,6 +164,23 @@ class WebSocketManager:
         except Exception as e:
             print(f"Error sending message: {e}")
 
+    def encode(self, msg_type: str, data: Any) -> str:
+        """Serialize a message once so it can be sent to many players"""
+        return json.dumps({
+            'type': msg_type,
+            'data': data,
+            'timestamp': asyncio.get_event_loop().time()
+        })
+
+    async def send_encoded(self, player_id: str, message: str):
+        """Send an already-serialized message to a specific player"""
+        ws = self.connections.get(player_id)
+        try:
+            if ws is not None and not ws.closed:
+                await ws.send_str(message)
+        except Exception as e:
+            print(f"Error sending message: {e}")
+
     async def send_to_player(self, player_id: str, msg_type: str, data: Any):
         """Send a message to a specific player"""
         if player_id in self.connections:
@@ -161,17 +204,44 @@ class WebSocketManager:
             self.channels[channel].discard(player_id)
 
     async def broadcast_channel(self, channel: str, msg_type: str, data: Any, exclude: str = None):
-        """Broadcast a message to all players in a channel"""
+        """Broadcast a message to all players in a channel (serialized once)"""
         if channel in self.channels:
-            for player_id in self.channels[channel]:
+            message = self.encode(msg_type, data)
+            for player_id in list(self.channels[channel]):
                 if player_id != exclude:
-                    await self.send_to_player(player_id, msg_type, data)
+                    await self.send_encoded(player_id, message)
 
     async def broadcast_all(self, msg_type: str, data: Any, exclude: str = None):
-        """Broadcast a message to all connected players"""
-        for player_id in self.connections:
+        """Broadcast a message to all connected players (serialized once)"""
+        message = self.encode(msg_type, data)
+        for player_id in list(self.connections):
             if player_id != exclude:
-                await self.send_to_player(player_id, msg_type, data)
+                await self.send_encoded(player_id, message)
+
+    def _record_rtt(self, player_id: str, payload: bytes):
+        """Update a player's RTT from a pong echoing our ping's send time"""
+        try:
+            sample = (time.monotonic() - float(payload.decode())) * 1000
+        except (ValueError, UnicodeDecodeError):
+            return
+        if sample < 0:
+            return
+        previous = self.rtt.get(player_id)
+        self.rtt[player_id] = sample if previous is None else previous + RTT_EWMA_ALPHA * (sample - previous)
+
+    def get_rtt(self, player_id: str) -> Optional[float]:
+        """Smoothed round trip time in ms (None until measured)"""
+        return self.rtt.get(player_id)
+
+    async def ping_all(self):
+        """Ping every connection; pongs carry the send time back"""
+        payload = repr(time.monotonic()).encode()
+        for player_id, ws in list(self.connections.items()):
+            try:
+                if not ws.closed:
+                    await ws.ping(payload)
+            except Exception as e:
+                print(f"Error pinging {player_id}: {e}")
 
     def is_online(self, player_id: str) -> bool:
         """Check if a player is online"""
@@ -208,3 +278,14 @@ class WebSocketManager:
 
 # Global WebSocket manager instance
 ws_manager = WebSocketManager()
+
+
+async def rtt_loop():
+    """Background task to measure connection round trip times"""
+    while True:
+        try:
+            await ws_manager.ping_all()
+        except Exception as e:
+            print(f"RTT loop error: {e}")
+
+        await asyncio.sleep(RTT_PING_INTERVAL)
@@ -0,0 +1,180 @@
+"""
+Battle Spectators
+Delayed, down-sampled battle feeds shared by every viewer of a battle
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Set, Optional, Any, Deque, Tuple
+
+SPECTATOR_DELAY = 3.0  # Seconds spectators run behind the live battle
+SPECTATOR_TICK = 0.5  # Seconds between spectator frames
+MAX_SPECTATORS_PER_BATTLE = 100
+MAX_BUFFERED_EVENTS = 500  # Per battle, oldest dropped first
+
+
+class SpectatorFeed:
+    """Buffered events for one battle and the players watching it"""
+
+    def __init__(self, battle_id: str):
+        self.battle_id = battle_id
+        self.viewers: Set[str] = set()
+        # (timestamp, kind, payload) with kind in 'action', 'state', 'result'
+        self.events: Deque[Tuple[float, str, Any]] = deque(maxlen=MAX_BUFFERED_EVENTS)
+        # Viewers waiting for their own delayed snapshot: player_id -> (timestamp, state)
+        self.joining: Dict[str, Tuple[float, Dict]] = {}
+        self.finished = False
+
+
+class SpectatorHub:
+    def __init__(self):
+        self.feeds: Dict[str, SpectatorFeed] = {}
+        # player_id -> battle_id being watched (one battle at a time)
+        self.viewer_battles: Dict[str, str] = {}
+        self.metrics = {
+            'frames_built': 0,
+            'frames_sent': 0,
+            'bytes_sent': 0,
+            'rejected_full': 0,
+            'peak_viewers': 0,
+        }
+
+    def is_watched(self, battle_id: str) -> bool:
+        """Cheap check so unwatched battles skip all spectator work"""
+        return battle_id in self.feeds
+
+    def add_spectator(self, battle, player_id: str, initial_state: Dict) -> Optional[str]:
+        """Start watching a battle (returns an error message on failure)"""
+        feed = self.feeds.get(battle.id)
+        if feed and len(feed.viewers) >= MAX_SPECTATORS_PER_BATTLE:
+            self.metrics['rejected_full'] += 1
+            return 'Spectator limit reached'
+
+        self.remove_spectator(player_id)
+        feed = self.feeds.get(battle.id)  # Leaving may have closed it (re-spectating the same battle)
+        if not feed:
+            feed = SpectatorFeed(battle.id)
+            self.feeds[battle.id] = feed
+        # Each viewer starts from the battle as it is now, shown once the delay has passed
+        feed.viewers.add(player_id)
+        feed.joining[player_id] = (time.time(), initial_state)
+        self.viewer_battles[player_id] = battle.id
+        self.metrics['peak_viewers'] = max(self.metrics['peak_viewers'], len(feed.viewers))
+        return None
+
+    def remove_spectator(self, player_id: str) -> bool:
+        """Stop watching whatever battle the player is spectating"""
+        battle_id = self.viewer_battles.pop(player_id, None)
+        feed = self.feeds.get(battle_id)
+        if not feed:
+            return False
+        feed.viewers.discard(player_id)
+        feed.joining.pop(player_id, None)
+        if not feed.viewers:
+            del self.feeds[battle_id]
+        return True
+
+    def record_action(self, battle_id: str, action: Dict):
+        feed = self.feeds.get(battle_id)
+        if feed:
+            feed.events.append((time.time(), 'action', action))
+
+    def record_state(self, battle_id: str, state: Dict):
+        feed = self.feeds.get(battle_id)
+        if feed:
+            feed.events.append((time.time(), 'state', state))
+
+    def record_result(self, battle_id: str, result: Dict):
+        feed = self.feeds.get(battle_id)
+        if feed:
+            feed.events.append((time.time(), 'result', result))
+            feed.finished = True
+
+    def get_metrics(self) -> Dict:
+        return {
+            **self.metrics,
+            'watched_battles': len(self.feeds),
+            'viewers': len(self.viewer_battles),
+        }
+
+    async def tick(self, ws_manager):
+        """Release events older than the delay as one shared frame per battle"""
+        cutoff = time.time() - SPECTATOR_DELAY
+        for battle_id, feed in list(self.feeds.items()):
+            actions = []
+            state = None
+            state_time = 0.0
+            result = None
+            while feed.events and feed.events[0][0] <= cutoff:
+                timestamp, kind, payload = feed.events.popleft()
+                if kind == 'action':
+                    actions.append((timestamp, payload))
+                elif kind == 'state':
+                    state, state_time = payload, timestamp  # Down-sample: only the latest state per frame
+                else:
+                    result = payload
+
+            # Joining viewers get their snapshot (and what happened after it) in a frame of their own
+            joined = [
+                (player_id, timestamp, snapshot)
+                for player_id, (timestamp, snapshot) in feed.joining.items() if timestamp <= cutoff
+            ]
+            for player_id, timestamp, snapshot in joined:
+                del feed.joining[player_id]
+                if state is not None and state_time > timestamp:
+                    snapshot, timestamp = state, state_time
+                frame = {'battle_id': battle_id, 'delay': SPECTATOR_DELAY, 'state': snapshot}
+                later = [payload for action_time, payload in actions if action_time > timestamp]
+                if later:
+                    frame['actions'] = later
+                if result is not None:
+                    frame['result'] = result
+                await self._send(ws_manager, [player_id], ws_manager.encode('spectate_frame', frame))
+
+            if not actions and state is None and result is None:
+                continue
+
+            frame = {'battle_id': battle_id, 'delay': SPECTATOR_DELAY}
+            if actions:
+                frame['actions'] = [payload for _, payload in actions]
+            if state is not None:
+                frame['state'] = state
+            if result is not None:
+                frame['result'] = result
+
+            # Serialize once, send the same text to every viewer
+            message = ws_manager.encode('spectate_frame', frame)
+            joined_ids = {player_id for player_id, _, _ in joined}
+            await self._send(ws_manager, [p for p in feed.viewers if p not in feed.joining and p not in joined_ids],
+                             message)
+            self._close_if_finished(battle_id, feed, result)
+
+    async def _send(self, ws_manager, player_ids, message: str):
+        self.metrics['frames_built'] += 1
+        for player_id in list(player_ids):
+            await ws_manager.send_encoded(player_id, message)
+            self.metrics['frames_sent'] += 1
+            self.metrics['bytes_sent'] += len(message)
+
+    def _close_if_finished(self, battle_id: str, feed: SpectatorFeed, result: Optional[Dict]):
+        """Drop a feed once its result has been released"""
+        if result is not None and not feed.events:
+            for player_id in feed.viewers:
+                self.viewer_battles.pop(player_id, None)
+            self.feeds.pop(battle_id, None)
+
+
+# Global spectator hub instance
+spectators = SpectatorHub()
+
+
+async def spectator_loop(ws_manager):
+    """Background task to push delayed spectator frames"""
+    while True:
+        try:
+            await spectators.tick(ws_manager)
+        except Exception as e:
+            print(f"Spectator loop error: {e}")
+
+        await asyncio.sleep(SPECTATOR_TICK)